@@ -0,0 +1,152 @@
+import time
+from typing import List, Optional, Collection
+
+from prime_backup.action import Action
+from prime_backup.db.access import DbAccess
+from prime_backup.types.blob_storage_method import BlobStorageMethod
+from prime_backup.types.size_diff import SizeDiff
+from prime_backup.types.units import ByteCount
+from prime_backup.utils import pack_utils, blob_utils, collection_utils
+from prime_backup.utils.pack_utils import PackWriter
+
+_LOOSE_BLOB_BATCH_SIZE = 1000
+
+
+class CompactPacksAction(Action[SizeDiff]):
+	"""
+	Maintains the pack store:
+
+	1. Rewrites the packs whose dead space ratio reaches the pack_compact_threshold.
+	   Dead spaces are left by deleted blobs and chunks, and recompressed blobs and chunks
+	2. Moves the loose direct blobs smaller than the pack_threshold into packs, if pack_loose_blobs is True
+	3. Removes the pack files that are unknown to the database, e.g. leftovers of interrupted writes
+
+	:return: the size diff of the pack store. The moved loose blobs are counted in the "before" size
+	"""
+
+	def __init__(self, *, pack_loose_blobs: bool = True):
+		super().__init__()
+		self.pack_loose_blobs = pack_loose_blobs
+
+	def __compact_pack(self, pack_id: int, excluded_pack_ids: Collection[int]):
+		pack_writer: Optional[PackWriter] = None
+		try:
+			with DbAccess.open_session() as session:
+				if (pack := session.get_pack_opt(pack_id)) is None:
+					return
+				packed_blobs = session.get_packed_blobs_in_pack(pack_id)
+				packed_chunks = session.get_packed_chunks_in_pack(pack_id)
+				if len(packed_blobs) > 0 or len(packed_chunks) > 0:
+					pack_writer = PackWriter(session, self.config.backup.pack_max_size, excluded_pack_ids=excluded_pack_ids)
+					with open(pack_utils.get_pack_path(pack_id), 'rb') as f:
+						def read_data(offset: int, length: int, what: str) -> bytes:
+							f.seek(offset)
+							data = f.read(length)
+							if len(data) != length:
+								raise EOFError('pack {} is truncated, expect {} bytes at offset {} for {}, read {}'.format(
+									pack_id, length, offset, what, len(data),
+								))
+							return data
+
+						for packed_blob in packed_blobs:
+							data = read_data(packed_blob.offset, packed_blob.length, 'blob {}'.format(packed_blob.blob_hash))
+							packed_blob.pack_id, packed_blob.offset = pack_writer.write(data)
+						for chunk in packed_chunks:
+							data = read_data(chunk.pack_offset, chunk.stored_size, 'chunk {}'.format(chunk.hash))
+							chunk.pack_id, chunk.pack_offset = pack_writer.write(data)
+					pack_writer.close()
+				session.delete_pack(pack)
+		except Exception:
+			if pack_writer is not None:
+				pack_writer.rollback()
+			raise
+
+		pack_utils.get_pack_path(pack_id).unlink(missing_ok=True)
+
+	def __pack_loose_blobs(self, blob_hashes: List[str]) -> int:
+		"""
+		:return: the stored size sum of the blobs moved into packs
+		"""
+		moved_hashes: List[str] = []
+		moved_size = 0
+		pack_writer: Optional[PackWriter] = None
+		try:
+			with DbAccess.open_session() as session:
+				pack_writer = PackWriter(session, self.config.backup.pack_max_size)
+				for blob in session.get_blobs(blob_hashes).values():
+					if blob is None or blob.storage_method != BlobStorageMethod.direct.name:
+						continue
+					blob_path = blob_utils.get_blob_path(blob.hash)
+					try:
+						data = blob_path.read_bytes()
+					except OSError as e:
+						self.logger.warning('Read loose blob {} failed, skipped: {}'.format(blob.hash, e))
+						continue
+					if len(data) != blob.stored_size:
+						self.logger.warning('Loose blob {} stored size mismatch, expect {}, found {}, skipped'.format(blob.hash, blob.stored_size, len(data)))
+						continue
+
+					pack_id, offset = pack_writer.write(data)
+					session.create_packed_blob(blob_hash=blob.hash, pack_id=pack_id, offset=offset, length=len(data))
+					blob.storage_method = BlobStorageMethod.packed.name
+					moved_hashes.append(blob.hash)
+					moved_size += len(data)
+				session.update_file_blob_storage_method(moved_hashes, BlobStorageMethod.packed)
+				pack_writer.close()
+		except Exception:
+			if pack_writer is not None:
+				pack_writer.rollback()
+			raise
+
+		for h in moved_hashes:
+			blob_path = blob_utils.get_blob_path(h)
+			try:
+				blob_path.unlink()
+			except OSError as e:
+				self.logger.error('Remove packed loose blob file {!r} failed: {}'.format(blob_path, e))
+		return moved_size
+
+	def __remove_unknown_pack_files(self) -> int:
+		with DbAccess.open_session() as session:
+			known_pack_ids = {pack.id for pack in session.list_packs()}
+
+		cnt = 0
+		for pack_id, pack_path in pack_utils.iterate_pack_files():
+			if pack_id not in known_pack_ids:
+				self.logger.info('Removing unknown pack file {!r}'.format(pack_path.as_posix()))
+				pack_path.unlink(missing_ok=True)
+				cnt += 1
+		return cnt
+
+	def run(self) -> SizeDiff:
+		t = time.time()
+		threshold = self.config.backup.pack_compact_threshold
+		with DbAccess.open_session() as session:
+			before_size = session.get_pack_size_sum()
+			live_sizes = session.get_pack_live_sizes()
+			pack_ids_to_compact = []
+			for pack in session.list_packs():
+				dead_size = pack.size - live_sizes.get(pack.id, 0)
+				if (dead_size > 0 and dead_size >= pack.size * threshold) or pack.id not in live_sizes:
+					pack_ids_to_compact.append(pack.id)
+			loose_blob_hashes = session.get_direct_blob_hashes_smaller_than(self.config.backup.pack_threshold) if self.pack_loose_blobs else []
+
+		pack_utils.prepare_pack_directory()
+		for pack_id in pack_ids_to_compact:
+			self.__compact_pack(pack_id, pack_ids_to_compact)
+
+		for i, view in enumerate(collection_utils.slicing_iterate(loose_blob_hashes, _LOOSE_BLOB_BATCH_SIZE)):
+			self.logger.info('Moving loose blobs into packs {} / {}'.format(min((i + 1) * _LOOSE_BLOB_BATCH_SIZE, len(loose_blob_hashes)), len(loose_blob_hashes)))
+			before_size += self.__pack_loose_blobs(list(view))
+
+		removed_file_cnt = self.__remove_unknown_pack_files()
+
+		with DbAccess.open_session() as session:
+			after_size = session.get_pack_size_sum()
+
+		if len(pack_ids_to_compact) > 0 or len(loose_blob_hashes) > 0 or removed_file_cnt > 0:
+			self.logger.info('Compact packs done, compacted {} packs, packed {} loose blobs, removed {} unknown pack files, size {} -> {}, cost {}s'.format(
+				len(pack_ids_to_compact), len(loose_blob_hashes), removed_file_cnt,
+				ByteCount(before_size).auto_str(), ByteCount(after_size).auto_str(), round(time.time() - t, 2),
+			))
+		return SizeDiff(before_size, after_size)
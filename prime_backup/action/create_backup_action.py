@@ -5,27 +5,37 @@ import enum
 import functools
 import hashlib
 import os
+import queue
 import stat
 import threading
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Tuple, Callable, Any, Dict, Generator, Union, Set, Deque, ContextManager
+from typing import List, Optional, Tuple, Callable, Any, Dict, Generator, Union, Set, Deque, ContextManager, Hashable, TypeVar
 
 import pathspec
 
 from prime_backup.action.create_backup_action_base import CreateBackupActionBase
+from prime_backup.action.train_compress_dict_action import TrainCompressDictAction
+from prime_backup.chunkers import Chunker, FastCdcChunker, AnvilRegionChunker
 from prime_backup.compressors import Compressor, CompressMethod
 from prime_backup.db import schema
 from prime_backup.db.access import DbAccess
+from prime_backup.db.blob_index import BlobIndex
 from prime_backup.db.session import DbSession
 from prime_backup.exceptions import PrimeBackupError, UnsupportedFileFormat
+from prime_backup.types.backup_creation_stats import BackupCreationStats, BackupCreationPhase
 from prime_backup.types.backup_info import BackupInfo
 from prime_backup.types.backup_tags import BackupTags
+from prime_backup.types.blob_storage_method import BlobStorageMethod
 from prime_backup.types.operator import Operator
 from prime_backup.types.units import ByteCount
-from prime_backup.utils import hash_utils, misc_utils, blob_utils, file_utils
-from prime_backup.utils.thread_pool import FailFastThreadPool
+from prime_backup.utils import hash_utils, misc_utils, blob_utils, file_utils, chunk_utils, pack_utils
+from prime_backup.utils.bypass_io import BypassReader
+from prime_backup.utils.change_journal import ChangeJournal
+from prime_backup.utils.pack_utils import PackWriter
+from prime_backup.utils.process_pool import CompressProcessPool
 
 
 class VolatileBlobFile(PrimeBackupError):
@@ -49,15 +59,60 @@ class _BlobCreatePolicy(enum.Enum):
 _BLOB_FILE_CHANGED_RETRY_COUNT = 3
 _READ_ALL_SIZE_THRESHOLD = 8 * 1024  # 8KiB
 _HASH_ONCE_SIZE_THRESHOLD = 10 * 1024 * 1024  # 10MiB
+_MAX_ONGOING_FILE_CREATION = 1000
+_CHUNK_WRITE_BATCH_SIZE = 16 * 1024 * 1024  # 16MiB, raw size of the new chunks to be compressed in a single worker task
+# mtime granularity of the coarsest common file systems, e.g. 2s for FAT. Files modified this close to a scan start are racily clean
+_RACY_MTIME_MARGIN_NS = 2 * 10 ** 9
+_T = TypeVar('_T')
+
+
+class _CreationStatsCollector:
+	"""
+	Collects the :class:`BackupCreationStats` of a backup creation.
+	Phase costs can be added in any thread, other counters should be updated in the session thread only
+	"""
+
+	def __init__(self):
+		self.stats = BackupCreationStats()
+		self.__lock = threading.Lock()
+		self.__start_time = time.time()
+
+	def add_cost(self, phase: BackupCreationPhase, cost: float):
+		with self.__lock:
+			self.stats.phase_costs[phase.name] = self.stats.phase_costs.get(phase.name, 0) + cost
+
+	@contextlib.contextmanager
+	def measure(self, phase: BackupCreationPhase) -> ContextManager[None]:
+		start = time.time()
+		try:
+			yield
+		finally:
+			self.add_cost(phase, time.time() - start)
+
+	def timed(self, phase: BackupCreationPhase, func: Callable[[], _T]) -> Callable[[], _T]:
+		def wrapped() -> _T:
+			with self.measure(phase):
+				return func()
+		return wrapped
+
+	def add_policy(self, policy: _BlobCreatePolicy):
+		self.stats.policy_counts[policy.name] = self.stats.policy_counts.get(policy.name, 0) + 1
+
+	def snapshot(self) -> BackupCreationStats:
+		with self.__lock:
+			stats = dataclasses.replace(self.stats, phase_costs=dict(self.stats.phase_costs), policy_counts=dict(self.stats.policy_counts))
+		stats.total_cost = time.time() - self.__start_time
+		return stats
 
 
 class BatchFetcherBase(ABC):
 	Callback = Callable
 	tasks: dict
 
-	def __init__(self, session: DbSession, max_batch_size: int):
+	def __init__(self, session: DbSession, max_batch_size: int, stats_collector: _CreationStatsCollector):
 		self.session = session
 		self.max_batch_size = max_batch_size
+		self.stats_collector = stats_collector
 		self.first_task_scheduled_time = time.time()
 
 	def _post_query(self):
@@ -68,10 +123,14 @@ class BatchFetcherBase(ABC):
 
 	def flush_if_needed(self):
 		if len(self.tasks) > 0 and (len(self.tasks) >= self.max_batch_size or time.time() - self.first_task_scheduled_time >= 0.1):
-			self._batch_run()
+			self.__measured_batch_run()
 
 	def flush(self):
 		if len(self.tasks) > 0:
+			self.__measured_batch_run()
+
+	def __measured_batch_run(self):
+		with self.stats_collector.measure(BackupCreationPhase.lookup):
 			self._batch_run()
 
 	@abstractmethod
@@ -91,13 +150,19 @@ class BlobBySizeFetcher(BatchFetcherBase):
 	Callback = Callable[[Rsp], Any]
 	tasks: Dict[int, List[Callback]]
 
-	def __init__(self, session: DbSession, max_batch_size: int, result_cache: Dict[int, bool]):
-		super().__init__(session, max_batch_size)
+	def __init__(self, session: DbSession, max_batch_size: int, stats_collector: _CreationStatsCollector, result_cache: Dict[int, bool], blob_index: Optional[BlobIndex]):
+		super().__init__(session, max_batch_size, stats_collector)
 		self.tasks: List[Tuple[int, BlobBySizeFetcher.Callback]] = []
 		self.sizes: Set[int] = set()
 		self.result_cache = result_cache
+		self.blob_index = blob_index
 
 	def query(self, query: Req, callback: Callback):
+		if self.blob_index is not None:
+			# a false positive of the index only makes the hash_once policy unusable, so no need to confirm it
+			self.result_cache[query.size] = exists = self.blob_index.may_have_size(query.size)
+			callback(self.Rsp(exists))
+			return
 		self.tasks.append((query.size, callback))
 		self.sizes.add(query.size)
 		self._post_query()
@@ -124,13 +189,18 @@ class BlobByHashFetcher(BatchFetcherBase):
 	Callback = Callable[[Rsp], Any]
 	tasks: Dict[str, List[Callback]]
 
-	def __init__(self, session: DbSession, max_batch_size: int, result_cache: Dict[str, schema.Blob]):
-		super().__init__(session, max_batch_size)
+	def __init__(self, session: DbSession, max_batch_size: int, stats_collector: _CreationStatsCollector, result_cache: Dict[str, schema.Blob], blob_index: Optional[BlobIndex]):
+		super().__init__(session, max_batch_size, stats_collector)
 		self.tasks: List[Tuple[str, BlobByHashFetcher.Callback]] = []
 		self.hashes: Set[str] = set()
 		self.result_cache = result_cache
+		self.blob_index = blob_index
 
 	def query(self, query: Req, callback: Callback):
+		if self.blob_index is not None and not self.blob_index.may_have_hash(query.hash):
+			self.result_cache[query.hash] = None
+			callback(self.Rsp(None))
+			return
 		self.tasks.append((query.hash, callback))
 		self.hashes.add(query.hash)
 		self._post_query()
@@ -148,9 +218,9 @@ class BlobByHashFetcher(BatchFetcherBase):
 class BatchQueryManager:
 	Reqs = Union[BlobBySizeFetcher.Req, BlobByHashFetcher.Req]
 
-	def __init__(self, session: DbSession, size_result_cache: dict, hash_result_cache: dict, max_batch_size: int = 100):
-		self.fetcher_size = BlobBySizeFetcher(session, max_batch_size, size_result_cache)
-		self.fetcher_hash = BlobByHashFetcher(session, max_batch_size, hash_result_cache)
+	def __init__(self, session: DbSession, stats_collector: _CreationStatsCollector, size_result_cache: dict, hash_result_cache: dict, blob_index: Optional[BlobIndex], max_batch_size: int = 100):
+		self.fetcher_size = BlobBySizeFetcher(session, max_batch_size, stats_collector, size_result_cache, blob_index)
+		self.fetcher_hash = BlobByHashFetcher(session, max_batch_size, stats_collector, hash_result_cache, blob_index)
 
 	def query(self, query: Reqs, callback: callable):
 		if isinstance(query, BlobBySizeFetcher.Req):
@@ -169,6 +239,106 @@ class BatchQueryManager:
 		self.fetcher_hash.flush()
 
 
+class WorkerTaskRunner:
+	"""
+	Runs the CPU / IO heavy works of the blob creation, e.g. hashing and compressing, in a worker thread pool.
+	The callbacks are always invoked in the session thread, inside :meth:`poll`
+
+	If there's only 1 worker, the tasks are executed directly in the session thread
+	"""
+
+	@dataclasses.dataclass(frozen=True)
+	class Req:
+		func: Callable[[], Any]
+
+	Callback = Callable[[Future], Any]
+
+	def __init__(self, max_workers: int):
+		self.__pool: Optional[ThreadPoolExecutor] = None
+		if max_workers > 1:
+			self.__pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=misc_utils.make_thread_name('blob_worker'))
+		self.__pending_futures: Set[Future] = set()
+		self.__done_queue: 'queue.Queue[Tuple[WorkerTaskRunner.Callback, Future]]' = queue.Queue()
+
+	def submit(self, req: Req, callback: Callback):
+		if self.__pool is None:
+			future = Future()
+			try:
+				future.set_result(req.func())
+			except Exception as e:
+				future.set_exception(e)
+			callback(future)
+		else:
+			future = self.__pool.submit(req.func)
+			self.__pending_futures.add(future)
+			future.add_done_callback(lambda f: self.__done_queue.put((callback, f)))
+
+	def has_pending(self) -> bool:
+		return len(self.__pending_futures) > 0
+
+	def poll(self, block: bool):
+		"""
+		Invoke the callbacks of the done tasks
+
+		:param block: if set, wait until at least 1 task is done
+		"""
+		while len(self.__pending_futures) > 0:
+			try:
+				callback, future = self.__done_queue.get(block=block)
+			except queue.Empty:
+				break
+			block = False
+			self.__pending_futures.discard(future)
+			callback(future)
+
+	def shutdown(self):
+		if self.__pool is not None:
+			for future in self.__pending_futures:
+				future.cancel()
+			self.__pool.shutdown(wait=True)
+			self.__pending_futures.clear()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.shutdown()
+
+
+class BlobCreationLockManager:
+	"""
+	Ensures that there's at most 1 generator writing the direct blob file of a given hash at the same time.
+	The owner should check the blob-by-hash cache again after acquiring the lock, since the blob might be created by the previous owner
+	"""
+
+	@dataclasses.dataclass(frozen=True)
+	class Req:
+		hash: str
+
+	Callback = Callable[[None], Any]
+
+	def __init__(self):
+		self.__waiters: Dict[str, Deque[BlobCreationLockManager.Callback]] = {}
+
+	def acquire(self, req: Req, callback: Callback):
+		if (waiters := self.__waiters.get(req.hash)) is None:
+			self.__waiters[req.hash] = collections.deque()
+			callback(None)
+		else:
+			waiters.append(callback)
+
+	def release(self, blob_hash: str):
+		waiters = self.__waiters[blob_hash]
+		if len(waiters) > 0:
+			# hand the lock over to the next waiter directly
+			waiters.popleft()(None)
+		else:
+			self.__waiters.pop(blob_hash)
+
+	def is_locked(self, blob_hash: str) -> bool:
+		return blob_hash in self.__waiters
+
+
 @dataclasses.dataclass(frozen=True)
 class _ScanResultEntry:
 	path: Path  # full path, including source_root
@@ -184,20 +354,78 @@ class _ScanResultEntry:
 		return stat.S_ISLNK(self.stat.st_mode)
 
 
+@dataclasses.dataclass(frozen=True)
+class _ScanNode:
+	entry: _ScanResultEntry
+	rel_path: Path
+	is_root_target: bool
+	journal_reused: bool
+	children: Optional['Future[List[_ScanNode]]']  # None for non-directories
+
+
 @dataclasses.dataclass(frozen=True)
 class _ScanResult:
 	all_files: List[_ScanResultEntry] = dataclasses.field(default_factory=list)
 	root_targets: List[str] = dataclasses.field(default_factory=list)  # list of posix path, related to the source_path
 
 
+def _make_stat_result(file: schema.File) -> os.stat_result:
+	"""
+	Make a stat result from a file recorded in the database. Fields that are not recorded, e.g. st_dev, are zero
+	"""
+	def ns_to_s(ns: Optional[int]) -> float:
+		return (ns or 0) / 1e9
+
+	return os.stat_result((
+		file.mode, 0, 0, 0, file.uid or 0, file.gid or 0, file.blob_raw_size or 0,
+		int(ns_to_s(file.atime_ns)), int(ns_to_s(file.mtime_ns)), int(ns_to_s(file.ctime_ns)),
+		ns_to_s(file.atime_ns), ns_to_s(file.mtime_ns), ns_to_s(file.ctime_ns),
+		file.atime_ns or 0, file.mtime_ns or 0, file.ctime_ns or 0,
+	))
+
+
+@dataclasses.dataclass(frozen=True)
+class _ChunkPiece:
+	offset: int
+	size: int
+	hash: str
+
+
+@dataclasses.dataclass(frozen=True)
+class _CompressedChunk:
+	hash: str
+	compress: CompressMethod
+	raw_size: int
+	stored_size: int
+	data: Optional[bytes]  # the stored data, if the chunk is going to be packed
+	temp_path: Optional[Path]  # the file containing the stored data, if the chunk is going to be stored as a chunk file
+
+
+@dataclasses.dataclass(frozen=True)
+class _ChunkingResult:
+	raw_size: int
+	hash: str
+	stored_size: int
+	chunks: List[Tuple[int, str]]  # (offset, chunk hash), in order
+
+
 @dataclasses.dataclass(frozen=True)
 class _PreCalculationResult:
 	stats: Dict[Path, os.stat_result] = dataclasses.field(default_factory=dict)
-	hashes: Dict[Path, str] = dataclasses.field(default_factory=dict)
+	reused_blobs: Dict[Path, schema.Blob] = dataclasses.field(default_factory=dict)
+	staged_paths: Dict[Path, Path] = dataclasses.field(default_factory=dict)  # source path -> staged copy path
 
 
 class CreateBackupAction(CreateBackupActionBase):
-	def __init__(self, creator: Operator, comment: str, *, tags: Optional[BackupTags] = None, expire_timestamp_ns: Optional[int] = None, source_path: Optional[Path] = None):
+	def __init__(
+			self, creator: Operator, comment: str, *,
+			tags: Optional[BackupTags] = None, expire_timestamp_ns: Optional[int] = None, source_path: Optional[Path] = None,
+			on_staged: Optional[Callable[[], Any]] = None,
+	):
+		"""
+		:param on_staged: in staged snapshot mode, it's invoked once the files to be read are copied to the staging area,
+			i.e. the source files are no longer needed. It's not invoked if the staged snapshot mode is disabled
+		"""
 		super().__init__()
 		if tags is None:
 			tags = BackupTags()
@@ -206,67 +434,173 @@ class CreateBackupAction(CreateBackupActionBase):
 		self.comment = comment
 		self.tags = tags
 		self.expire_timestamp_ns = expire_timestamp_ns
+		self.on_staged = on_staged
 
 		self.__pre_calc_result = _PreCalculationResult()
 		self.__blob_store_st: Optional[os.stat_result] = None
 		self.__blob_store_in_cow_fs: Optional[bool] = None
+		self.__pack_writer: Optional[PackWriter] = None
 
 		self.__batch_query_manager: Optional[BatchQueryManager] = None
+		self.__blob_lock_manager = BlobCreationLockManager()
 		self.__blob_by_size_cache: Dict[int, bool] = {}
 		self.__blob_by_hash_cache: Dict[str, schema.Blob] = {}
+		self.__chunk_by_hash_cache: Dict[str, schema.Chunk] = {}
+		self.__dangling_chunk_hashes: Set[str] = set()  # chunks created in failed blob creation attempts, which might be unused
+		self.__stats_collector = _CreationStatsCollector()
+		self.__prev_backup_files: Optional[List[schema.File]] = None
 
 		self.__source_path: Path = source_path or self.config.source_path
 
-	def __scan_files(self) -> _ScanResult:
+	def __get_scan_key(self) -> Hashable:
+		"""
+		The settings that affect the scan result. The change journal is only usable if they are unchanged
+		"""
+		cb = self.config.backup
+		return self.__source_path, tuple(cb.targets), tuple(cb.ignore_patterns), tuple(cb.ignored_files), cb.follow_target_symlink
+
+	def __get_prev_backup_files(self, session: DbSession, prev_backup: schema.Backup) -> List[schema.File]:
+		# the backup might be a delta backup, so resolve it only once, and only when it's needed
+		if self.__prev_backup_files is None:
+			self.__prev_backup_files = session.get_backup_files(prev_backup)
+		return self.__prev_backup_files
+
+	def __scan_files(self, session: DbSession, journal_snapshot: Optional[ChangeJournal.Snapshot], prev_backup: Optional[schema.Backup]) -> _ScanResult:
+		"""
+		:param journal_snapshot: if it's usable and relative to prev_backup, the clean paths in the snapshot are not scanned,
+			the entries in prev_backup are reused instead
+		"""
 		ignore_patterns = pathspec.GitIgnoreSpec.from_lines(self.config.backup.ignore_patterns)
 		result = _ScanResult()
 		visited_path: Set[Path] = set()  # full path
 		ignored_paths: List[Path] = []   # related path
 
-		def scan(full_path: Path, is_root_target: bool):
+		prev_files: Dict[Path, schema.File] = {}  # full path -> file
+		prev_children: Dict[Path, List[str]] = collections.defaultdict(list)  # full path -> children names
+		if journal_snapshot is not None and journal_snapshot.usable and prev_backup is not None and journal_snapshot.base_backup_id == prev_backup.id:
+			for file in self.__get_prev_backup_files(session, prev_backup):
+				full_path = self.__source_path / file.path
+				prev_files[full_path] = file
+				prev_children[full_path.parent].append(full_path.name)
+		journal_reused_cnt = 0
+
+		# directories are scanned in parallel, since the metadata requests are slow on HDDs and network file systems
+		pool: Optional[ThreadPoolExecutor] = None
+		if (max_workers := self.config.get_effective_concurrency()) > 1:
+			pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=misc_utils.make_thread_name('scanner'))
+
+		def submit(func: Callable, *args) -> Future:
+			if pool is not None:
+				return pool.submit(func, *args)
+			future = Future()
 			try:
-				rel_path = full_path.relative_to(self.__source_path)
-			except ValueError:
-				self.logger.warning("Skipping backup path {!r} cuz it's not inside the source path {!r}".format(str(full_path), str(self.__source_path)))
-				return
+				future.set_result(func(*args))
+			except Exception as e:
+				future.set_exception(e)
+			return future
 
+		def is_ignored(rel_path: Path) -> bool:
 			if ignore_patterns.match_file(rel_path) or self.config.backup.is_file_ignore_by_deprecated_ignored_files(rel_path.name):
 				ignored_paths.append(rel_path)
-				if is_root_target:
-					self.logger.warning('Backup target {!r} is ignored by config'.format(str(rel_path)))
-				return
+				return True
+			return False
 
-			if full_path in visited_path:
-				return
-			visited_path.add(full_path)
+		def get_journal_reused_file(full_path: Path) -> Optional[schema.File]:
+			if (prev_file := prev_files.get(full_path)) is not None and journal_snapshot.is_clean(full_path):
+				return prev_file
+			return None
 
+		def make_node(full_path: Path, rel_path: Path, st: os.stat_result, is_root_target: bool, journal_reused: bool) -> _ScanNode:
+			entry = _ScanResultEntry(full_path, st)
+			children = None
+			if entry.is_dir():
+				children = submit(scan_dir, full_path, rel_path, journal_reused)
+			return _ScanNode(entry, rel_path, is_root_target, journal_reused, children)
+
+		def scan_dir(dir_path: Path, dir_rel_path: Path, journal_reused: bool) -> List[_ScanNode]:
+			children: List[Tuple[str, Optional[os.DirEntry]]]
+			if journal_reused:
+				# the children list of a clean directory is unchanged as well
+				children = [(name, None) for name in prev_children.get(dir_path, [])]
+			else:
+				with os.scandir(dir_path) as it:
+					children = [(dir_entry.name, dir_entry) for dir_entry in it]
+
+			nodes: List[_ScanNode] = []
+			for name, dir_entry in children:
+				full_path, rel_path = dir_path / name, dir_rel_path / name
+				if is_ignored(rel_path):
+					continue
+				if (prev_file := get_journal_reused_file(full_path)) is not None:
+					st = _make_stat_result(prev_file)
+				else:
+					try:
+						st = dir_entry.stat(follow_symlinks=False) if dir_entry is not None else full_path.lstat()
+					except FileNotFoundError:
+						continue
+				nodes.append(make_node(full_path, rel_path, st, False, prev_file is not None))
+			return nodes
+
+		root_nodes: List[_ScanNode] = []
+
+		def scan_root(full_path: Path):
 			try:
-				st = full_path.lstat()
-			except FileNotFoundError:
-				if is_root_target:
-					self.logger.warning('Backup target {!r} does not exist, skipped. full_path: {!r}'.format(str(rel_path), str(full_path)))
+				rel_path = full_path.relative_to(self.__source_path)
+			except ValueError:
+				self.logger.warning("Skipping backup path {!r} cuz it's not inside the source path {!r}".format(str(full_path), str(self.__source_path)))
 				return
 
-			entry = _ScanResultEntry(full_path, st)
-			result.all_files.append(entry)
-			if is_root_target:
-				result.root_targets.append(rel_path.as_posix())
+			if is_ignored(rel_path):
+				self.logger.warning('Backup target {!r} is ignored by config'.format(str(rel_path)))
+				return
 
-			if entry.is_dir():
-				for child in os.listdir(full_path):
-					scan(full_path / child, False)
-			elif is_root_target and entry.is_symlink() and self.config.backup.follow_target_symlink:
+			if (prev_file := get_journal_reused_file(full_path)) is not None:
+				st = _make_stat_result(prev_file)
+			else:
+				try:
+					st = full_path.lstat()
+				except FileNotFoundError:
+					self.logger.warning('Backup target {!r} does not exist, skipped. full_path: {!r}'.format(str(rel_path), str(full_path)))
+					return
+
+			node = make_node(full_path, rel_path, st, True, prev_file is not None)
+			root_nodes.append(node)
+			if node.entry.is_symlink() and self.config.backup.follow_target_symlink:
 				symlink_target = full_path.readlink()
 				symlink_target_full_path = self.__source_path / symlink_target
 				self.logger.info('Following root symlink target {!r} -> {!r} ({!r})'.format(str(rel_path), str(symlink_target), str(symlink_target_full_path)))
-				scan(symlink_target_full_path, True)
+				scan_root(symlink_target_full_path)
 
 		self.logger.debug(f'Scan file done start, targets: {self.config.backup.targets}')
 		start_time = time.time()
 
-		for target in self.config.backup.targets:
-			scan(self.__source_path / target, True)
-
+		try:
+			for target in self.config.backup.targets:
+				scan_root(self.__source_path / target)
+
+			# collect the entries in depth-first order, the same order as a recursive serial scan
+			stack: List[_ScanNode] = list(reversed(root_nodes))
+			while len(stack) > 0:
+				node = stack.pop()
+				if node.entry.path in visited_path:
+					continue
+				visited_path.add(node.entry.path)
+
+				result.all_files.append(node.entry)
+				if node.is_root_target:
+					result.root_targets.append(node.rel_path.as_posix())
+				if node.journal_reused:
+					journal_reused_cnt += 1
+				if node.children is not None:
+					stack.extend(reversed(node.children.result()))
+		finally:
+			if pool is not None:
+				pool.shutdown(wait=True)
+
+		if len(prev_files) > 0:
+			self.logger.info('Change journal: reused {} entries from backup #{}, scanned {} entries'.format(
+				journal_reused_cnt, prev_backup.id, len(result.all_files) - journal_reused_cnt,
+			))
 		self.logger.debug('Scan file done, cost {:.2f}s, count {}, root_targets (len={}): {}, ignored_paths[:100] (len={}): {}'.format(
 			time.time() - start_time, len(result.all_files),
 			len(result.root_targets), result.root_targets,
@@ -280,32 +614,121 @@ class CreateBackupAction(CreateBackupActionBase):
 		for file_entry in scan_result.all_files:
 			stats[file_entry.path] = file_entry.stat
 
-	def __pre_calculate_hash(self, session: DbSession, scan_result: _ScanResult):
-		hashes = self.__pre_calc_result.hashes
-		hashes.clear()
-
-		sizes: Set[int] = set()
+	def __pre_calculate_reused_blobs(self, session: DbSession, scan_result: _ScanResult, backup: schema.Backup, prev_backup: Optional[schema.Backup]):
+		"""
+		Stat-based change detection: if the stat of a file matches the one recorded in the previous backup,
+		the file is considered as unchanged, and the blob of the previous file will be reused without reading the file
+		"""
+		reused_blobs = self.__pre_calc_result.reused_blobs
+		reused_blobs.clear()
+
+		if prev_backup is None:
+			return
+		rehash_interval = self.config.backup.stat_change_detection_rehash_interval
+		if rehash_interval > 0 and backup.id % rehash_interval == 0:
+			self.logger.info('Backup #{} is a full re-hash backup (interval {}), stat-based change detection skipped'.format(backup.id, rehash_interval))
+			return
+
+		if prev_backup.scan_timestamp is None:
+			self.logger.info('Scan start time of backup #{} is unknown, stat-based change detection skipped'.format(prev_backup.id))
+			return
+
+		# Racily clean: a file might be modified after it got scanned in the previous backup, within the same mtime tick.
+		# Its stat is unchanged, but the content stored in the previous backup might not be the latest one.
+		# The stats are taken after the scan starts, so any file with mtime close to or after the scan start is re-hashed
+		racy_mtime_ns = prev_backup.scan_timestamp - _RACY_MTIME_MARGIN_NS
+		prev_files: Dict[str, schema.File] = {file.path: file for file in self.__get_prev_backup_files(session, prev_backup)}
+		reused_hashes: Dict[Path, str] = {}
+		racy_cnt = 0
 		for file_entry in scan_result.all_files:
-			if file_entry.is_file():
-				sizes.add(file_entry.stat.st_size)
-
-		hash_dict_lock = threading.Lock()
-		existence = session.has_blob_with_size_batched(list(sizes))
-		self.__blob_by_size_cache.update(existence)
-
-		def hash_worker(pth: Path):
-			h = hash_utils.calc_file_hash(pth)
-			with hash_dict_lock:
-				hashes[pth] = h
-
-		with FailFastThreadPool(name='hasher') as pool:
-			for file_entry in scan_result.all_files:
-				if file_entry.is_file():
-					if existence[file_entry.stat.st_size]:
-						# we need to hash the file, sooner or later
-						pool.submit(hash_worker, file_entry.path)
-					else:
-						pass  # will use hash_once policy
+			if not file_entry.is_file():
+				continue
+			file = prev_files.get(file_entry.path.relative_to(self.__source_path).as_posix())
+			st = file_entry.stat
+			if (
+					file is not None
+					and file.blob_hash is not None
+					and file.mode == st.st_mode
+					and file.blob_raw_size == st.st_size
+					and file.mtime_ns == st.st_mtime_ns
+					and file.ctime_ns == st.st_ctime_ns
+			):
+				if file.mtime_ns < racy_mtime_ns:
+					reused_hashes[file_entry.path] = file.blob_hash
+				else:
+					racy_cnt += 1
+
+		blobs = session.get_blobs(list(set(reused_hashes.values())))
+		for path, h in reused_hashes.items():
+			if (blob := blobs[h]) is not None:
+				reused_blobs[path] = blob
+				self.__blob_by_hash_cache[h] = blob
+				self.__blob_by_size_cache[blob.raw_size] = True
+
+		self.logger.info('Stat-based change detection: found {} unchanged files out of {} files from backup #{}, {} racily clean files will be re-hashed'.format(
+			len(reused_blobs), len(scan_result.all_files), prev_backup.id, racy_cnt,
+		))
+
+	@functools.cached_property
+	def __staging_path(self) -> Path:
+		return self.config.temp_path / f'staging_{os.getpid()}'
+
+	def __stage_files(self, scan_result: _ScanResult):
+		"""
+		Staged snapshot mode: copy the files to be read into the staging area, so the source files can be released
+		before the slow hashing and compressing. Files whose blobs are reused are not copied
+		"""
+		t = time.time()
+		pre_calc_result = self.__pre_calc_result
+		paths = [entry.path for entry in scan_result.all_files if entry.is_file() and entry.path not in pre_calc_result.reused_blobs]
+
+		def stage(path: Path) -> Optional[Tuple[Path, os.stat_result]]:
+			staged_path = self.__staging_path / path.relative_to(self.__source_path)
+			staged_path.parent.mkdir(parents=True, exist_ok=True)
+			for _ in range(_BLOB_FILE_CHANGED_RETRY_COUNT):
+				try:
+					st_before = path.lstat()
+					file_utils.copy_file_fast(path, staged_path)
+					st_after = path.lstat()
+				except FileNotFoundError:
+					break
+				if st_before.st_size == st_after.st_size and st_before.st_mtime_ns == st_after.st_mtime_ns and staged_path.stat().st_size == st_after.st_size:
+					return staged_path, st_after
+
+			staged_path.unlink(missing_ok=True)
+			return None
+
+		staged_size = 0
+
+		def add_staged(path_: Path, staged_path_: Path, st: os.stat_result):
+			nonlocal staged_size
+			pre_calc_result.staged_paths[path_] = staged_path_
+			pre_calc_result.stats[path_] = st
+			staged_size += st.st_size
+
+		unstable_paths: List[Path] = []
+		max_workers = self.config.get_effective_concurrency()
+		with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=misc_utils.make_thread_name('stager')) as pool:
+			for path, ret in zip(paths, pool.map(stage, paths)):
+				if ret is not None:
+					add_staged(path, *ret)
+				else:
+					unstable_paths.append(path)
+
+		# retry the files that kept changing during the copying, once the other copies are done.
+		# The source files are still held at this point, so it's the last chance to get a consistent copy
+		for path in unstable_paths:
+			if (ret := stage(path)) is not None:
+				add_staged(path, *ret)
+			elif os.path.lexists(path):
+				self.logger.warning('Unable to get a stable copy of file {!r} for staging, it will be read from the source after the source files are released'.format(path.as_posix()))
+
+		self.__stats_collector.stats.bytes_read += staged_size
+		self.__stats_collector.stats.bytes_written += staged_size
+
+		self.logger.info('Staged {} / {} files (size {}) in {}s, source files are released'.format(
+			len(pre_calc_result.staged_paths), len(paths), ByteCount(staged_size).auto_str(), round(time.time() - t, 2),
+		))
 
 	@functools.cached_property
 	def __temp_path(self) -> Path:
@@ -313,9 +736,212 @@ class CreateBackupAction(CreateBackupActionBase):
 		p.mkdir(parents=True, exist_ok=True)
 		return p
 
+	@functools.cached_property
+	def __cdc_chunker(self) -> Chunker:
+		return FastCdcChunker(self.config.backup.chunking_avg_size)
+
+	@functools.cached_property
+	def __region_chunker(self) -> Chunker:
+		return AnvilRegionChunker()
+
+	def __get_chunker(self, src_path: Path, file_size: int) -> Optional[Chunker]:
+		"""
+		:return: the chunker to split the file with, or None if the file should be stored as a direct blob
+		"""
+		if file_size <= _READ_ALL_SIZE_THRESHOLD:
+			return None
+		if self.config.backup.region_chunking_enabled and AnvilRegionChunker.is_region_file(src_path.name):
+			return self.__region_chunker
+		if self.config.backup.should_use_chunking(file_size):
+			return self.__cdc_chunker
+		return None
+
+	def __probe_compressible(self, compressor: Compressor, src_path: Path, file_size: int) -> bool:
+		"""
+		Compress a sample of the file, to estimate whether the compression of the file is worth it.
+		The sample is taken from the middle of the file, since file headers are usually more compressible than the rest,
+		e.g. the offset table in region files
+		"""
+		sample_size = self.config.backup.compress_probe_sample_size
+		with open(src_path, 'rb') as f:
+			f.seek(max(0, (file_size - sample_size) // 2))
+			sample = f.read(sample_size)
+		if len(sample) == 0:
+			return True
+		ratio = len(compressor.compress_bytes(sample)) / len(sample)
+		return ratio <= self.config.backup.compress_probe_ratio_cutoff
+
+	def __copy_compressed(self, compressor: Compressor, src_path: Path, dst_path: Path, *, calc_hash: bool) -> Compressor.CopyCompressResult:
+		if (pool := self.__compress_process_pool) is not None and pool.should_use(compressor.get_method()):
+			return pool.copy_compressed(compressor.get_method(), src_path, dst_path, calc_hash=calc_hash)
+		return compressor.copy_compressed(src_path, dst_path, calc_hash=calc_hash)
+
+	def __cut_and_hash_chunks(self, chunker: Chunker, src_path: Path) -> Tuple[List[_ChunkPiece], hash_utils.SizeAndHash]:
+		"""
+		:return: a tuple of (the chunk pieces in order, size and hash of the whole file)
+		"""
+		pieces: List[_ChunkPiece] = []
+		with open(src_path, 'rb') as f:
+			reader = BypassReader(f, calc_hash=True)
+			for piece in chunker.cut_stream(reader):
+				pieces.append(_ChunkPiece(piece.offset, len(piece.data), hash_utils.calc_bytes_hash(piece.data)))
+		return pieces, hash_utils.SizeAndHash(reader.get_read_len(), reader.get_hash())
+
+	def __compress_chunks(self, src_path: Path, pieces: List[_ChunkPiece], compress_method_override: Optional[CompressMethod]) -> List[_CompressedChunk]:
+		"""
+		Read the given pieces again, and compress them. The small ones are compressed in memory for the pack writer,
+		and the others are compressed into temp files, which will be moved into the chunk store in the session thread
+		"""
+		results: List[_CompressedChunk] = []
+		temp_paths: List[Path] = []
+		try:
+			with open(src_path, 'rb') as f:
+				for piece in pieces:
+					f.seek(piece.offset)
+					data = f.read(piece.size)
+					if len(data) != piece.size or hash_utils.calc_bytes_hash(data) != piece.hash:
+						self.logger.warning('Chunk at offset {} of file {!r} has changed'.format(piece.offset, src_path.as_posix()))
+						raise _BlobFileChanged()
+
+					compress_method = self.config.backup.get_compress_method_from_size(len(data), compress_method_override=compress_method_override)
+					compressor = Compressor.create(compress_method)
+					if self.__pack_writer is not None and self.config.backup.should_use_pack(len(data)):
+						stored_data = compressor.compress_bytes(data)
+						results.append(_CompressedChunk(piece.hash, compress_method, len(data), len(stored_data), stored_data, None))
+					else:
+						temp_path = self.__temp_path / f'chunk_{os.getpid()}_{threading.current_thread().ident}_{piece.hash}.tmp'
+						temp_paths.append(temp_path)
+						with compressor.open_compressed_bypassed(temp_path) as (writer, f_chunk):
+							f_chunk.write(data)
+						results.append(_CompressedChunk(piece.hash, compress_method, len(data), writer.get_write_len(), None, temp_path))
+		except BaseException:
+			for temp_path in temp_paths:
+				self._remove_file(temp_path, what='temp_file')
+			raise
+		return results
+
+	def __store_compressed_chunk(self, session: DbSession, cc: _CompressedChunk) -> schema.Chunk:
+		pack_id: Optional[int] = None
+		pack_offset: Optional[int] = None
+		if cc.data is not None:
+			pack_id, pack_offset = self.__pack_writer.write(cc.data)
+		else:
+			chunk_path = chunk_utils.get_chunk_path(cc.hash)
+			self._add_remove_file_rollbacker(chunk_path)
+			try:
+				os.replace(cc.temp_path, chunk_path)
+			except OSError:
+				# The temp dir is in the different file system to the chunk store? Use file copy as the fallback
+				file_utils.copy_file_fast(cc.temp_path, chunk_path)
+		return self._create_chunk(
+			session,
+			hash=cc.hash,
+			compress=cc.compress.name,
+			raw_size=cc.raw_size,
+			stored_size=cc.stored_size,
+			pack_id=pack_id,
+			pack_offset=pack_offset,
+		)
+
+	def __create_chunks(
+			self, session: DbSession, chunker: Chunker, src_path: Path, check_changes: Optional[Callable[[int, str], Any]], *,
+			compress_method_override: Optional[CompressMethod] = None,
+	) -> Generator[Any, Any, _ChunkingResult]:
+		"""
+		Split the file into chunks, and store the chunks that do not exist yet
+
+		The file is cut and hashed in a worker thread, then the existing chunks are queried in a batch.
+		The new chunks are read again, verified and compressed in the worker threads,
+		and get stored in the session thread, into the pack files if they are small enough.
+		The new chunks are added to the session right away, so the other blobs being created can reuse them
+		"""
+		stats_collector = self.__stats_collector
+		stats = stats_collector.stats
+
+		cut_func = functools.partial(self.__cut_and_hash_chunks, chunker, src_path)
+		pieces, sah = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.hash, cut_func))).result()
+		stats.bytes_read += sah.size
+		if check_changes is not None:
+			check_changes(sah.size, sah.hash)
+
+		if len(unknown_hashes := list({piece.hash for piece in pieces if piece.hash not in self.__chunk_by_hash_cache})) > 0:
+			with stats_collector.measure(BackupCreationPhase.lookup):
+				for chunk_hash, chunk in session.get_chunks(unknown_hashes).items():
+					if chunk is not None:
+						self.__chunk_by_hash_cache[chunk_hash] = chunk
+
+		new_pieces: Dict[str, _ChunkPiece] = {}
+		for piece in pieces:
+			if piece.hash not in self.__chunk_by_hash_cache and piece.hash not in new_pieces:
+				new_pieces[piece.hash] = piece
+
+		created_hashes: List[str] = []
+		try:
+			batch: List[_ChunkPiece] = []
+			batch_size = 0
+			for i, piece in enumerate(new_pieces.values()):
+				batch.append(piece)
+				batch_size += piece.size
+				if batch_size < _CHUNK_WRITE_BATCH_SIZE and i < len(new_pieces) - 1:
+					continue
+
+				compress_func = functools.partial(self.__compress_chunks, src_path, batch, compress_method_override)
+				compressed_chunks: List[_CompressedChunk] = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.compress_write, compress_func))).result()
+				try:
+					with stats_collector.measure(BackupCreationPhase.compress_write):
+						for cc in compressed_chunks:
+							stats.bytes_read += cc.raw_size
+							if cc.hash in self.__chunk_by_hash_cache:
+								continue  # created by another blob during the compression
+							self.__chunk_by_hash_cache[cc.hash] = self.__store_compressed_chunk(session, cc)
+							created_hashes.append(cc.hash)
+							stats.bytes_written += cc.stored_size
+				finally:
+					for cc in compressed_chunks:
+						if cc.temp_path is not None:
+							self._remove_file(cc.temp_path, what='temp_file')
+				batch, batch_size = [], 0
+		except BaseException:
+			# the chunks are valid, but might not be used by any blob if this attempt fails
+			self.__dangling_chunk_hashes.update(created_hashes)
+			raise
+
+		return _ChunkingResult(
+			raw_size=sah.size,
+			hash=sah.hash,
+			stored_size=sum(self.__chunk_by_hash_cache[piece.hash].stored_size for piece in pieces),
+			chunks=[(piece.offset, piece.hash) for piece in pieces],
+		)
+
+	def __create_chunked_blob(self, session: DbSession, cr: _ChunkingResult) -> schema.Blob:
+		for offset, chunk_hash in cr.chunks:
+			session.create_blob_chunk(blob_hash=cr.hash, offset=offset, chunk_hash=chunk_hash)
+		return self._create_blob(
+			session,
+			hash=cr.hash,
+			storage_method=BlobStorageMethod.chunked.name,
+			compress=CompressMethod.plain.name,
+			raw_size=cr.raw_size,
+			stored_size=cr.stored_size,
+		)
+
+	def __delete_dangling_chunks(self, session: DbSession):
+		"""
+		Delete the chunks that were created in the failed blob creation attempts, but are not used by any blob
+		"""
+		if len(self.__dangling_chunk_hashes) == 0:
+			return
+		session.flush()
+		if len(orphan_hashes := session.filtered_orphan_chunk_hashes(list(self.__dangling_chunk_hashes))) > 0:
+			self.logger.info('Deleting {} unused chunks created by the failed blob creation attempts'.format(len(orphan_hashes)))
+			self._delete_new_chunks(session, [self.__chunk_by_hash_cache.pop(h) for h in orphan_hashes])
+		self.__dangling_chunk_hashes.clear()
+
 	def __get_or_create_blob(self, session: DbSession, src_path: Path, st: os.stat_result) -> Generator[Any, Any, Tuple[schema.Blob, os.stat_result]]:
 		src_path_str = repr(src_path.as_posix())
 		src_path_md5 = hashlib.md5(src_path_str.encode('utf8')).hexdigest()
+		stats_collector = self.__stats_collector
+		stats = stats_collector.stats
 
 		@contextlib.contextmanager
 		def make_temp_file(): # def make_temp_file() -> ContextManager[Path]:
@@ -328,7 +954,12 @@ class CreateBackupAction(CreateBackupActionBase):
 
 		def attempt_once(last_chance: bool = False) -> Generator[Any, Any, schema.Blob]:
 			compress_method: CompressMethod = self.config.backup.get_compress_method_from_size(st.st_size)
+			chunker = self.__get_chunker(src_path, st.st_size)
+			use_chunking = chunker is not None
+			use_pack = not use_chunking and self.__pack_writer is not None and self.config.backup.should_use_pack(st.st_size)
 			can_copy_on_write = (
+					not use_chunking and
+					not use_pack and
 					file_utils.HAS_COPY_FILE_RANGE and
 					compress_method == CompressMethod.plain and
 					self.__blob_store_in_cow_fs and
@@ -340,23 +971,25 @@ class CreateBackupAction(CreateBackupActionBase):
 			blob_content: Optional[bytes] = None
 			raw_size: Optional[int] = None
 			stored_size: Optional[int] = None
-			pre_calc_hash = self.__pre_calc_result.hashes.pop(src_path, None)
+			chunking_result: Optional[_ChunkingResult] = None
+			pack_location: Optional[Tuple[int, int]] = None  # (pack id, offset)
+
+			def read_all() -> Tuple[bytes, str]:
+				with open(src_path, 'rb') as f:
+					content = f.read(_READ_ALL_SIZE_THRESHOLD + 1)
+				if len(content) > _READ_ALL_SIZE_THRESHOLD:
+					self.logger.warning('Read too many bytes for read_all policy, stat: {}, read: {}'.format(st.st_size, len(content)))
+					raise _BlobFileChanged()
+				return content, hash_utils.calc_bytes_hash(content)
 
 			if last_chance:
 				policy = _BlobCreatePolicy.copy_hash
-			elif pre_calc_hash is not None:  # hash already calculated? just use default
-				policy = _BlobCreatePolicy.default
-				blob_hash = pre_calc_hash
 			elif not can_copy_on_write:  # do tricks iff. no COW copy
 				if st.st_size <= _READ_ALL_SIZE_THRESHOLD:
 					policy = _BlobCreatePolicy.read_all
-					with open(src_path, 'rb') as f:
-						blob_content = f.read(_READ_ALL_SIZE_THRESHOLD + 1)
-					if len(blob_content) > _READ_ALL_SIZE_THRESHOLD:
-						self.logger.warning('Read too many bytes for read_all policy, stat: {}, read: {}'.format(st.st_size, len(blob_content)))
-						raise _BlobFileChanged()
-					blob_hash = hash_utils.calc_bytes_hash(blob_content)
-				elif st.st_size > _HASH_ONCE_SIZE_THRESHOLD:
+					blob_content, blob_hash = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.hash, read_all))).result()
+					stats.bytes_read += len(blob_content)
+				elif st.st_size > _HASH_ONCE_SIZE_THRESHOLD or use_chunking:
 					if (exist := self.__blob_by_size_cache.get(st.st_size)) is None:
 						# existence is unknown yet
 						yield BlobBySizeFetcher.Req(st.st_size)
@@ -364,12 +997,14 @@ class CreateBackupAction(CreateBackupActionBase):
 					else:
 						can_hash_once = exist is False
 					if can_hash_once:
-						# it's certain that this blob is unique, but notes: the following code
-						# cannot be interrupted (yield), or other generator could make a same blob
+						# it's certain that this blob does not exist in the database,
+						# but notes: a blob with the same content might still be created by others during the creation
 						policy = _BlobCreatePolicy.hash_once
 			if policy is None:
 				policy = _BlobCreatePolicy.default
-				blob_hash = hash_utils.calc_file_hash(src_path)
+				blob_hash = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.hash, functools.partial(hash_utils.calc_file_hash, src_path)))).result()
+				stats.bytes_read += st.st_size
+			stats_collector.add_policy(policy)
 
 			# self.logger.info("%s %s %s", policy.name, compress_method.name, src_path)
 			if blob_hash is not None:
@@ -381,9 +1016,10 @@ class CreateBackupAction(CreateBackupActionBase):
 				if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
 					return cache
 
-			# notes: the following code cannot be interrupted (yield).
-			# The blob is specifically generated by the generator
-			# if any yield is done, ensure to check __blob_by_hash_cache again
+			# notes: the direct blob file is written in the worker threads, so other generators can run in the meantime.
+			# Writing a direct blob file requires the BlobCreationLockManager lock of the blob hash,
+			# and __blob_by_hash_cache needs to be checked again after each yield.
+			# Chunks are compressed in the worker threads too, see __create_chunks
 
 			def check_changes(new_size: int, new_hash: Optional[str]):
 				if new_size != st.st_size:
@@ -403,78 +1039,188 @@ class CreateBackupAction(CreateBackupActionBase):
 				self._add_remove_file_rollbacker(bp)
 				return bp
 
+			# probe after the existence check, so reused blobs do not cost anything
+			chunk_compress_method_override: Optional[CompressMethod] = None
+			if compress_method != CompressMethod.plain and self.config.backup.should_probe_compressibility(st.st_size):
+				probe_func = functools.partial(self.__probe_compressible, Compressor.create(compress_method), src_path, st.st_size)
+				compressible = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.compress_write, probe_func))).result()
+				stats.bytes_read += min(st.st_size, self.config.backup.compress_probe_sample_size)
+				if compressible:
+					stats.probe_miss += 1
+				else:
+					stats.probe_hit += 1
+					stats.probe_hit_raw_size += st.st_size
+					compress_method = chunk_compress_method_override = CompressMethod.plain
+
 			compressor = Compressor.create(compress_method)
-			if policy == _BlobCreatePolicy.copy_hash:
-				# copy to temp file, calc hash, then compress to blob store
-				misc_utils.assert_true(blob_hash is None, 'blob_hash should not be calculated')
-				with make_temp_file() as temp_file_path:
-					file_utils.copy_file_fast(src_path, temp_file_path)
-					blob_hash = hash_utils.calc_file_hash(temp_file_path)
-
-					misc_utils.assert_true(last_chance, 'only last_chance=True is allowed for the copy_hash policy')
+			locked_hash: Optional[str] = None
+			try:
+				if policy == _BlobCreatePolicy.copy_hash:
+					# copy to temp file, calc hash, then compress to blob store
+					misc_utils.assert_true(blob_hash is None, 'blob_hash should not be calculated')
+					with make_temp_file() as temp_file_path:
+						with stats_collector.measure(BackupCreationPhase.hash):
+							file_utils.copy_file_fast(src_path, temp_file_path)
+							blob_hash = hash_utils.calc_file_hash(temp_file_path)
+						stats.bytes_read += 2 * st.st_size
+						stats.bytes_written += st.st_size
+
+						misc_utils.assert_true(last_chance, 'only last_chance=True is allowed for the copy_hash policy')
+						if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
+							return cache
+						yield BlobByHashFetcher.Req(blob_hash)
+						if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
+							return cache
+
+						if use_chunking:
+							chunking_result = yield from self.__create_chunks(session, chunker, temp_file_path, None, compress_method_override=chunk_compress_method_override)
+							raw_size, stored_size = chunking_result.raw_size, chunking_result.stored_size
+							if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
+								return cache
+						else:
+							yield BlobCreationLockManager.Req(blob_hash)
+							locked_hash = blob_hash
+							if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
+								return cache
+							blob_path = bp_rba(blob_hash)
+							with stats_collector.measure(BackupCreationPhase.compress_write):
+								cr = compressor.copy_compressed(temp_file_path, blob_path, calc_hash=False)
+							raw_size, stored_size = cr.read_size, cr.write_size
+							stats.bytes_read += cr.read_size
+							stats.bytes_written += cr.write_size
+
+				elif use_chunking:
+					# chunk+hash, then read+compress the new chunks to chunk store. For the default policy, the hash is verified
+					misc_utils.assert_true(policy in (_BlobCreatePolicy.hash_once, _BlobCreatePolicy.default), f'unexpected policy {policy} for chunking')
+					chunking_result = yield from self.__create_chunks(session, chunker, src_path, check_changes, compress_method_override=chunk_compress_method_override)
+					raw_size, blob_hash, stored_size = chunking_result.raw_size, chunking_result.hash, chunking_result.stored_size
 					if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
+						# a blob with the same content was created during the chunking
 						return cache
-					yield BlobByHashFetcher.Req(blob_hash)
+
+				elif policy == _BlobCreatePolicy.hash_once:
+					# read once, compress+hash to temp file, then move
+					misc_utils.assert_true(blob_hash is None, 'blob_hash should not be calculated')
+					with make_temp_file() as temp_file_path:
+						copy_func = functools.partial(self.__copy_compressed, compressor, src_path, temp_file_path, calc_hash=True)
+						cr = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.compress_write, copy_func))).result()
+						stats.bytes_read += cr.read_size
+						stats.bytes_written += cr.write_size
+						check_changes(cr.read_size, None)  # the size must be unchanged, to satisfy the uniqueness
+
+						raw_size, blob_hash, stored_size = cr.read_size, cr.read_hash, cr.write_size
+						if (cache := self.__blob_by_hash_cache.get(blob_hash)) is None and self.__blob_lock_manager.is_locked(blob_hash):
+							# someone is writing the same blob
+							yield BlobCreationLockManager.Req(blob_hash)
+							locked_hash = blob_hash
+							cache = self.__blob_by_hash_cache.get(blob_hash)
+						if cache is not None:
+							return cache
+						blob_path = bp_rba(blob_hash)
+
+						# reference: shutil.move, but os.replace is used
+						try:
+							os.replace(temp_file_path, blob_path)
+						except OSError:
+							# The temp dir is in the different file system to the blob store?
+							# Whatever, use file copy as the fallback
+							file_utils.copy_file_fast(temp_file_path, blob_path)
+
+				elif use_pack:
+					# read+compress+hash in memory, then append to the pack file in the session thread
+					misc_utils.assert_true(policy in (_BlobCreatePolicy.read_all, _BlobCreatePolicy.default), f'unexpected policy {policy} for packing')
+					misc_utils.assert_true(blob_hash is not None, 'blob_hash is None')
+					yield BlobCreationLockManager.Req(blob_hash)
+					locked_hash = blob_hash
 					if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
 						return cache
 
-					blob_path = bp_rba(blob_hash)
-					cr = compressor.copy_compressed(temp_file_path, blob_path, calc_hash=False)
-					raw_size, stored_size = cr.read_size, cr.write_size
-
-			elif policy == _BlobCreatePolicy.hash_once:
-				# read once, compress+hash to temp file, then move
-				misc_utils.assert_true(blob_hash is None, 'blob_hash should not be calculated')
-				with make_temp_file() as temp_file_path:
-					cr = compressor.copy_compressed(src_path, temp_file_path, calc_hash=True)
-					check_changes(cr.read_size, None)  # the size must be unchanged, to satisfy the uniqueness
+					def compress_for_pack() -> Tuple[hash_utils.SizeAndHash, bytes]:
+						if blob_content is not None:
+							content, content_hash = blob_content, blob_hash
+						else:
+							with open(src_path, 'rb') as f:
+								content = f.read(st.st_size + 1)
+							content_hash = hash_utils.calc_bytes_hash(content)
+						return hash_utils.SizeAndHash(len(content), content_hash), compressor.compress_bytes(content)
+
+					sah, stored_data = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.compress_write, compress_for_pack))).result()
+					if blob_content is None:
+						stats.bytes_read += sah.size
+					check_changes(sah.size, sah.hash)
+					if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
+						# a chunked blob with the same hash was created during the compression
+						return cache
+					raw_size, stored_size = sah.size, len(stored_data)
+					with stats_collector.measure(BackupCreationPhase.compress_write):
+						pack_location = self.__pack_writer.write(stored_data)
+					stats.bytes_written += stored_size
 
-					raw_size, blob_hash, stored_size = cr.read_size, cr.read_hash, cr.write_size
+				else:
+					misc_utils.assert_true(blob_hash is not None, 'blob_hash is None')
+					yield BlobCreationLockManager.Req(blob_hash)
+					locked_hash = blob_hash
+					if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
+						return cache
 					blob_path = bp_rba(blob_hash)
 
-					# reference: shutil.move, but os.replace is used
-					try:
-						os.replace(temp_file_path, blob_path)
-					except OSError:
-						# The temp dir is in the different file system to the blob store?
-						# Whatever, use file copy as the fallback
-						file_utils.copy_file_fast(temp_file_path, blob_path)
-
-			else:
-				misc_utils.assert_true(blob_hash is not None, 'blob_hash is None')
-				blob_path = bp_rba(blob_hash)
-
-				if policy == _BlobCreatePolicy.read_all:
-					# the file content is already in memory, just write+compress to blob store
-					misc_utils.assert_true(blob_content is not None, 'blob_content is None')
-					with compressor.open_compressed_bypassed(blob_path) as (writer, f):
-						f.write(blob_content)
-					raw_size, stored_size = len(blob_content), writer.get_write_len()
-				elif policy == _BlobCreatePolicy.default:
-					if can_copy_on_write and compress_method == CompressMethod.plain:
-						# fast copy, then calc size and hash to verify
-						file_utils.copy_file_fast(src_path, blob_path)
-						sah = hash_utils.calc_file_size_and_hash(blob_path)
-						raw_size = stored_size = sah.size
-						check_changes(sah.size, sah.hash)
+					if policy == _BlobCreatePolicy.read_all:
+						# the file content is already in memory, just write+compress to blob store
+						misc_utils.assert_true(blob_content is not None, 'blob_content is None')
+
+						def write_content() -> Tuple[int, int]:
+							with compressor.open_compressed_bypassed(blob_path) as (writer, f):
+								f.write(blob_content)
+							return len(blob_content), writer.get_write_len()
+
+						raw_size, stored_size = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.compress_write, write_content))).result()
+						stats.bytes_written += stored_size
+					elif policy == _BlobCreatePolicy.default:
+						if can_copy_on_write and compress_method == CompressMethod.plain:
+							# fast copy, then calc size and hash to verify
+							def copy_and_hash() -> hash_utils.SizeAndHash:
+								file_utils.copy_file_fast(src_path, blob_path)
+								return hash_utils.calc_file_size_and_hash(blob_path)
+
+							sah = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.compress_write, copy_and_hash))).result()
+							raw_size = stored_size = sah.size
+							stats.bytes_read += 2 * sah.size
+							stats.bytes_written += sah.size
+							check_changes(sah.size, sah.hash)
+						else:
+							# copy+compress+hash to blob store
+							copy_func = functools.partial(self.__copy_compressed, compressor, src_path, blob_path, calc_hash=True)
+							cr = (yield WorkerTaskRunner.Req(stats_collector.timed(BackupCreationPhase.compress_write, copy_func))).result()
+							raw_size, stored_size = cr.read_size, cr.write_size
+							stats.bytes_read += cr.read_size
+							stats.bytes_written += cr.write_size
+							check_changes(cr.read_size, cr.read_hash)
 					else:
-						# copy+compress+hash to blob store
-						cr = compressor.copy_compressed(src_path, blob_path, calc_hash=True)
-						raw_size, stored_size = cr.read_size, cr.write_size
-						check_changes(cr.read_size, cr.read_hash)
-				else:
-					raise AssertionError('bad policy {!r}'.format(policy))
-
-			misc_utils.assert_true(blob_hash is not None, f'blob_hash is None, policy {policy}')
-			misc_utils.assert_true(raw_size is not None, f'raw_size is None, policy {policy}')
-			misc_utils.assert_true(stored_size is not None, f'stored_size is None, policy {policy}')
-			return self._create_blob(
-				session,
-				hash=blob_hash,
-				compress=compress_method.name,
-				raw_size=raw_size,
-				stored_size=stored_size,
-			)
+						raise AssertionError('bad policy {!r}'.format(policy))
+
+					if (cache := self.__blob_by_hash_cache.get(blob_hash)) is not None:
+						# a chunked blob with the same hash was created during the writing
+						self._remove_file(blob_path, what='duplicated_blob')
+						return cache
+
+				misc_utils.assert_true(blob_hash is not None, f'blob_hash is None, policy {policy}')
+				misc_utils.assert_true(raw_size is not None, f'raw_size is None, policy {policy}')
+				misc_utils.assert_true(stored_size is not None, f'stored_size is None, policy {policy}')
+				if chunking_result is not None:
+					return self.__create_chunked_blob(session, chunking_result)
+				if pack_location is not None:
+					session.create_packed_blob(blob_hash=blob_hash, pack_id=pack_location[0], offset=pack_location[1], length=stored_size)
+				return self._create_blob(
+					session,
+					hash=blob_hash,
+					storage_method=(BlobStorageMethod.packed if pack_location is not None else BlobStorageMethod.direct).name,
+					compress=compress_method.name,
+					raw_size=raw_size,
+					stored_size=stored_size,
+				)
+			finally:
+				if locked_hash is not None:
+					self.__blob_lock_manager.release(locked_hash)
 
 		for i in range(_BLOB_FILE_CHANGED_RETRY_COUNT):
 			last_attempt = i == _BLOB_FILE_CHANGED_RETRY_COUNT - 1
@@ -488,6 +1234,10 @@ class CreateBackupAction(CreateBackupActionBase):
 					query = gen.send(result)
 			except StopIteration as e:  # ok
 				blob: schema.Blob = e.value
+				if self.__blob_by_hash_cache.get(blob.hash) is None:
+					stats.blob_created += 1
+				else:
+					stats.blob_reused += 1
 				self.__blob_by_size_cache[blob.raw_size] = True
 				self.__blob_by_hash_cache[blob.hash] = blob
 				return blob, st
@@ -509,8 +1259,10 @@ class CreateBackupAction(CreateBackupActionBase):
 
 		blob: Optional[schema.Blob] = None
 		content: Optional[bytes] = None
-		if stat.S_ISREG(st.st_mode):
-			gen = self.__get_or_create_blob(session, path, st)
+		if stat.S_ISREG(st.st_mode) and (blob := self.__pre_calc_result.reused_blobs.pop(path, None)) is not None:
+			self.__stats_collector.stats.blob_reused += 1  # unchanged file, reuse the blob from the previous backup
+		elif stat.S_ISREG(st.st_mode):
+			gen = self.__get_or_create_blob(session, self.__pre_calc_result.staged_paths.pop(path, path), st)
 			try:
 				query = gen.send(None)
 				while True:
@@ -541,24 +1293,130 @@ class CreateBackupAction(CreateBackupActionBase):
 			blob=blob,
 		)
 
+	def get_creation_stats(self) -> BackupCreationStats:
+		return self.__stats_collector.snapshot()
+
+	def __create_files(self, session: DbSession, scan_result: _ScanResult) -> List[schema.File]:
+		self.__compress_process_pool = CompressProcessPool.create_from_config()
+		if self.config.backup.pack_enabled:
+			self.__pack_writer = PackWriter(session, self.config.backup.pack_max_size)
+			self._add_pack_writer_rollbacker(self.__pack_writer)
+		try:
+			files = self.__run_file_creation_pipeline(session, scan_result)
+			self.__delete_dangling_chunks(session)
+			return files
+		finally:
+			if self.__compress_process_pool is not None:
+				self.__compress_process_pool.shutdown()
+				self.__compress_process_pool = None
+			if self.__pack_writer is not None:
+				self.__pack_writer.close()
+				self.__pack_writer = None
+
+	def __run_file_creation_pipeline(self, session: DbSession, scan_result: _ScanResult) -> List[schema.File]:
+		files = []
+		files_to_create: Deque[Path] = collections.deque(file_entry.path for file_entry in scan_result.all_files)
+		schedule_queue: Deque[Tuple[Generator, Any]] = collections.deque()
+		ongoing_cnt = 0
+		worker_cnt = self.config.get_effective_concurrency()
+		if self.__compress_process_pool is not None:
+			# the worker threads mostly wait for the compress processes
+			worker_cnt = max(worker_cnt, self.config.backup.compress_process_pool_size)
+		with WorkerTaskRunner(worker_cnt) as worker_task_runner:
+			def dispatch(q: Any, cb: Callable[[Any], Any]):
+				if isinstance(q, WorkerTaskRunner.Req):
+					worker_task_runner.submit(q, cb)
+				elif isinstance(q, BlobCreationLockManager.Req):
+					self.__blob_lock_manager.acquire(q, cb)
+				else:
+					self.__batch_query_manager.query(q, cb)
+
+			while True:
+				# limit the amount of the ongoing generators, so the memory usage is bounded
+				while len(files_to_create) > 0 and ongoing_cnt < _MAX_ONGOING_FILE_CREATION:
+					schedule_queue.append((self.__create_file(session, files_to_create.popleft()), None))
+					ongoing_cnt += 1
+
+				worker_task_runner.poll(block=False)
+				if len(schedule_queue) == 0:
+					self.__batch_query_manager.flush()
+				if len(schedule_queue) == 0:
+					if worker_task_runner.has_pending():
+						worker_task_runner.poll(block=True)
+						continue
+					break
+
+				gen, value = schedule_queue.popleft()
+				try:
+					def callback(v, g=gen):
+						schedule_queue.appendleft((g, v))
+
+					query = gen.send(value)
+					dispatch(query, callback)
+				except StopIteration as e:
+					files.append(misc_utils.ensure_type(e.value, schema.File))
+					ongoing_cnt -= 1
+
+				self.__batch_query_manager.flush_if_needed()
+
+		misc_utils.assert_true(ongoing_cnt == 0, lambda: f'{ongoing_cnt} file creations are not finished')
+		return files
+
+	def __log_creation_stats(self, stats: BackupCreationStats):
+		self.logger.info('Creation stats: total cost {}s, phase costs: {}'.format(
+			round(stats.total_cost, 2),
+			', '.join('{} {}s'.format(phase.name, round(cost, 2)) for phase in BackupCreationPhase if (cost := stats.get_phase_cost(phase)) is not None),
+		))
+		self.logger.info('Creation stats: {} files, read {}, written {}, blobs reused {}, created {}, policies: {}'.format(
+			stats.file_count, ByteCount(stats.bytes_read).auto_str(), ByteCount(stats.bytes_written).auto_str(),
+			stats.blob_reused, stats.blob_created, ', '.join('{} {}'.format(k, v) for k, v in stats.policy_counts.items()) or 'none',
+		))
+
 	def run(self) -> BackupInfo:
 		super().run()
 		self.__blob_by_size_cache.clear()
 		self.__blob_by_hash_cache.clear()
+		self.__chunk_by_hash_cache.clear()
+		self.__dangling_chunk_hashes.clear()
+		self.__blob_lock_manager = BlobCreationLockManager()
+		self.__stats_collector = stats_collector = _CreationStatsCollector()
+		self.__prev_backup_files = None
+
+		if self.config.backup.compress_dict_enabled:
+			try:
+				TrainCompressDictAction().run()
+			except Exception as e:
+				self.logger.warning('Train compress dictionary failed, the existing dictionary will be used: {}'.format(e))
+
+		journal = ChangeJournal.get_opt()
+		if journal is not None and journal.source_path != self.__source_path:
+			journal = None
+		journal_snapshot: Optional[ChangeJournal.Snapshot] = None
+		scan_key = self.__get_scan_key()
 
 		try:
 			with DbAccess.open_session() as session:
-				self.__batch_query_manager = BatchQueryManager(session, self.__blob_by_size_cache, self.__blob_by_hash_cache)
+				if (blob_index := BlobIndex.get_opt()) is not None:
+					with stats_collector.measure(BackupCreationPhase.lookup):
+						blob_index.sync(session)
+				self.__batch_query_manager = BatchQueryManager(session, stats_collector, self.__blob_by_size_cache, self.__blob_by_hash_cache, blob_index)
 
 				self.logger.info('Scanning file for backup creation at path {!r}, targets: {}'.format(
 					self.__source_path.as_posix(), self.config.backup.targets,
 				))
-				scan_result = self.__scan_files()
+				if journal is not None:
+					journal_snapshot = journal.begin_scan(scan_key)
+				cb = self.config.backup
+				prev_backup = session.get_last_backup_opt() if cb.is_stat_change_detection_enabled() or cb.delta_file_set_enabled or journal_snapshot is not None else None
+				scan_timestamp = time.time_ns()
+				with stats_collector.measure(BackupCreationPhase.scan):
+					scan_result = self.__scan_files(session, journal_snapshot, prev_backup)
 				backup = session.create_backup(
 					creator=str(self.creator),
 					comment=self.comment,
 					targets=scan_result.root_targets,
 					tags=self.tags.to_dict(),
+					scan_timestamp=scan_timestamp,
 				)
 				self.logger.info('Creating backup for {} at path {!r}, file cnt {}, timestamp {!r}, creator {!r}, comment {!r}, tags {!r}'.format(
 					scan_result.root_targets, self.__source_path.as_posix(), len(scan_result.all_files),
@@ -566,43 +1424,71 @@ class CreateBackupAction(CreateBackupActionBase):
 				))
 
 				self.__pre_calculate_stats(scan_result)
-				if self.config.get_effective_concurrency() > 1:
-					self.__pre_calculate_hash(session, scan_result)
-					self.logger.info('Pre-calculate all file hash done')
+				if self.config.backup.is_stat_change_detection_enabled():
+					with stats_collector.measure(BackupCreationPhase.pre_calculate):
+						session.flush()  # generate the backup id
+						self.__pre_calculate_reused_blobs(session, scan_result, backup, prev_backup)
 
 				blob_utils.prepare_blob_directories()
 				bs_path = blob_utils.get_blob_store()
 				self.__blob_store_st = bs_path.stat()
 				self.__blob_store_in_cow_fs = file_utils.does_fs_support_cow(bs_path)
-
-				files = []
-				schedule_queue: Deque[Tuple[Generator, Any]] = collections.deque()
-				for file_entry in scan_result.all_files:
-					schedule_queue.append((self.__create_file(session, file_entry.path), None))
-				while len(schedule_queue) > 0:
-					gen, value = schedule_queue.popleft()
-					try:
-						def callback(v, g=gen):
-							schedule_queue.appendleft((g, v))
-
-						query = gen.send(value)
-						self.__batch_query_manager.query(query, callback)
-					except StopIteration as e:
-						files.append(misc_utils.ensure_type(e.value, schema.File))
-
-					self.__batch_query_manager.flush_if_needed()
-					if len(schedule_queue) == 0:
-						self.__batch_query_manager.flush()
-
-				self._finalize_backup_and_files(session, backup, files)
+				if self.config.backup.chunking_enabled or self.config.backup.region_chunking_enabled:
+					chunk_utils.prepare_chunk_directories()
+				if self.config.backup.pack_enabled:
+					pack_utils.prepare_pack_directory()
+
+				if self.config.backup.staged_snapshot_enabled:
+					file_utils.rm_rf(self.__staging_path, missing_ok=True)
+					with stats_collector.measure(BackupCreationPhase.pre_calculate):
+						self.__stage_files(scan_result)
+					if self.on_staged is not None:
+						self.on_staged()
+
+				files = self.__create_files(session, scan_result)
+				with stats_collector.measure(BackupCreationPhase.db_flush):
+					base_backup, base_files = None, None
+					if cb.delta_file_set_enabled and prev_backup is not None:
+						if (chain_len := len(session.get_backup_chain(prev_backup))) <= cb.delta_file_set_max_chain_length:
+							base_backup, base_files = prev_backup, self.__get_prev_backup_files(session, prev_backup)
+						else:
+							self.logger.info('Backup chain of backup #{} has {} backups, creating a non-delta backup'.format(prev_backup.id, chain_len))
+					self._finalize_backup_and_files(session, backup, files, base_backup=base_backup, base_files=base_files)
+					session.flush()
+
+				# the commit cost is not known yet here, so it's not stored
+				stats_collector.stats.file_count = len(files)
+				backup.creation_stats = stats_collector.snapshot().to_dict()
 				info = BackupInfo.of(backup)
+				commit_start = time.time()
+			stats_collector.add_cost(BackupCreationPhase.db_commit, time.time() - commit_start)
+			self._on_new_blobs_committed()
+
+			if journal_snapshot is not None:
+				journal.end_scan(journal_snapshot, scan_key, info.id)
+				journal_snapshot = None
 
 			s = self.get_new_blobs_summary()
 			self.logger.info('Create backup #{} done, +{} blobs (size {} / {})'.format(
 				info.id, s.count, ByteCount(s.stored_size).auto_str(), ByteCount(s.raw_size).auto_str(),
 			))
+			if self.config.backup.compress_probe_enabled:
+				stats = stats_collector.stats
+				self.logger.info('Compress probe: {} hits (stored without compression, raw size {}), {} misses'.format(
+					stats.probe_hit, ByteCount(stats.probe_hit_raw_size).auto_str(), stats.probe_miss,
+				))
+			if self.config.backup.log_creation_stats:
+				self.__log_creation_stats(stats_collector.snapshot())
 			return info
 
 		except Exception as e:
 			self._apply_blob_rollback()
+			if journal_snapshot is not None:
+				journal.end_scan(journal_snapshot, scan_key, None)
 			raise e
+
+		finally:
+			self.__pre_calc_result.staged_paths.clear()
+			self.__prev_backup_files = None
+			if self.config.backup.staged_snapshot_enabled:
+				file_utils.rm_rf(self.__staging_path, missing_ok=True)
@@ -1,13 +1,18 @@
+import collections
 import functools
 from abc import ABC
 from pathlib import Path
-from typing import List, Callable, Optional
+from typing import List, Callable, Optional, Dict
 
 from prime_backup.action import Action
-from prime_backup.db import schema
+from prime_backup.db import schema, db_constants
+from prime_backup.db.blob_index import BlobIndex
 from prime_backup.db.session import DbSession
 from prime_backup.types.backup_info import BackupInfo
 from prime_backup.types.blob_info import BlobInfo, BlobListSummary
+from prime_backup.types.chunk_info import ChunkInfo
+from prime_backup.utils import chunk_utils
+from prime_backup.utils.pack_utils import PackWriter
 
 
 class CreateBackupActionBase(Action[BackupInfo], ABC):
@@ -15,6 +20,8 @@ class CreateBackupActionBase(Action[BackupInfo], ABC):
 		super().__init__()
 		self.__new_blobs: List[BlobInfo] = []
 		self.__new_blobs_summary: Optional[BlobListSummary] = None
+		self.__new_chunks: List[ChunkInfo] = []
+		self.__blobs_to_insert: List[schema.Blob] = []
 		self.__blobs_rollbackers: List[Callable] = []
 
 	def _remove_file(self, file_to_remove: Path, *, what: str = 'rollback'):
@@ -26,6 +33,9 @@ class CreateBackupActionBase(Action[BackupInfo], ABC):
 	def _add_remove_file_rollbacker(self, file_to_remove: Path):
 		self.__blobs_rollbackers.append(functools.partial(self._remove_file, file_to_remove=file_to_remove))
 
+	def _add_pack_writer_rollbacker(self, pack_writer: PackWriter):
+		self.__blobs_rollbackers.append(pack_writer.rollback)
+
 	def _apply_blob_rollback(self):
 		if len(self.__blobs_rollbackers) > 0:
 			self.logger.warning('Error occurs during backup creation, applying rollback')
@@ -33,36 +43,109 @@ class CreateBackupActionBase(Action[BackupInfo], ABC):
 				rollback_func()
 			self.__blobs_rollbackers.clear()
 
-	def _create_blob(self, session: DbSession, **kwargs) -> schema.Blob:
-		blob = session.create_blob(**kwargs)
+	def _create_blob(self, session: DbSession, *, bulk_insert: bool = False, **kwargs) -> schema.Blob:
+		"""
+		:param bulk_insert: if set, the blob is not added to the session, but bulk inserted in :meth:`_finalize_backup_and_files`.
+			Only use it when the blob will not be queried before that
+		"""
+		blob = session.create_blob(add_to_session=not bulk_insert, **kwargs)
+		if bulk_insert:
+			self.__blobs_to_insert.append(blob)
 		self.__new_blobs.append(BlobInfo.of(blob))
 		return blob
 
+	def _create_chunk(self, session: DbSession, **kwargs) -> schema.Chunk:
+		chunk = session.create_chunk(**kwargs)
+		self.__new_chunks.append(ChunkInfo.of(chunk))
+		return chunk
+
+	def _delete_new_chunks(self, session: DbSession, chunks: List[schema.Chunk]):
+		"""
+		Delete the unused chunks that were created by :meth:`_create_chunk`.
+		Packed chunks leave dead spaces in their pack files, which will be reclaimed by the pack compaction
+		"""
+		hashes = {chunk.hash for chunk in chunks}
+		self.__new_chunks = [chunk for chunk in self.__new_chunks if chunk.hash not in hashes]
+		for chunk in chunks:
+			if chunk.pack_id is None:
+				self._remove_file(chunk_utils.get_chunk_path(chunk.hash), what='unused_chunk')
+			session.expunge(chunk)
+		session.delete_chunks(list(hashes))
+
+	def _on_new_blobs_committed(self):
+		if (blob_index := BlobIndex.get_opt()) is not None:
+			blob_index.on_blobs_created(self.__new_blobs)
+
 	def get_new_blobs_summary(self) -> BlobListSummary:
 		if self.__new_blobs_summary is None:
-			self.__new_blobs_summary = BlobListSummary.of(self.__new_blobs)
+			# chunked blobs do not occupy spaces by themselves, their newly created chunks do
+			direct_blobs = BlobListSummary.of([blob for blob in self.__new_blobs if not blob.is_chunked()])
+			chunked_blobs = BlobListSummary.of([blob for blob in self.__new_blobs if blob.is_chunked()])
+			self.__new_blobs_summary = BlobListSummary(
+				count=direct_blobs.count + chunked_blobs.count,
+				raw_size=direct_blobs.raw_size + chunked_blobs.raw_size,
+				stored_size=direct_blobs.stored_size + sum(chunk.stored_size for chunk in self.__new_chunks),
+			)
 		return self.__new_blobs_summary
 
+	# the file attributes that matter on restore, and the ones used by the stat-based change detection (ctime),
+	# otherwise a ctime-only change is never stored, and the file gets re-hashed in every later backup.
+	# atime changes on every read, so it's not compared, otherwise almost every file differs from the base backup
+	__DELTA_FILE_KEYS = ('mode', 'content', 'blob_hash', 'blob_raw_size', 'uid', 'gid', 'mtime_ns', 'ctime_ns')
+
 	@classmethod
-	def _finalize_backup_and_files(cls, session: DbSession, backup: schema.Backup, files: List[schema.File]):
+	def __is_same_file(cls, a: schema.File, b: schema.File) -> bool:
+		return all(getattr(a, key) == getattr(b, key) for key in cls.__DELTA_FILE_KEYS)
+
+	def _finalize_backup_and_files(self, session: DbSession, backup: schema.Backup, files: List[schema.File], *, base_backup: Optional[schema.Backup] = None, base_files: Optional[List[schema.File]] = None):
+		"""
+		The files should be transient objects. They are inserted in bulk, and will not be added to the session
+
+		:param base_backup: if given, the backup is created as a delta backup of it, and only the files that differ from the base are inserted
+		:param base_files: the effective files of the base backup, see :meth:`DbSession.get_backup_files`
+		"""
 		# flush to generate the backup id
 		session.flush()
+		session.bulk_insert(self.__blobs_to_insert)
+		self.__blobs_to_insert.clear()
+
+		# the transient files only have their path assigned, resolve the path ids in bulk
+		path_ids = session.get_or_create_path_ids([file.path for file in files])
 
 		file_raw_size_sum = 0
 		file_stored_size_sum = 0
 
 		for file in files:
 			file.backup_id = backup.id
+			file.path_id = path_ids[file.path]
 			if file.blob_raw_size is not None:
 				file_raw_size_sum += file.blob_raw_size
 			if file.blob_stored_size is not None:
 				file_stored_size_sum += file.blob_stored_size
-			session.add(file)
 
-		backup.file_raw_size_sum = file_raw_size_sum
-		backup.file_stored_size_sum = file_stored_size_sum
+		if base_backup is not None:
+			if base_files is None:
+				raise ValueError('base_files is required for delta backups')
+			base_files_by_path_id: Dict[int, schema.File] = {file.path_id: file for file in base_files}
+			files_to_insert = []
+			for file in files:
+				base_file = base_files_by_path_id.pop(file.path_id, None)
+				if base_file is None or not self.__is_same_file(file, base_file):
+					files_to_insert.append(file)
+			for path_id in base_files_by_path_id.keys():
+				files_to_insert.append(session.create_file(add_to_session=False, backup_id=backup.id, path_id=path_id, mode=db_constants.DELETED_FILE_MODE))
+			backup.base_backup_id = base_backup.id
+			self.logger.info('Backup #{} is a delta backup based on backup #{}, file rows {} / {}'.format(backup.id, base_backup.id, len(files_to_insert), len(files)))
+		else:
+			files_to_insert = files
+		session.bulk_insert(files_to_insert)
+		session.add_blob_ref_counts(collections.Counter(file.blob_hash for file in files_to_insert if file.blob_hash is not None))
+
+		session.set_backup_file_size_sums(backup, file_raw_size_sum, file_stored_size_sum)
 
 	def run(self) -> None:
 		self.__new_blobs.clear()
 		self.__new_blobs_summary = None
+		self.__new_chunks.clear()
+		self.__blobs_to_insert.clear()
 		self.__blobs_rollbackers.clear()
@@ -1,11 +1,15 @@
+import collections
 import dataclasses
 import logging
 from typing import Optional, List
 
 from prime_backup.action import Action
 from prime_backup.db.access import DbAccess
+from prime_backup.db.blob_index import BlobIndex
+from prime_backup.db.session import DbSession
 from prime_backup.types.backup_info import BackupInfo
 from prime_backup.types.blob_info import BlobInfo, BlobListSummary
+from prime_backup.types.chunk_info import ChunkInfo
 from prime_backup.types.units import ByteCount
 from prime_backup.utils import collection_utils, misc_utils
 
@@ -14,18 +18,34 @@ class BlobTrashBin(List[BlobInfo]):
 	def __init__(self, logger: logging.Logger):
 		super().__init__()
 		self.logger = logger
+		self.chunks: List[ChunkInfo] = []
 		self.errors: List[Exception] = []
 
 	def make_summary(self) -> BlobListSummary:
-		return BlobListSummary.of(self)
+		# chunked blobs do not occupy spaces by themselves, their chunks do
+		s = BlobListSummary.of(self)
+		chunked_stored_size = sum(blob.stored_size for blob in self if blob.is_chunked())
+		chunk_stored_size = sum(chunk.stored_size for chunk in self.chunks)
+		return BlobListSummary(s.count, s.raw_size, s.stored_size - chunked_stored_size + chunk_stored_size)
 
 	def erase_all(self):
 		for trash in self:
+			if trash.is_chunked() or trash.is_packed():
+				# packed blobs leave dead spaces in their pack files, which will be reclaimed by the pack compaction
+				continue
 			try:
 				trash.blob_path.unlink()
 			except Exception as e:
 				self.logger.error('Error erasing blob {} at {!r}'.format(trash.hash, trash.blob_path))
 				self.errors.append(e)
+		for chunk in self.chunks:
+			if chunk.is_packed():
+				continue
+			try:
+				chunk.chunk_path.unlink()
+			except Exception as e:
+				self.logger.error('Error erasing chunk {} at {!r}'.format(chunk.hash, chunk.chunk_path))
+				self.errors.append(e)
 
 
 class DeleteOrphanBlobsAction(Action[BlobListSummary]):
@@ -36,6 +56,27 @@ class DeleteOrphanBlobsAction(Action[BlobListSummary]):
 			self.blob_hash_to_check = collection_utils.deduplicated_list(self.blob_hash_to_check)
 		self.quiet = quiet
 
+	@classmethod
+	def __delete_orphan_blobs(cls, session: DbSession, trash_bin: BlobTrashBin, orphan_blob_hashes: List[str]):
+		orphan_blobs = session.get_blobs(orphan_blob_hashes)
+		blob_infos = [BlobInfo.of(blob) for blob in orphan_blobs.values()]
+		trash_bin.extend(blob_infos)
+		session.delete_blobs(list(orphan_blobs.keys()))
+
+		packed_blob_hashes = [blob.hash for blob in blob_infos if blob.is_packed()]
+		if len(packed_blob_hashes) > 0:
+			session.delete_packed_blobs(packed_blob_hashes)
+
+		# the chunks of the deleted chunked blobs might become orphan too
+		chunked_blob_hashes = [blob.hash for blob in blob_infos if blob.is_chunked()]
+		if len(chunked_blob_hashes) > 0:
+			chunk_hashes = collection_utils.deduplicated_list([bc.chunk_hash for bc in session.get_blob_chunks_by_blob_hashes(chunked_blob_hashes)])
+			session.delete_blob_chunks(chunked_blob_hashes)
+			orphan_chunks = session.get_chunks(session.filtered_orphan_chunk_hashes(chunk_hashes))
+			for chunk in orphan_chunks.values():
+				trash_bin.chunks.append(ChunkInfo.of(chunk))
+			session.delete_chunks(list(orphan_chunks.keys()))
+
 	def run(self) -> BlobListSummary:
 		trash_bin = BlobTrashBin(self.logger)
 
@@ -43,16 +84,14 @@ class DeleteOrphanBlobsAction(Action[BlobListSummary]):
 			self.logger.info('Delete orphan blobs start')
 		with DbAccess.open_session() as session:
 			if self.blob_hash_to_check is None:
-				hashes = session.get_all_blob_hashes()
+				# the orphans are located by the database in batches, to keep the memory usage bounded
+				for orphan_blob_hashes in session.iterate_orphan_blob_hash_batch():
+					self.__delete_orphan_blobs(session, trash_bin, orphan_blob_hashes)
 			else:
-				hashes = self.blob_hash_to_check
-
-			orphan_blob_hashes = session.filtered_orphan_blob_hashes(hashes)
-			orphan_blobs = session.get_blobs(orphan_blob_hashes)
+				self.__delete_orphan_blobs(session, trash_bin, session.filtered_orphan_blob_hashes(self.blob_hash_to_check))
 
-			for blob in orphan_blobs.values():
-				trash_bin.append(BlobInfo.of(blob))
-			session.delete_blobs(list(orphan_blobs.keys()))
+		if (blob_index := BlobIndex.get_opt()) is not None:
+			blob_index.on_blobs_deleted(len(trash_bin))
 
 		s = trash_bin.make_summary()
 		trash_bin.erase_all()
@@ -85,11 +124,19 @@ class DeleteBackupAction(Action[DeleteBackupResult]):
 			backup = session.get_backup(self.backup_id)
 			info = BackupInfo.of(backup)
 
+			# keep the delta backups based on this backup valid
+			if len(rebased_ids := session.rebase_delta_child_backups(backup)) > 0:
+				if backup.base_backup_id is not None:
+					self.logger.info('Rebased delta backups {} onto backup #{}'.format(rebased_ids, backup.base_backup_id))
+				else:
+					self.logger.info('Rebased delta backups {} into non-delta backups'.format(rebased_ids))
+
 			hashes = []
 			for file in backup.files:
 				if file.blob_hash is not None:
 					hashes.append(file.blob_hash)
 				session.delete_file(file)
+			session.add_blob_ref_counts({h: -cnt for h, cnt in collections.Counter(hashes).items()})
 			session.delete_backup(backup)
 
 		orphan_blob_cleaner = DeleteOrphanBlobsAction(hashes, quiet=True)
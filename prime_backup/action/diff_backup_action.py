@@ -28,8 +28,8 @@ class DiffBackupAction(Action[DiffResult]):
 	@classmethod
 	def __get_files_from_backup(cls, session: DbSession, backup_id: int) -> Dict[str, FileInfo]:
 		files = {}
-		for file in session.get_backup(backup_id).files:
-			files[file.path] = FileInfo.of(file)
+		for file in session.get_backup_files(session.get_backup(backup_id)):
+			files[file.path] = FileInfo.of(file, backup_id=backup_id)
 		return files
 
 	def __compare_files(self, a: FileInfo, b: FileInfo) -> bool:
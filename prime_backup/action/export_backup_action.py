@@ -12,7 +12,7 @@ import zipfile
 from abc import abstractmethod, ABC
 from io import BytesIO
 from pathlib import Path
-from typing import ContextManager, Optional, List, Tuple, IO, Any
+from typing import ContextManager, Optional, List, Tuple, IO, Any, Dict, BinaryIO
 
 from prime_backup import constants
 from prime_backup.action import Action
@@ -23,9 +23,12 @@ from prime_backup.db.access import DbAccess
 from prime_backup.db.session import DbSession
 from prime_backup.exceptions import PrimeBackupError, VerificationError
 from prime_backup.types.backup_meta import BackupMeta
+from prime_backup.types.blob_storage_method import BlobStorageMethod
+from prime_backup.types.chunk_info import ChunkInfo
 from prime_backup.types.export_failure import ExportFailures
+from prime_backup.types.packed_blob_info import PackedBlobInfo
 from prime_backup.types.tar_format import TarFormat
-from prime_backup.utils import file_utils, blob_utils, misc_utils, hash_utils, path_utils, platform_utils, collection_utils
+from prime_backup.utils import file_utils, blob_utils, misc_utils, hash_utils, path_utils, platform_utils, collection_utils, chunk_utils
 from prime_backup.utils.bypass_io import BypassReader
 from prime_backup.utils.thread_pool import FailFastThreadPool
 
@@ -46,10 +49,16 @@ class _ExportBackupActionBase(Action[ExportFailures], ABC):
 		self.verify_blob = verify_blob
 		self.create_meta = create_meta
 
+		self.__blob_chunks: Dict[str, List[ChunkInfo]] = {}
+		self.__packed_blobs: Dict[str, PackedBlobInfo] = {}
+
 	def run(self) -> ExportFailures:
 		with DbAccess.open_session() as session:
 			backup = session.get_backup(self.backup_id)
-			failures = self._export_backup(session, backup)
+			files = session.get_backup_files(backup)
+			self.__prefetch_blob_chunks(session, files)
+			self.__prefetch_packed_blobs(session, files)
+			failures = self._export_backup(session, backup, files)
 
 		if len(failures) > 0:
 			self.logger.info('Export done with {} failures'.format(len(failures)))
@@ -58,9 +67,53 @@ class _ExportBackupActionBase(Action[ExportFailures], ABC):
 		return failures
 
 	@abstractmethod
-	def _export_backup(self, session: DbSession, backup: schema.Backup) -> ExportFailures:
+	def _export_backup(self, session: DbSession, backup: schema.Backup, files: List[schema.File]) -> ExportFailures:
 		...
 
+	def __prefetch_blob_chunks(self, session: DbSession, files: List[schema.File]):
+		self.__blob_chunks.clear()
+		chunked_blob_hashes = collection_utils.deduplicated_list([
+			file.blob_hash
+			for file in files
+			if file.blob_hash is not None and file.blob_storage_method == BlobStorageMethod.chunked.name
+		])
+		for blob_hash, chunks in session.get_blob_chunks(chunked_blob_hashes).items():
+			self.__blob_chunks[blob_hash] = [ChunkInfo.of(chunk) for chunk in chunks]
+
+	def __prefetch_packed_blobs(self, session: DbSession, files: List[schema.File]):
+		self.__packed_blobs.clear()
+		packed_blob_hashes = collection_utils.deduplicated_list([
+			file.blob_hash
+			for file in files
+			if file.blob_hash is not None and file.blob_storage_method == BlobStorageMethod.packed.name
+		])
+		for blob_hash, packed_blob in session.get_packed_blobs(packed_blob_hashes).items():
+			self.__packed_blobs[blob_hash] = PackedBlobInfo.of(packed_blob)
+
+	@classmethod
+	def _is_chunked_blob(cls, file: schema.File) -> bool:
+		return file.blob_storage_method == BlobStorageMethod.chunked.name
+
+	@classmethod
+	def _is_packed_blob(cls, file: schema.File) -> bool:
+		return file.blob_storage_method == BlobStorageMethod.packed.name
+
+	@contextlib.contextmanager
+	def _open_blob_decompressed(self, file: schema.File) -> ContextManager[BinaryIO]:
+		if self._is_chunked_blob(file):
+			if (chunks := self.__blob_chunks.get(file.blob_hash)) is None:
+				raise VerificationError('chunks not found for chunked blob {} of file {}'.format(file.blob_hash, file.path))
+			with chunk_utils.open_chunks_decompressed(chunks) as f:
+				yield f
+		elif self._is_packed_blob(file):
+			if (packed_blob := self.__packed_blobs.get(file.blob_hash)) is None:
+				raise VerificationError('pack location not found for packed blob {} of file {}'.format(file.blob_hash, file.path))
+			with blob_utils.open_blob_decompressed(file.blob_hash, file.blob_compress, packed_blob) as f:
+				yield f
+		else:
+			with blob_utils.open_blob_decompressed(file.blob_hash, file.blob_compress) as f:
+				yield f
+
 	def _create_meta_buf(self, backup: schema.Backup) -> bytes:
 		if not self.create_meta:
 			raise RuntimeError('calling _create_meta_buf() with create_meta set to False')
@@ -170,15 +223,14 @@ class ExportBackupToDirectoryAction(_ExportBackupActionBase):
 
 		if stat.S_ISREG(file.mode):
 			self.logger.debug('write file {}'.format(file.path))
-			blob_path = blob_utils.get_blob_path(file.blob_hash)
-			compressor = Compressor.create(file.blob_compress)
-			if compressor.get_method() == CompressMethod.plain:
+			if not self._is_chunked_blob(file) and not self._is_packed_blob(file) and file.blob_compress == CompressMethod.plain.name:
+				blob_path = blob_utils.get_blob_path(file.blob_hash)
 				file_utils.copy_file_fast(blob_path, file_path)
 				if self.verify_blob:
 					sah = hash_utils.calc_file_size_and_hash(file_path)
 					self._verify_exported_blob(file, sah.size, sah.hash)
 			else:
-				with compressor.open_decompressed(blob_path) as f_in:
+				with self._open_blob_decompressed(file) as f_in:
 					with open(file_path, 'wb') as f_out:
 						if self.verify_blob:
 							reader = BypassReader(f_in, calc_hash=True)
@@ -204,7 +256,7 @@ class ExportBackupToDirectoryAction(_ExportBackupActionBase):
 		if not stat.S_ISDIR(file.mode):
 			self.__set_attrs(file, file_path)
 
-	def _export_backup(self, session: DbSession, backup: schema.Backup) -> ExportFailures:
+	def _export_backup(self, session: DbSession, backup: schema.Backup, files: List[schema.File]) -> ExportFailures:
 		failures = ExportFailures(self.fail_soft)
 
 		# 1. collect export item
@@ -219,11 +271,11 @@ class ExportBackupToDirectoryAction(_ExportBackupActionBase):
 		export_items: List[ExportBackupToDirectoryAction._ExportItem] = []
 		if self.child_to_export is None:
 			self.logger.info('Exporting {} to directory {}'.format(backup, self.output_path))
-			for file in backup.files:
+			for file in files:
 				add_export_item(file, Path(file.path))
 		else:
 			self.logger.info('Exporting child {!r} in {} to directory {}, recursively = {}'.format(self.child_to_export.as_posix(), backup, self.output_path, self.recursively_export_child))
-			for file in backup.files:
+			for file in files:
 				try:
 					rel_path = Path(file.path).relative_to(self.child_to_export)
 				except ValueError:
@@ -368,9 +420,8 @@ class ExportBackupToTarAction(_ExportBackupActionBase):
 			self.logger.debug('add file {} to tarfile'.format(file.path))
 			info.type = tarfile.REGTYPE
 			info.size = file.blob_raw_size
-			blob_path = blob_utils.get_blob_path(file.blob_hash)
 
-			with Compressor.create(file.blob_compress).open_decompressed(blob_path) as stream:
+			with self._open_blob_decompressed(file) as stream:
 				# Exception raised in TarFile.addfile might nuke the whole remaining tar file, which is bad
 				# We read a few bytes from the stream, to *hopefully* trigger potential decompress exception in advanced,
 				# make it fail before affecting the actual tar file
@@ -401,7 +452,7 @@ class ExportBackupToTarAction(_ExportBackupActionBase):
 		else:
 			self._on_unsupported_file_mode(file)
 
-	def _export_backup(self, session, backup: schema.Backup) -> ExportFailures:
+	def _export_backup(self, session, backup: schema.Backup, files: List[schema.File]) -> ExportFailures:
 		failures = ExportFailures(self.fail_soft)
 		if not self.output_path.name.endswith(self.tar_format.value.extension):
 			raise ValueError('bad output file extension for file name {!r}, should be {!r} for tar format {}'.format(
@@ -413,7 +464,7 @@ class ExportBackupToTarAction(_ExportBackupActionBase):
 
 		try:
 			with self.__open_tar() as tar:
-				for file in backup.files:
+				for file in files:
 					if self.is_interrupted.is_set():
 						self.logger.info('Export to tarfile interrupted')
 						raise _ExportInterrupted()
@@ -463,9 +514,8 @@ class ExportBackupToZipAction(_ExportBackupActionBase):
 		if stat.S_ISREG(file.mode):
 			self.logger.debug('add file {} to zipfile'.format(file.path))
 			info.file_size = file.blob_raw_size
-			blob_path = blob_utils.get_blob_path(file.blob_hash)
 
-			with Compressor.create(file.blob_compress).open_decompressed(blob_path) as stream:
+			with self._open_blob_decompressed(file) as stream:
 				with zipf.open(info, 'w') as zip_item:
 					if self.verify_blob:
 						reader = BypassReader(stream, calc_hash=True)
@@ -487,14 +537,14 @@ class ExportBackupToZipAction(_ExportBackupActionBase):
 		else:
 			self._on_unsupported_file_mode(file)
 
-	def _export_backup(self, session, backup: schema.Backup) -> ExportFailures:
+	def _export_backup(self, session, backup: schema.Backup, files: List[schema.File]) -> ExportFailures:
 		failures = ExportFailures(self.fail_soft)
 		self.logger.info('Exporting backup {} to zipfile {}'.format(backup, self.output_path))
 		self.output_path.parent.mkdir(parents=True, exist_ok=True)
 
 		try:
 			with zipfile.ZipFile(self.output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-				for file in backup.files:
+				for file in files:
 					if self.is_interrupted.is_set():
 						self.logger.info('Export to zipfile interrupted')
 						raise _ExportInterrupted()
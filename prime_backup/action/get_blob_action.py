@@ -16,7 +16,7 @@ class GetBlobAction(Action[BlobInfo]):
 		"""
 		with DbAccess.open_session() as session:
 			blob = session.get_blob(self.blob_hash)
-			file_count = session.get_file_count_by_blob_hashes([blob.hash]) if self.count_files else 0
+			file_count = blob.ref_count if self.count_files else 0
 			return BlobInfo.of(blob, file_count=file_count)
 
 
@@ -38,5 +38,5 @@ class GetBlobByHashPrefixAction(Action[BlobInfo]):
 				raise BlobHashNotUnique(self.blob_hash_prefix, list(sorted(map(BlobInfo.of, blobs))))
 
 			blob = blobs[0]
-			file_count = session.get_file_count_by_blob_hashes([blob.hash]) if self.count_files else 0
+			file_count = blob.ref_count if self.count_files else 0
 			return BlobInfo.of(blob, file_count=file_count)
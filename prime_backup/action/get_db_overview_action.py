@@ -10,11 +10,14 @@ class DbOverviewResult:
 	hash_method: str
 
 	blob_count: int
+	chunk_count: int
 	file_count: int
 	backup_count: int
 
 	blob_stored_size_sum: int
 	blob_raw_size_sum: int
+	chunk_stored_size_sum: int
+	chunk_raw_size_sum: int
 	file_raw_size_sum: int
 
 	db_file_size: int
@@ -25,17 +28,21 @@ class GetDbOverviewAction(Action[DbOverviewResult]):
 		db_file_size = DbAccess.get_db_file_path().stat().st_size
 		with DbAccess.open_session() as session:
 			meta = session.get_db_meta()
+			stats = session.get_storage_stats()
 			return DbOverviewResult(
 				db_version=meta.version,
 				hash_method=meta.hash_method,
 
-				blob_count=session.get_blob_count(),
-				file_count=session.get_file_count(),
+				blob_count=stats.blob_count,
+				chunk_count=stats.chunk_count,
+				file_count=stats.file_count,
 				backup_count=session.get_backup_count(),
 
-				blob_stored_size_sum=session.get_blob_stored_size_sum(),
-				blob_raw_size_sum=session.get_blob_raw_size_sum(),
-				file_raw_size_sum=session.get_file_raw_size_sum(),
+				blob_stored_size_sum=stats.blob_stored_size_sum,
+				blob_raw_size_sum=stats.blob_raw_size_sum,
+				chunk_stored_size_sum=stats.chunk_stored_size_sum,
+				chunk_raw_size_sum=stats.chunk_raw_size_sum,
+				file_raw_size_sum=stats.file_raw_size_sum,
 
 				db_file_size=db_file_size,
 			)
@@ -14,8 +14,9 @@ class ObjectCounts:
 class GetObjectCountsAction(Action[ObjectCounts]):
 	def run(self) -> ObjectCounts:
 		with DbAccess.open_session() as session:
+			stats = session.get_storage_stats()
 			return ObjectCounts(
-				blob_count=session.get_blob_count(),
-				file_count=session.get_file_count(),
+				blob_count=stats.blob_count,
+				file_count=stats.file_count,
 				backup_count=session.get_backup_count(),
 			)
@@ -1,3 +1,4 @@
+import collections
 import contextlib
 import functools
 import json
@@ -9,8 +10,9 @@ import threading
 import time
 import zipfile
 from abc import ABC, abstractmethod
+from concurrent.futures import Future
 from pathlib import Path
-from typing import ContextManager, IO, Optional, List, Dict, Tuple
+from typing import ContextManager, IO, Optional, List, Dict, Tuple, Deque, Set
 
 from prime_backup.action.create_backup_action_base import CreateBackupActionBase
 from prime_backup.compressors import Compressor, CompressMethod
@@ -22,12 +24,14 @@ from prime_backup.db.session import DbSession
 from prime_backup.exceptions import PrimeBackupError
 from prime_backup.types.backup_info import BackupInfo
 from prime_backup.types.backup_meta import BackupMeta
+from prime_backup.types.blob_storage_method import BlobStorageMethod
 from prime_backup.types.operator import Operator, PrimeBackupOperatorNames
 from prime_backup.types.standalone_backup_format import StandaloneBackupFormat
 from prime_backup.types.tar_format import TarFormat
 from prime_backup.types.units import ByteCount
 from prime_backup.utils import hash_utils, blob_utils, misc_utils
 from prime_backup.utils.hash_utils import SizeAndHash
+from prime_backup.utils.process_pool import CompressProcessPool
 
 
 class UnsupportedFormat(PrimeBackupError):
@@ -302,8 +306,9 @@ class ImportBackupAction(CreateBackupActionBase):
 	def __create_blob(self, session: DbSession, file_reader: IO[bytes], sah: SizeAndHash) -> schema.Blob:
 		stored_size, compress_method = self.__create_blob_file(file_reader, sah)
 		blob = self._create_blob(
-			session,
+			session, bulk_insert=True,
 			hash=sah.hash,
+			storage_method=BlobStorageMethod.direct.name,
 			compress=compress_method.name,
 			raw_size=sah.size,
 			stored_size=stored_size,
@@ -311,6 +316,59 @@ class ImportBackupAction(CreateBackupActionBase):
 		self.__blob_cache[sah.hash] = blob
 		return blob
 
+	def __create_blobs_in_process_pool(
+			self, session: DbSession, pool: CompressProcessPool,
+			members: List[PackedBackupFileHandler.Member], sah_dict: Dict[int, SizeAndHash],
+	):
+		"""
+		Create the new blobs concurrently in the compress process pool. The process pool only accepts file paths,
+		so the members are extracted into temp files first
+		"""
+		temp_dir = self.config.temp_path
+		temp_dir.mkdir(parents=True, exist_ok=True)
+		max_pending = self.config.backup.compress_process_pool_size * 2  # limits the disk usage of the temp files
+		pending: Deque[Tuple[SizeAndHash, CompressMethod, Path, Future]] = collections.deque()
+		scheduled_hashes: Set[str] = set()
+
+		def wait_one():
+			sah_, compress_method_, temp_file_path_, future = pending.popleft()
+			try:
+				cr: Compressor.CopyCompressResult = future.result()
+			finally:
+				self._remove_file(temp_file_path_, what='temp_file')
+			self.__blob_cache[sah_.hash] = self._create_blob(
+				session, bulk_insert=True,
+				hash=sah_.hash,
+				storage_method=BlobStorageMethod.direct.name,
+				compress=compress_method_.name,
+				raw_size=sah_.size,
+				stored_size=cr.write_size,
+			)
+
+		try:
+			for i, member in enumerate(members):
+				if (sah := sah_dict.get(i)) is None or sah.hash in self.__blob_cache or sah.hash in scheduled_hashes:
+					continue
+				compress_method: CompressMethod = self.config.backup.get_compress_method_from_size(sah.size)
+				if not pool.should_use(compress_method):
+					continue  # will be created in __import_member
+
+				blob_path = blob_utils.get_blob_path(sah.hash)
+				self._add_remove_file_rollbacker(blob_path)
+				temp_file_path = temp_dir / 'import_{}_{}.tmp'.format(os.getpid(), sah.hash)
+				with member.open() as f_in, open(temp_file_path, 'wb') as f_out:
+					shutil.copyfileobj(f_in, f_out)
+
+				scheduled_hashes.add(sah.hash)
+				pending.append((sah, compress_method, temp_file_path, pool.submit_copy_compressed(compress_method, temp_file_path, blob_path)))
+				if len(pending) >= max_pending:
+					wait_one()
+			while len(pending) > 0:
+				wait_one()
+		finally:
+			for _, _, temp_file_path, _ in pending:
+				self._remove_file(temp_file_path, what='temp_file')
+
 	@classmethod
 	def __format_path(cls, path: str) -> str:
 		return Path(path).as_posix()
@@ -415,6 +473,9 @@ class ImportBackupAction(CreateBackupActionBase):
 
 		files = []
 		blob_utils.prepare_blob_directories()
+		if (pool := CompressProcessPool.create_from_config()) is not None:
+			with pool:
+				self.__create_blobs_in_process_pool(session, pool, members, sah_dict)
 		for i, member in enumerate(members):
 			try:
 				file = self.__import_member(session, member, now_ns, sah_dict.get(i))
@@ -447,6 +508,7 @@ class ImportBackupAction(CreateBackupActionBase):
 				with handler.open_file(self.file_path) as file_holder:
 					backup = self.__import_packed_backup_file(session, file_holder)
 				info = BackupInfo.of(backup)
+			self._on_new_blobs_committed()
 
 			s = self.get_new_blobs_summary()
 			self.logger.info('Import backup #{} done, +{} blobs (size {} / {})'.format(
@@ -1,17 +1,23 @@
-import shutil
 import time
+from concurrent.futures import Future
 from pathlib import Path
-from typing import List, Tuple, Set
+from typing import List, Tuple, Set, Dict, Union, Callable, Optional
 
 from prime_backup.action import Action
 from prime_backup.compressors import CompressMethod, Compressor
 from prime_backup.db import schema
 from prime_backup.db.access import DbAccess
 from prime_backup.db.session import DbSession
+from prime_backup.types.blob_storage_method import BlobStorageMethod
+from prime_backup.types.chunk_info import ChunkInfo
+from prime_backup.types.packed_blob_info import PackedBlobInfo
 from prime_backup.types.size_diff import SizeDiff
-from prime_backup.utils import blob_utils
+from prime_backup.utils import blob_utils, chunk_utils, pack_utils
+from prime_backup.utils.pack_utils import PackWriter
+from prime_backup.utils.process_pool import CompressProcessPool
 
 _OLD_BLOB_SUFFIX = '_old'
+_MigratableObject = Union[schema.Blob, schema.Chunk]
 
 
 class MigrateCompressMethodAction(Action[SizeDiff]):
@@ -19,7 +25,12 @@ class MigrateCompressMethodAction(Action[SizeDiff]):
 		super().__init__()
 		self.new_compress_method = new_compress_method
 		self.__migrated_blob_hashes: List[str] = []
-		self.__affected_backup_ids: Set[int] = set()
+		self.__migrated_chunk_hashes: List[str] = []
+		self.__migrated_packed_blob_count = 0
+		self.__migrated_packed_chunk_count = 0
+		self.__affected_file_keys: Set[Tuple[int, int]] = set()  # (backup_id, path_id)
+		self.__compress_process_pool: Optional[CompressProcessPool] = None
+		self.__pack_writer: Optional[PackWriter] = None
 
 	@classmethod
 	def __get_blob_paths(cls, h: str) -> Tuple[Path, Path]:
@@ -27,44 +38,147 @@ class MigrateCompressMethodAction(Action[SizeDiff]):
 		old_trash_path = blob_path.parent / (blob_path.name + _OLD_BLOB_SUFFIX)
 		return blob_path, old_trash_path
 
-	def __migrate_blob(self, blob: schema.Blob) -> bool:
-		new_compress_method = self.config.backup.get_compress_method_from_size(blob.raw_size, compress_method_override=self.new_compress_method)
-		decompressor = Compressor.create(blob.compress)
-		compressor = Compressor.create(new_compress_method)
-		if decompressor.get_method() == compressor.get_method():
-			return False
+	@classmethod
+	def __get_chunk_paths(cls, h: str) -> Tuple[Path, Path]:
+		chunk_path = chunk_utils.get_chunk_path(h)
+		old_trash_path = chunk_path.parent / (chunk_path.name + _OLD_BLOB_SUFFIX)
+		return chunk_path, old_trash_path
 
-		blob_path, old_trash_path = self.__get_blob_paths(blob.hash)
-		blob_path.replace(old_trash_path)
-		with decompressor.open_decompressed(old_trash_path) as f_src:
-			with compressor.open_compressed_bypassed(blob_path) as (writer, f_dst):
-				shutil.copyfileobj(f_src, f_dst)
+	def __migrate_objects(self, objects: List[_MigratableObject], get_paths: Callable[[str], Tuple[Path, Path]], migrated_hashes: List[str], what: str) -> List[_MigratableObject]:
+		"""
+		:return: the objects whose compress method is changed
+		"""
+		changed_objects: List[_MigratableObject] = []
+		pending: List[Tuple[_MigratableObject, CompressMethod, Future]] = []
 
-		blob.compress = new_compress_method.name
-		blob.stored_size = writer.get_write_len()
-		return True
+		def apply_result(o: _MigratableObject, method: CompressMethod, cr: Compressor.CopyCompressResult):
+			o.compress = method.name
+			o.stored_size = cr.write_size
+			changed_objects.append(o)
 
-	def __migrate_blobs_and_sync_files(self, session: DbSession, blobs: List[schema.Blob]):
-		blob_mapping = {}
+		for obj in objects:
+			new_compress_method = self.config.backup.get_compress_method_from_size(obj.raw_size, compress_method_override=self.new_compress_method)
+			old_compress_method = CompressMethod[obj.compress]
+			if old_compress_method == new_compress_method:
+				continue
+
+			obj_path, old_trash_path = get_paths(obj.hash)
+			obj_path.replace(old_trash_path)
+			migrated_hashes.append(obj.hash)  # record it right after the move, so it can be rolled back
+
+			try:
+				pool = self.__compress_process_pool
+				if pool is not None and pool.should_use(new_compress_method) and pool.should_use(old_compress_method):
+					pending.append((obj, new_compress_method, pool.submit_copy_recompressed(new_compress_method, old_trash_path, obj_path, old_compress_method)))
+				else:
+					apply_result(obj, new_compress_method, Compressor.create(new_compress_method).copy_recompressed(old_trash_path, obj_path, old_compress_method))
+			except Exception as e:
+				self.logger.error('Migrate {} {} failed: {}'.format(what, obj, e))
+				raise
+
+		for obj, new_compress_method, future in pending:
+			try:
+				apply_result(obj, new_compress_method, future.result())
+			except Exception as e:
+				self.logger.error('Migrate {} {} failed: {}'.format(what, obj, e))
+				raise
+
+		return changed_objects
+
+	def __get_pack_writer(self, session: DbSession) -> PackWriter:
+		if self.__pack_writer is None:
+			pack_utils.prepare_pack_directory()
+			self.__pack_writer = PackWriter(session, self.config.backup.pack_max_size)
+		return self.__pack_writer
+
+	def __migrate_packed_blobs(self, session: DbSession, blobs: List[schema.Blob]) -> List[schema.Blob]:
+		"""
+		The recompressed data is appended to the pack store. The old data becomes dead space, which will be reclaimed by the pack compaction
+
+		:return: the blobs whose compress method is changed
+		"""
+		changed_blobs: List[schema.Blob] = []
+		packed_blobs = session.get_packed_blobs([blob.hash for blob in blobs])
 		for blob in blobs:
+			new_compress_method = self.config.backup.get_compress_method_from_size(blob.raw_size, compress_method_override=self.new_compress_method)
+			if CompressMethod[blob.compress] == new_compress_method:
+				continue
+
+			packed_blob = packed_blobs[blob.hash]
 			try:
-				changed = self.__migrate_blob(blob)
+				with blob_utils.open_blob_decompressed(blob.hash, blob.compress, PackedBlobInfo.of(packed_blob)) as f:
+					content = f.read()
+				stored_data = Compressor.create(new_compress_method).compress_bytes(content)
 			except Exception as e:
-				self.logger.error('Migrate blob {} failed: {}'.format(blob, e))
+				self.logger.error('Migrate packed blob {} failed: {}'.format(blob, e))
 				raise
 
-			if changed:
-				blob_mapping[blob.hash] = blob
-				self.__migrated_blob_hashes.append(blob.hash)
+			packed_blob.pack_id, packed_blob.offset = self.__get_pack_writer(session).write(stored_data)
+			packed_blob.length = len(stored_data)
+			blob.compress = new_compress_method.name
+			blob.stored_size = len(stored_data)
+			changed_blobs.append(blob)
+			self.__migrated_packed_blob_count += 1
+		return changed_blobs
+
+	def __migrate_packed_chunks(self, session: DbSession, chunks: List[schema.Chunk]) -> List[schema.Chunk]:
+		"""
+		Like :meth:`__migrate_packed_blobs`, but for the packed chunks
+
+		:return: the chunks whose compress method is changed
+		"""
+		changed_chunks: List[schema.Chunk] = []
+		for chunk in chunks:
+			new_compress_method = self.config.backup.get_compress_method_from_size(chunk.raw_size, compress_method_override=self.new_compress_method)
+			if CompressMethod[chunk.compress] == new_compress_method:
+				continue
 
+			try:
+				with chunk_utils.open_chunk_decompressed(ChunkInfo.of(chunk)) as f:
+					content = f.read()
+				stored_data = Compressor.create(new_compress_method).compress_bytes(content)
+			except Exception as e:
+				self.logger.error('Migrate packed chunk {} failed: {}'.format(chunk, e))
+				raise
+
+			chunk.pack_id, chunk.pack_offset = self.__get_pack_writer(session).write(stored_data)
+			chunk.compress = new_compress_method.name
+			chunk.stored_size = len(stored_data)
+			changed_chunks.append(chunk)
+			self.__migrated_packed_chunk_count += 1
+		return changed_chunks
+
+	def __sync_files(self, session: DbSession, blob_mapping: Dict[str, schema.Blob]):
 		for file in session.get_file_by_blob_hashes(list(blob_mapping.keys())):
 			blob = blob_mapping[file.blob_hash]
 			file.blob_compress = blob.compress
 			file.blob_stored_size = blob.stored_size
-			self.__affected_backup_ids.add(file.backup_id)
+			self.__affected_file_keys.add((file.backup_id, file.path_id))
+
+	def __migrate_blobs_and_sync_files(self, session: DbSession, blobs: List[schema.Blob]):
+		# chunked blobs are handled in __migrate_chunks_and_sync_blobs
+		direct_blobs = [blob for blob in blobs if blob.storage_method == BlobStorageMethod.direct.name]
+		packed_blobs = [blob for blob in blobs if blob.storage_method == BlobStorageMethod.packed.name]
+		changed_blobs = self.__migrate_objects(direct_blobs, self.__get_blob_paths, self.__migrated_blob_hashes, 'blob')
+		changed_blobs.extend(self.__migrate_packed_blobs(session, packed_blobs))
+		self.__sync_files(session, {blob.hash: blob for blob in changed_blobs})
+
+	def __migrate_chunks_and_sync_blobs(self, session: DbSession, chunks: List[schema.Chunk]):
+		loose_chunks = [chunk for chunk in chunks if chunk.pack_id is None]
+		packed_chunks = [chunk for chunk in chunks if chunk.pack_id is not None]
+		changed_chunks = self.__migrate_objects(loose_chunks, self.__get_chunk_paths, self.__migrated_chunk_hashes, 'chunk')
+		changed_chunks.extend(self.__migrate_packed_chunks(session, packed_chunks))
+		changed_chunk_hashes = [chunk.hash for chunk in changed_chunks]
+
+		session.flush()
+		blob_hashes = list({bc.blob_hash for bc in session.get_blob_chunks_by_chunk_hashes(changed_chunk_hashes)})
+		blob_mapping = {}
+		for blob in session.get_blobs(blob_hashes).values():
+			blob.stored_size = session.calc_blob_chunk_stored_size_sum(blob.hash)
+			blob_mapping[blob.hash] = blob
+		self.__sync_files(session, blob_mapping)
 
-	def __update_backups(self, session: DbSession):
-		backup_ids = list(sorted(self.__affected_backup_ids))
+	def __update_backups(self, session: DbSession, backup_ids: List[int]):
 		backups = session.get_backups(backup_ids)
 		for backup_id in backup_ids:
 			backup = backups[backup_id]
@@ -74,18 +188,49 @@ class MigrateCompressMethodAction(Action[SizeDiff]):
 		for h in self.__migrated_blob_hashes:
 			_, old_trash_path = self.__get_blob_paths(h)
 			old_trash_path.unlink()
+		for h in self.__migrated_chunk_hashes:
+			_, old_trash_path = self.__get_chunk_paths(h)
+			old_trash_path.unlink()
+
+	@classmethod
+	def __get_stored_size_sum(cls, session: DbSession) -> int:
+		return (
+				session.get_blob_stored_size_sum(BlobStorageMethod.direct) +
+				session.get_blob_stored_size_sum(BlobStorageMethod.packed) +
+				session.get_chunk_stored_size_sum()
+		)
+
+	def __close_pack_writer(self):
+		if self.__pack_writer is not None:
+			self.__pack_writer.close()
+			self.__pack_writer = None
+
+	def __shutdown_compress_process_pool(self):
+		if self.__compress_process_pool is not None:
+			self.__compress_process_pool.shutdown()
+			self.__compress_process_pool = None
 
 	def __rollback(self):
+		if self.__pack_writer is not None:
+			self.__pack_writer.rollback()
 		for h in self.__migrated_blob_hashes:
 			blob_path, old_trash_path = self.__get_blob_paths(h)
 			if old_trash_path.is_file():
 				old_trash_path.replace(blob_path)
+		for h in self.__migrated_chunk_hashes:
+			chunk_path, old_trash_path = self.__get_chunk_paths(h)
+			if old_trash_path.is_file():
+				old_trash_path.replace(chunk_path)
 
 	def run(self) -> SizeDiff:
 		# Notes: requires 2x disk usage of the blob store, stores all blob hashes in memory
 		self.__migrated_blob_hashes.clear()
+		self.__migrated_chunk_hashes.clear()
+		self.__migrated_packed_blob_count = 0
+		self.__migrated_packed_chunk_count = 0
 		self.logger.info('Migrating compress method to {} (compress threshold = {})'.format(self.new_compress_method.name, self.config.backup.compress_threshold))
 
+		self.__compress_process_pool = CompressProcessPool.create_from_config()
 		try:
 			# Blob operation steps:
 			# 1. move xxx -> xxx_old
@@ -94,8 +239,9 @@ class MigrateCompressMethodAction(Action[SizeDiff]):
 			with DbAccess.open_session() as session:
 				# 0. fetch information before the migration
 				t = time.time()
-				before_size = session.get_blob_stored_size_sum()
+				before_size = self.__get_stored_size_sum(session)
 				total_blob_count = session.get_blob_count()
+				total_chunk_count = session.get_chunk_count()
 
 				# 1. migrate blob objects
 				cnt = 0
@@ -105,21 +251,36 @@ class MigrateCompressMethodAction(Action[SizeDiff]):
 					self.__migrate_blobs_and_sync_files(session, blobs)
 					session.flush_and_expunge_all()
 
-				if len(self.__migrated_blob_hashes) == 0:
+				# 2. migrate chunk objects
+				cnt = 0
+				for chunks in session.iterate_chunk_batch(batch_size=1000):
+					cnt += len(chunks)
+					self.logger.info('Processing chunks {} / {}'.format(cnt, total_chunk_count))
+					self.__migrate_chunks_and_sync_blobs(session, chunks)
+					session.flush_and_expunge_all()
+
+				if len(self.__migrated_blob_hashes) == 0 and len(self.__migrated_chunk_hashes) == 0 and self.__migrated_packed_blob_count == 0 and self.__migrated_packed_chunk_count == 0:
 					self.logger.info('No blob needs a compress method change, nothing to migrate')
 				else:
-					self.logger.info('Migrated {} blobs and related files'.format(len(self.__migrated_blob_hashes)))
+					self.logger.info('Migrated {} blobs, {} packed blobs, {} chunks, {} packed chunks and related files'.format(
+						len(self.__migrated_blob_hashes), self.__migrated_packed_blob_count, len(self.__migrated_chunk_hashes), self.__migrated_packed_chunk_count,
+					))
 
 					# 3. migrate backup data
-					self.logger.info('Syncing {} affected backups'.format(len(self.__affected_backup_ids)))
-					self.__update_backups(session)
+					# delta backups that inherit the affected files are affected too
+					affected_backup_ids = session.get_backup_ids_by_file_keys(self.__affected_file_keys)
+					self.logger.info('Syncing {} affected backups'.format(len(affected_backup_ids)))
+					self.__update_backups(session, affected_backup_ids)
 					session.flush_and_expunge_all()
 
 				# 4. output
-				after_size = session.get_blob_stored_size_sum()
+				# the stored sizes are changed in place, recalculate the storage statistics
+				session.reconcile_storage_stats()
+				after_size = self.__get_stored_size_sum(session)
 
 		except Exception:
 			self.logger.warning('Error occurs during compress method migration, applying rollback')
+			self.__shutdown_compress_process_pool()  # wait for the ongoing compressions before touching the files
 			self.__rollback()
 			raise
 
@@ -133,4 +294,7 @@ class MigrateCompressMethodAction(Action[SizeDiff]):
 			return SizeDiff(before_size, after_size)
 
 		finally:
+			self.__shutdown_compress_process_pool()
+			self.__close_pack_writer()
 			self.__migrated_blob_hashes.clear()
+			self.__migrated_chunk_hashes.clear()
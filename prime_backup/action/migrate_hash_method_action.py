@@ -1,14 +1,18 @@
 import shutil
 import time
-from typing import List, Dict, Set
+from typing import List, Dict
 
 from prime_backup.action import Action
-from prime_backup.compressors import Compressor
 from prime_backup.db.access import DbAccess
+from prime_backup.db.blob_index import BlobIndex
 from prime_backup.db.session import DbSession
+from prime_backup.db.temp_table import TempKeyTable
 from prime_backup.exceptions import PrimeBackupError
+from prime_backup.types.blob_storage_method import BlobStorageMethod
+from prime_backup.types.chunk_info import ChunkInfo
 from prime_backup.types.hash_method import HashMethod
-from prime_backup.utils import blob_utils, hash_utils, collection_utils
+from prime_backup.types.packed_blob_info import PackedBlobInfo
+from prime_backup.utils import blob_utils, hash_utils, chunk_utils
 
 
 class HashCollisionError(PrimeBackupError):
@@ -23,38 +27,82 @@ class MigrateHashMethodAction(Action[None]):
 		super().__init__()
 		self.new_hash_method = new_hash_method
 
-	def __migrate_blobs(self, session: DbSession, blob_hashes: List[str], old_hashes: Set[str], processed_hash_mapping: Dict[str, str]):
+	def __migrate_chunks(self, session: DbSession, chunk_hashes: List[str], old_hashes: TempKeyTable, processed_hash_mapping: Dict[str, str]):
+		hash_mapping: Dict[str, str] = {}
+		chunks = list(session.get_chunks(chunk_hashes).values())
+
+		# calc chunk hashes
+		for chunk in chunks:
+			with chunk_utils.open_chunk_decompressed(ChunkInfo.of(chunk)) as f:
+				sah = hash_utils.calc_reader_size_and_hash(f, hash_method=self.new_hash_method)
+			hash_mapping[chunk.hash] = sah.hash
+		if len(collided := old_hashes.filter_contained(list(hash_mapping.values()))) > 0:
+			raise HashCollisionError(collided[0])
+
+		# update the objects
+		for chunk in chunks:
+			old_hash, new_hash = chunk.hash, hash_mapping[chunk.hash]
+			if chunk.pack_id is None:
+				old_path = chunk_utils.get_chunk_path(old_hash)
+				new_path = chunk_utils.get_chunk_path(new_hash)
+				try:
+					shutil.move(old_path, new_path)
+				except Exception as e:
+					self.logger.error('Move chunk ({} -> {}) from {!r} to {!r} failed: {}'.format(old_hash, new_hash, old_path, new_path, e))
+					raise
+
+				processed_hash_mapping[old_hash] = new_hash
+			chunk.hash = new_hash
+
+		for blob_chunk in session.get_blob_chunks_by_chunk_hashes(list(hash_mapping.keys())):
+			blob_chunk.chunk_hash = hash_mapping[blob_chunk.chunk_hash]
+
+	def __migrate_blobs(self, session: DbSession, blob_hashes: List[str], old_hashes: TempKeyTable, processed_hash_mapping: Dict[str, str]):
 		hash_mapping: Dict[str, str] = {}
 		blobs = list(session.get_blobs(blob_hashes).values())
+		chunked_blob_hashes = [blob.hash for blob in blobs if blob.storage_method == BlobStorageMethod.chunked.name]
+		blob_chunks = session.get_blob_chunks(chunked_blob_hashes)
+		packed_blobs = session.get_packed_blobs([blob.hash for blob in blobs if blob.storage_method == BlobStorageMethod.packed.name])
 
 		# calc blob hashes
 		for blob in blobs:
-			blob_path = blob_utils.get_blob_path(blob.hash)
-			with Compressor.create(blob.compress).open_decompressed(blob_path) as f:
-				sah = hash_utils.calc_reader_size_and_hash(f, hash_method=self.new_hash_method)
+			if blob.storage_method == BlobStorageMethod.chunked.name:
+				chunks = [ChunkInfo.of(chunk) for chunk in blob_chunks.get(blob.hash, [])]
+				with chunk_utils.open_chunks_decompressed(chunks) as f:
+					sah = hash_utils.calc_reader_size_and_hash(f, hash_method=self.new_hash_method)
+			else:
+				packed_blob = PackedBlobInfo.of(packed_blobs[blob.hash]) if blob.hash in packed_blobs else None
+				with blob_utils.open_blob_decompressed(blob.hash, blob.compress, packed_blob) as f:
+					sah = hash_utils.calc_reader_size_and_hash(f, hash_method=self.new_hash_method)
 			hash_mapping[blob.hash] = sah.hash
-			if sah.hash in old_hashes:
-				raise HashCollisionError(sah.hash)
+		if len(collided := old_hashes.filter_contained(list(hash_mapping.values()))) > 0:
+			raise HashCollisionError(collided[0])
 
 		# update the objects
 		for blob in blobs:
 			old_hash, new_hash = blob.hash, hash_mapping[blob.hash]
-			old_path = blob_utils.get_blob_path(old_hash)
-			new_path = blob_utils.get_blob_path(new_hash)
-			try:
-				shutil.move(old_path, new_path)
-			except Exception as e:
-				self.logger.error('Move blob ({} -> {}) from {!r} to {!r} failed: {}'.format(old_hash, new_hash, old_path, new_path, e))
-				raise
-
-			processed_hash_mapping[old_hash] = new_hash
+			if blob.storage_method == BlobStorageMethod.direct.name:
+				old_path = blob_utils.get_blob_path(old_hash)
+				new_path = blob_utils.get_blob_path(new_hash)
+				try:
+					shutil.move(old_path, new_path)
+				except Exception as e:
+					self.logger.error('Move blob ({} -> {}) from {!r} to {!r} failed: {}'.format(old_hash, new_hash, old_path, new_path, e))
+					raise
+
+				processed_hash_mapping[old_hash] = new_hash
 			blob.hash = new_hash
 
+		for blob_chunk in session.get_blob_chunks_by_blob_hashes(chunked_blob_hashes):
+			blob_chunk.blob_hash = hash_mapping[blob_chunk.blob_hash]
+		for packed_blob in packed_blobs.values():
+			packed_blob.blob_hash = hash_mapping[packed_blob.blob_hash]
 		for file in session.get_file_by_blob_hashes(list(hash_mapping.keys())):
 			file.blob_hash = hash_mapping[file.blob_hash]
 
 	def run(self):
 		processed_hash_mapping: Dict[str, str] = {}  # old -> new
+		processed_chunk_hash_mapping: Dict[str, str] = {}  # old -> new
 		try:
 			t = time.time()
 			with DbAccess.open_session() as session:
@@ -65,17 +113,28 @@ class MigrateHashMethodAction(Action[None]):
 
 				self.logger.info('Migrating hash method from {} to {}'.format(meta.hash_method, self.new_hash_method.name))
 
-				total_blob_count = session.get_blob_count()
-				all_hashes = session.get_all_blob_hashes()
-				all_hash_set = set(all_hashes)
-				cnt = 0
-				for blob_hashes in collection_utils.slicing_iterate(all_hashes, 1000):
-					blob_hashes: List[str] = list(blob_hashes)
-					cnt += len(blob_hashes)
-					self.logger.info('Migrating blobs {} / {}'.format(cnt, total_blob_count))
-
-					self.__migrate_blobs(session, blob_hashes, all_hash_set, processed_hash_mapping)
-					session.flush_and_expunge_all()
+				# snapshot the old hashes into temp tables, as the hashes in the tables are updated during the iteration
+				with session.temp_key_table() as old_chunk_hashes:
+					old_chunk_hashes.insert_keys(h for batch in session.iterate_chunk_hash_batch() for h in batch)
+					total_chunk_count = old_chunk_hashes.count()
+					cnt = 0
+					for chunk_hashes in old_chunk_hashes.iterate_key_batch(1000):
+						cnt += len(chunk_hashes)
+						self.logger.info('Migrating chunks {} / {}'.format(cnt, total_chunk_count))
+
+						self.__migrate_chunks(session, chunk_hashes, old_chunk_hashes, processed_chunk_hash_mapping)
+						session.flush_and_expunge_all()
+
+				with session.temp_key_table() as old_blob_hashes:
+					old_blob_hashes.insert_keys(h for batch in session.iterate_blob_hash_batch() for h in batch)
+					total_blob_count = old_blob_hashes.count()
+					cnt = 0
+					for blob_hashes in old_blob_hashes.iterate_key_batch(1000):
+						cnt += len(blob_hashes)
+						self.logger.info('Migrating blobs {} / {}'.format(cnt, total_blob_count))
+
+						self.__migrate_blobs(session, blob_hashes, old_blob_hashes, processed_hash_mapping)
+						session.flush_and_expunge_all()
 
 				meta = session.get_db_meta()  # get the meta again, cuz expunge_all() was called
 				meta.hash_method = self.new_hash_method.name
@@ -83,6 +142,8 @@ class MigrateHashMethodAction(Action[None]):
 			self.logger.info('Syncing config and variables')
 			DbAccess.sync_hash_method()
 			self.config.backup.hash_method = self.new_hash_method.name
+			if (blob_index := BlobIndex.get_opt()) is not None:
+				blob_index.invalidate()  # all blob hashes are changed
 
 			self.logger.info('Hash method migration done, cost {}s'.format(round(time.time() - t, 2)))
 
@@ -92,4 +153,8 @@ class MigrateHashMethodAction(Action[None]):
 				old_path = blob_utils.get_blob_path(old_hash)
 				new_path = blob_utils.get_blob_path(new_hash)
 				shutil.move(new_path, old_path)
+			for old_hash, new_hash in processed_chunk_hash_mapping.items():
+				old_path = chunk_utils.get_chunk_path(old_hash)
+				new_path = chunk_utils.get_chunk_path(new_hash)
+				shutil.move(new_path, old_path)
 			raise
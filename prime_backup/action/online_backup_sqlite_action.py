@@ -0,0 +1,33 @@
+import time
+from pathlib import Path
+
+from prime_backup.action import Action
+from prime_backup.db.access import DbAccess
+
+
+class OnlineBackupSqliteAction(Action[int]):
+	"""
+	Copy the database into the target file with the SQLite online backup API, see :meth:`DbSession.online_backup`
+
+	:return: size of the copied database file
+	"""
+
+	def __init__(self, target_path: Path, *, step_pages: int, step_sleep: float):
+		super().__init__()
+		self.target_path = target_path
+		self.step_pages = step_pages
+		self.step_sleep = step_sleep
+
+	def run(self) -> int:
+		self.target_path.parent.mkdir(parents=True, exist_ok=True)
+		last_report_time = time.time()
+
+		def progress(copied: int, total: int):
+			nonlocal last_report_time
+			if (now := time.time()) - last_report_time >= 10:
+				last_report_time = now
+				self.logger.info('Copying database, {} / {} pages ({:.1f}%)'.format(copied, total, 100 * copied / max(total, 1)))
+
+		with DbAccess.open_session() as session:
+			session.online_backup(self.target_path.as_posix(), step_pages=self.step_pages, step_sleep=self.step_sleep, progress=progress)
+		return self.target_path.stat().st_size
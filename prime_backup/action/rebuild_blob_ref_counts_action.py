@@ -0,0 +1,20 @@
+from prime_backup.action import Action
+from prime_backup.db.access import DbAccess
+
+
+class RebuildBlobRefCountsAction(Action[int]):
+	"""
+	Recalculate the reference counts of all blobs from the file table
+
+	:return: the amount of blobs whose reference count was incorrect
+	"""
+
+	def run(self) -> int:
+		self.logger.info('Rebuilding blob reference counts')
+		with DbAccess.open_session() as session:
+			fixed_cnt = session.rebuild_blob_ref_counts()
+		if fixed_cnt > 0:
+			self.logger.warning('Fixed reference counts of {} blobs'.format(fixed_cnt))
+		else:
+			self.logger.info('All blob reference counts are correct')
+		return fixed_cnt
@@ -0,0 +1,23 @@
+from typing import Dict, Tuple
+
+from prime_backup.action import Action
+from prime_backup.db.access import DbAccess
+
+
+class ReconcileStorageStatsAction(Action[Dict[str, Tuple[int, int]]]):
+	"""
+	Recalculate the storage statistics from the blob, chunk and file tables
+
+	:return: the incorrect fields, field name -> (stored value, actual value)
+	"""
+
+	def run(self) -> Dict[str, Tuple[int, int]]:
+		self.logger.info('Reconciling storage statistics')
+		with DbAccess.open_session() as session:
+			incorrect_fields = session.reconcile_storage_stats()
+		if len(incorrect_fields) > 0:
+			for key, (stored_value, actual_value) in incorrect_fields.items():
+				self.logger.warning('Fixed storage statistics {}: {} -> {}'.format(key, stored_value, actual_value))
+		else:
+			self.logger.info('All storage statistics are correct')
+		return incorrect_fields
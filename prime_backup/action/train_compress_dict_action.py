@@ -0,0 +1,82 @@
+import time
+from typing import Optional, List, Tuple
+
+from prime_backup.action import Action
+from prime_backup.compressors import ZstdDictCompressor
+from prime_backup.db.access import DbAccess
+from prime_backup.types.packed_blob_info import PackedBlobInfo
+from prime_backup.utils import blob_utils
+
+_MIN_SAMPLE_COUNT = 100
+_MAX_SAMPLE_COUNT = 10000
+_RETRAIN_GROWTH_FACTOR = 2
+
+
+class TrainCompressDictAction(Action[Optional[int]]):
+	"""
+	Train a new zstd dictionary for the compress method "zstd_dict", with a random sample of the existing small blobs
+
+	A new dictionary is trained if there's no dictionary yet,
+	or the amount of the small blobs is doubled since the training of the latest dictionary
+
+	:return: the id of the new dictionary, or None if no training is needed / possible
+	"""
+
+	def __init__(self, *, force: bool = False):
+		super().__init__()
+		self.force = force
+
+	def __read_samples(self, blobs: List[Tuple[str, str, Optional[PackedBlobInfo]]]) -> List[bytes]:
+		samples = []
+		for blob_hash, blob_compress, packed_blob in blobs:
+			try:
+				with blob_utils.open_blob_decompressed(blob_hash, blob_compress, packed_blob) as f:
+					samples.append(f.read())
+			except Exception as e:
+				self.logger.warning('Read blob {} for dictionary training failed, skipped: {}'.format(blob_hash, e))
+		return samples
+
+	def run(self) -> Optional[int]:
+		min_size = self.config.backup.compress_threshold
+		max_size = self.config.backup.compress_dict_threshold
+
+		with DbAccess.open_session() as session:
+			latest = session.get_latest_compress_dict_opt()
+			latest_id = latest.id if latest is not None else 0
+			candidate_count = session.get_unchunked_blob_count_in_size_range(min_size, max_size)
+			if candidate_count < _MIN_SAMPLE_COUNT:
+				self.logger.debug('Not enough small blobs for dictionary training ({} < {})'.format(candidate_count, _MIN_SAMPLE_COUNT))
+				return None
+			if not self.force and latest is not None and candidate_count < latest.candidate_count * _RETRAIN_GROWTH_FACTOR:
+				return None
+			sampled_blobs = session.sample_unchunked_blobs_in_size_range(min_size, max_size, _MAX_SAMPLE_COUNT)
+			packed_blobs = session.get_packed_blobs([blob.hash for blob in sampled_blobs])
+			blobs = [
+				(blob.hash, blob.compress, PackedBlobInfo.of(packed_blobs[blob.hash]) if blob.hash in packed_blobs else None)
+				for blob in sampled_blobs
+			]
+
+		self.logger.info('Training compress dictionary with {} samples from {} small blobs'.format(len(blobs), candidate_count))
+		t = time.time()
+		samples = self.__read_samples(blobs)
+		dict_id = latest_id + 1
+
+		import zstandard
+		try:
+			dict_data = zstandard.train_dictionary(self.config.backup.compress_dict_size, samples, dict_id=dict_id).as_bytes()
+		except zstandard.ZstdError as e:
+			self.logger.warning('Compress dictionary training failed: {}'.format(e))
+			return None
+
+		with DbAccess.open_session() as session:
+			session.create_compress_dict(
+				id=dict_id,
+				data=dict_data,
+				sample_count=len(samples),
+				candidate_count=candidate_count,
+				timestamp=time.time_ns(),
+			)
+		ZstdDictCompressor.register_dict(dict_id, dict_data, latest=True)
+
+		self.logger.info('Trained compress dictionary #{} (size {}), cost {}s'.format(dict_id, len(dict_data), round(time.time() - t, 2)))
+		return dict_id
@@ -21,8 +21,15 @@ class VacuumSqliteAction(Action[SizeDiff]):
 		else:
 			into_file = None
 
+		if into_file is None:
+			with DbAccess.open_session() as session:
+				if (cnt := session.delete_orphan_paths()) > 0:
+					self.logger.info('Deleted {} orphan paths'.format(cnt))
+
 		with DbAccess.open_session() as session:
 			session.vacuum(into_file)
+		if into_file is None:
+			DbAccess.checkpoint()  # in WAL mode, the vacuumed content is written to the WAL file first
 
 		if self.target_path is not None:
 			after_size = self.target_path.stat().st_size
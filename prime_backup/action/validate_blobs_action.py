@@ -6,8 +6,10 @@ from prime_backup.compressors import Compressor
 from prime_backup.db.access import DbAccess
 from prime_backup.db.session import DbSession
 from prime_backup.types.blob_info import BlobInfo
+from prime_backup.types.chunk_info import ChunkInfo
 from prime_backup.types.file_info import FileInfo
-from prime_backup.utils import blob_utils, hash_utils
+from prime_backup.types.packed_blob_info import PackedBlobInfo
+from prime_backup.utils import blob_utils, hash_utils, chunk_utils
 from prime_backup.utils.thread_pool import FailFastThreadPool
 
 
@@ -39,8 +41,95 @@ class ValidateBlobsAction(Action[ValidateBlobsResult]):
 
 	def __validate(self, session: DbSession, result: ValidateBlobsResult, blobs: List[BlobInfo]):
 		hash_to_blobs: Dict[str, BlobInfo] = {}  # store "good" blobs only
+		blob_chunks: Dict[str, List[ChunkInfo]] = {
+			h: [ChunkInfo.of(chunk) for chunk in chunks]
+			for h, chunks in session.get_blob_chunks([blob.hash for blob in blobs if blob.is_chunked()]).items()
+		}
+		packed_blobs: Dict[str, PackedBlobInfo] = {
+			h: PackedBlobInfo.of(packed_blob)
+			for h, packed_blob in session.get_packed_blobs([blob.hash for blob in blobs if blob.is_packed()]).items()
+		}
+
+		def validate_one_chunked_blob(blob: BlobInfo):
+			chunks = blob_chunks.get(blob.hash)
+			if chunks is None:
+				result.invalid.append(BadBlobItem(blob, 'chunked blob without chunks'))
+				return
+
+			stored_size = 0
+			for chunk in chunks:
+				if chunk.is_packed():
+					if not chunk.pack_path.is_file():
+						result.missing.append(BadBlobItem(blob, f'pack file {chunk.pack_id} of chunk {chunk.hash} does not exist'))
+						return
+					stored_size += chunk.stored_size
+					continue
+				try:
+					chunk_file_size = chunk.chunk_path.stat().st_size
+				except FileNotFoundError:
+					result.missing.append(BadBlobItem(blob, f'chunk file {chunk.hash} does not exist'))
+					return
+				if chunk_file_size != chunk.stored_size:
+					result.mismatched.append(BadBlobItem(blob, f'chunk {chunk.hash} stored size mismatch, expect {chunk.stored_size}, found {chunk_file_size}'))
+					return
+				stored_size += chunk.stored_size
+
+			try:
+				with chunk_utils.open_chunks_decompressed(chunks) as f_decompressed:
+					sah = hash_utils.calc_reader_size_and_hash(f_decompressed)
+			except Exception as e:
+				result.corrupted.append(BadBlobItem(blob, f'cannot read and decompress chunks: ({type(e)} {e}'))
+				return
+
+			if stored_size != blob.stored_size:
+				result.mismatched.append(BadBlobItem(blob, f'stored size mismatch, expect {blob.stored_size}, found {stored_size}'))
+				return
+			if sah.hash != blob.hash:
+				result.mismatched.append(BadBlobItem(blob, f'hash mismatch, expect {blob.hash}, found {sah.hash}'))
+				return
+			if sah.size != blob.raw_size:
+				result.mismatched.append(BadBlobItem(blob, f'raw size mismatch, expect {blob.raw_size}, found {sah.size}'))
+				return
+
+			# it's a good blob
+			hash_to_blobs[blob.hash] = blob
+
+		def validate_one_packed_blob(blob: BlobInfo):
+			if (packed_blob := packed_blobs.get(blob.hash)) is None:
+				result.invalid.append(BadBlobItem(blob, 'packed blob without pack location'))
+				return
+			if not packed_blob.pack_path.is_file():
+				result.missing.append(BadBlobItem(blob, f'pack file {packed_blob.pack_id} does not exist'))
+				return
+			if packed_blob.length != blob.stored_size:
+				result.mismatched.append(BadBlobItem(blob, f'stored size mismatch, expect {blob.stored_size}, found {packed_blob.length}'))
+				return
+
+			try:
+				with blob_utils.open_blob_decompressed(blob.hash, blob.compress, packed_blob) as f_decompressed:
+					sah = hash_utils.calc_reader_size_and_hash(f_decompressed)
+			except Exception as e:
+				result.corrupted.append(BadBlobItem(blob, f'cannot read and decompress packed blob in pack {packed_blob.pack_id}: ({type(e)} {e}'))
+				return
+
+			if sah.hash != blob.hash:
+				result.mismatched.append(BadBlobItem(blob, f'hash mismatch, expect {blob.hash}, found {sah.hash}'))
+				return
+			if sah.size != blob.raw_size:
+				result.mismatched.append(BadBlobItem(blob, f'raw size mismatch, expect {blob.raw_size}, found {sah.size}'))
+				return
+
+			# it's a good blob
+			hash_to_blobs[blob.hash] = blob
 
 		def validate_one_blob(blob: BlobInfo):
+			if blob.is_chunked():
+				validate_one_chunked_blob(blob)
+				return
+			if blob.is_packed():
+				validate_one_packed_blob(blob)
+				return
+
 			blob_path = blob_utils.get_blob_path(blob.hash)
 
 			if not blob_path.is_file():
@@ -84,10 +173,13 @@ class ValidateBlobsAction(Action[ValidateBlobsResult]):
 				result.validated += 1
 				pool.submit(validate_one_blob, b)
 
-		orphan_hashes = set(session.filtered_orphan_blob_hashes(list(hash_to_blobs.keys())))
+		# blob.file_count is the reference count stored in the database, see run()
+		ref_counts = session.calc_blob_ref_counts(list(hash_to_blobs.keys()))
 		for h, b in hash_to_blobs.items():
-			if h in orphan_hashes:
+			if (ref_count := ref_counts[h]) == 0:
 				result.orphan.append(BadBlobItem(b, f'orphan blob with 0 associated file, hash {h}'))
+			elif ref_count != b.file_count:
+				result.invalid.append(BadBlobItem(b, f'reference count mismatch, expect {ref_count}, found {b.file_count}'))
 			else:
 				result.ok += 1
 
@@ -98,12 +190,12 @@ class ValidateBlobsAction(Action[ValidateBlobsResult]):
 		with DbAccess.open_session() as session:
 			result.total = session.get_blob_count()
 			cnt = 0
-			for blobs in session.iterate_blob_batch():
+			for blobs in session.iterate_blob_batch(expunge=True):
 				if self.is_interrupted.is_set():
 					break
 				cnt += len(blobs)
 				self.logger.info('Validating {} / {} blobs'.format(cnt, result.total))
-				self.__validate(session, result, list(map(BlobInfo.of, blobs)))
+				self.__validate(session, result, [BlobInfo.of(blob, file_count=blob.ref_count) for blob in blobs])
 
 			bad_blob_hashes = []
 			bad_blob_hashes.extend([bbi.blob.hash for bbi in result.invalid])
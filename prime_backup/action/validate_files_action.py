@@ -3,6 +3,7 @@ import dataclasses
 from typing import List, Dict
 
 from prime_backup.action import Action
+from prime_backup.db import db_constants
 from prime_backup.db.access import DbAccess
 from prime_backup.db.session import DbSession
 from prime_backup.types.blob_info import BlobInfo
@@ -70,6 +71,8 @@ class ValidateFilesAction(Action[ValidateFilesResult]):
 					result.file_blob_mismatched.append(BadFileItem(file, f'file with missing blob {h}'))
 				elif file_blob.hash != blob.hash:
 					result.file_blob_mismatched.append(BadFileItem(file, f'mismatched blob data, blob hash should be {blob.hash}, but file blob hash is {file_blob.hash}'))
+				elif file_blob.storage_method.name != blob.storage_method:
+					result.file_blob_mismatched.append(BadFileItem(file, f'mismatched blob data, blob storage_method should be {blob.storage_method}, but file blob storage_method is {file_blob.storage_method.name}'))
 				elif file_blob.compress.name != blob.compress:
 					result.file_blob_mismatched.append(BadFileItem(file, f'mismatched blob data, blob compress should be {blob.compress}, but file blob compress is {file_blob.compress.name}'))
 				elif file_blob.raw_size != blob.raw_size:
@@ -86,9 +89,11 @@ class ValidateFilesAction(Action[ValidateFilesResult]):
 		with DbAccess.open_session() as session:
 			result.total = session.get_file_count()
 			cnt = 0
-			for files in session.iterate_file_batch():
+			for files in session.iterate_file_batch(expunge=True):
 				if self.is_interrupted.is_set():
 					break
+				# the deletion marks of the delta backups are not files, and are excluded from the file count
+				files = [file for file in files if file.mode != db_constants.DELETED_FILE_MODE]
 				cnt += len(files)
 				if cnt % 50000 == 0 or cnt == result.total:
 					self.logger.info('Validating {} / {} files'.format(cnt, result.total))
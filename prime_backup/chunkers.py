@@ -0,0 +1,148 @@
+import dataclasses
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Iterator, Union, Optional, List, Tuple, Generator
+
+
+class Chunker(ABC):
+	@dataclasses.dataclass(frozen=True)
+	class Piece:
+		offset: int
+		data: Union[bytes, memoryview]
+
+	@classmethod
+	@abstractmethod
+	def ensure_lib(cls):
+		...
+
+	@abstractmethod
+	def cut_stream(self, f_in: BinaryIO) -> Iterator[Piece]:
+		"""
+		Split the stream into pieces. The concatenation of all pieces is the whole stream
+
+		Notes: the data of a piece is only guaranteed to be valid before the next piece is generated
+		"""
+		...
+
+
+class FastCdcChunker(Chunker):
+	"""
+	Content-defined chunking with the FastCDC algorithm. An insertion / deletion inside the stream
+	only affects the pieces nearby, so the rest of the pieces can still be deduplicated
+	"""
+
+	def __init__(self, avg_size: int):
+		self.__cdc = self._lib().FastCDC(avg_size)
+
+	@classmethod
+	def _lib(cls):
+		# noinspection PyPackageRequirements
+		import pyfastcdc
+		return pyfastcdc
+
+	@classmethod
+	def ensure_lib(cls):
+		cls._lib()
+
+	def cut_stream(self, f_in: BinaryIO) -> Iterator[Chunker.Piece]:
+		for chunk in self.__cdc.cut_stream(f_in):
+			yield self.Piece(chunk.offset, chunk.data)
+
+
+class AnvilRegionChunker(Chunker):
+	"""
+	Split a Minecraft Anvil region file (.mca) along its own structure: the 8KiB header
+	(the location table and the timestamp table), and the payload of each chunk in the sectors.
+	A chunk that is not modified always produces the same piece, no matter where it is placed in the file
+
+	Free sectors, the padding after each chunk payload, and anything that cannot be parsed are emitted as raw pieces,
+	so the concatenation of all pieces is still exactly the whole file
+	"""
+
+	SECTOR_SIZE = 4096
+	HEADER_SIZE = 2 * SECTOR_SIZE
+	FILE_SUFFIXES = ('.mca',)
+
+	__MAX_RAW_PIECE_SIZE = 1024 * 1024  # 1MiB
+
+	@classmethod
+	def ensure_lib(cls):
+		pass
+
+	@classmethod
+	def is_region_file(cls, file_name: str) -> bool:
+		return file_name.endswith(cls.FILE_SUFFIXES)
+
+	@classmethod
+	def __read_exactly(cls, f_in: BinaryIO, n: int) -> memoryview:
+		buf = bytearray(n)
+		view = memoryview(buf)
+		pos = 0
+		while pos < n:
+			data = f_in.read(n - pos)
+			if not data:
+				break
+			view[pos:pos + len(data)] = data
+			pos += len(data)
+		return view[:pos]
+
+	def __cut_raw(self, f_in: BinaryIO, offset: int, length: Optional[int]) -> Generator[Chunker.Piece, None, bool]:
+		"""
+		:return: True if the end of the stream is reached
+		"""
+		end = offset + length if length is not None else None
+		while end is None or offset < end:
+			size = self.__MAX_RAW_PIECE_SIZE if end is None else min(self.__MAX_RAW_PIECE_SIZE, end - offset)
+			data = self.__read_exactly(f_in, size)
+			if len(data) > 0:
+				yield self.Piece(offset, data)
+				offset += len(data)
+			if len(data) < size:
+				return True
+		return False
+
+	def __iterate_chunk_sectors(self, header: memoryview) -> Iterator[Tuple[int, int]]:
+		"""
+		:return: an iterator of (start offset, sector bytes) of all present chunks, ordered by their positions
+		"""
+		locations: List[Tuple[int, int]] = []
+		for i in range(1024):
+			sector_offset = int.from_bytes(header[i * 4:i * 4 + 3], 'big')
+			sector_count = header[i * 4 + 3]
+			if sector_offset * self.SECTOR_SIZE >= self.HEADER_SIZE and sector_count > 0:
+				locations.append((sector_offset * self.SECTOR_SIZE, sector_count * self.SECTOR_SIZE))
+		locations.sort()
+		return iter(locations)
+
+	def cut_stream(self, f_in: BinaryIO) -> Iterator[Chunker.Piece]:
+		header = self.__read_exactly(f_in, self.HEADER_SIZE)
+		if len(header) > 0:
+			yield self.Piece(0, header)
+		if len(header) < self.HEADER_SIZE:
+			return
+
+		pos = self.HEADER_SIZE
+		for start, sector_bytes in self.__iterate_chunk_sectors(header):
+			if start < pos:
+				# overlapped with the previous chunk (a broken location table?), the bytes are already emitted
+				continue
+
+			# the free sectors between chunks
+			if (yield from self.__cut_raw(f_in, pos, start - pos)):
+				return
+
+			sectors = self.__read_exactly(f_in, sector_bytes)
+			if len(sectors) >= 4:
+				# 4 bytes length, then {length} bytes of compression type + compressed data
+				payload_size = min(4 + int.from_bytes(sectors[:4], 'big'), len(sectors))
+			else:
+				payload_size = len(sectors)
+			if payload_size > 0:
+				yield self.Piece(start, sectors[:payload_size])
+			if payload_size < len(sectors):
+				yield self.Piece(start + payload_size, sectors[payload_size:])
+			pos = start + len(sectors)
+			if len(sectors) < sector_bytes:
+				return
+
+		# the trailing bytes after the last chunk
+		yield from self.__cut_raw(f_in, pos, None)
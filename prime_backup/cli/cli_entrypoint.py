@@ -3,6 +3,7 @@ import contextlib
 import enum
 import functools
 import json
+import sqlite3
 import sys
 import zipfile
 from pathlib import Path
@@ -22,11 +23,12 @@ from prime_backup.db.access import DbAccess
 from prime_backup.db.migration import BadDbVersion
 from prime_backup.exceptions import BackupNotFound, BackupFileNotFound
 from prime_backup.logger import get as get_logger
+from prime_backup.types.backup_creation_stats import BackupCreationPhase
 from prime_backup.types.backup_filter import BackupFilter
 from prime_backup.types.standalone_backup_format import StandaloneBackupFormat
 from prime_backup.types.tar_format import TarFormat
 from prime_backup.types.units import ByteCount
-from prime_backup.utils import log_utils
+from prime_backup.utils import log_utils, db_backup_utils
 
 __all__ = ['cli_entry']
 
@@ -94,7 +96,8 @@ class CliHandler:
 
 		logger.info('Storage root set to {!r}'.format(config.storage_root))
 		try:
-			DbAccess.init(create=False, migrate=migrate)
+			# the CLI uses the default config, do not let it change the journal mode of the database owned by the plugin
+			DbAccess.init(create=False, migrate=migrate, keep_journal_mode=True)
 		except BadDbVersion as e:
 			logger.info('Load database failed, you need to ensure the database is accessible with MCDR plugin: {}'.format(e))
 			sys.exit(1)
@@ -144,6 +147,9 @@ class CliHandler:
 		logger.info('Blob count: %s', result.blob_count)
 		logger.info('Blob stored size sum: %s (%s)', result.blob_stored_size_sum, ByteCount(result.blob_stored_size_sum).auto_str())
 		logger.info('Blob raw size sum: %s (%s)', result.blob_raw_size_sum, ByteCount(result.blob_raw_size_sum).auto_str())
+		logger.info('Chunk count: %s', result.chunk_count)
+		logger.info('Chunk stored size sum: %s (%s)', result.chunk_stored_size_sum, ByteCount(result.chunk_stored_size_sum).auto_str())
+		logger.info('Chunk raw size sum: %s (%s)', result.chunk_raw_size_sum, ByteCount(result.chunk_raw_size_sum).auto_str())
 		logger.info('File count: %s', result.file_count)
 		logger.info('File raw size sum: %s (%s)', result.file_raw_size_sum, ByteCount(result.file_raw_size_sum).auto_str())
 
@@ -161,6 +167,17 @@ class CliHandler:
 		logger.info('%s', f'Size (stored): {ByteCount(ss).auto_str()} ({ss}) ({100 * ss / rs:.2f}%)')
 		logger.info('%s', f'Size (raw): {ByteCount(rs).auto_str()} ({rs})')
 		logger.info('%s', f'Creator: type={backup.creator.type!r} name={backup.creator.name!r}')
+		if (cs := backup.creation_stats) is not None:
+			phase_costs = ', '.join(f'{phase.name} {cost:.2f}s' for phase in BackupCreationPhase if (cost := cs.get_phase_cost(phase)) is not None)
+			policy_counts = ', '.join(f'{name} {cnt}' for name, cnt in cs.policy_counts.items())
+			logger.info('%s', 'Creation stats:')
+			logger.info('%s', f'  Time cost: {cs.total_cost:.2f}s')
+			logger.info('%s', f'  Phase costs: {phase_costs}')
+			logger.info('%s', f'  Bytes read: {ByteCount(cs.bytes_read).auto_str()} ({cs.bytes_read}), written: {ByteCount(cs.bytes_written).auto_str()} ({cs.bytes_written})')
+			logger.info('%s', f'  Blobs: {cs.blob_reused} reused, {cs.blob_created} created')
+			if cs.probe_hit + cs.probe_miss > 0:
+				logger.info('%s', f'  Compress probe: {cs.probe_hit} hits (raw size {ByteCount(cs.probe_hit_raw_size).auto_str()}), {cs.probe_miss} misses')
+			logger.info('%s', f'  Blob create policies: {policy_counts}')
 		logger.info('%s', f'Tags (size={len(backup.tags)}){":" if len(backup.tags) > 0 else ""}')
 		for k, v in backup.tags.items():
 			logger.info('%s', f'  {k}: {v}')
@@ -262,6 +279,28 @@ class CliHandler:
 		result = GetDbOverviewAction().run()
 		logger.info('Current DB version: {}'.format(result.db_version))
 
+	def cmd_restore_db_backup(self):
+		input_path = Path(self.args.input)
+		output_path = Path(self.args.output)
+		if output_path.exists():
+			logger.error('Output file {!r} already exists'.format(output_path.as_posix()))
+			sys.exit(1)
+
+		try:
+			chain = db_backup_utils.get_db_backup_chain(input_path)
+		except (OSError, ValueError) as e:
+			logger.error('Cannot restore database backup {!r}: {}'.format(input_path.as_posix(), e))
+			ErrorReturnCodes.action_failed.sys_exit()
+		logger.info('Restoring database from {} backup files: {}'.format(len(chain), ', '.join(path.name for path in chain)))
+		_, page_count = db_backup_utils.restore_db_backup(input_path, output_path)
+
+		with contextlib.closing(sqlite3.connect(output_path)) as conn:
+			check_result = [row[0] for row in conn.execute('PRAGMA quick_check').fetchall()]
+		if check_result != ['ok']:
+			logger.error('Restored database {!r} failed the integrity check: {}'.format(output_path.as_posix(), check_result))
+			ErrorReturnCodes.action_failed.sys_exit()
+		logger.info('Restored database to {!r}, page count {}'.format(output_path.as_posix(), page_count))
+
 	@classmethod
 	def entrypoint(cls):
 		parser = argparse.ArgumentParser(description='Prime Backup v{} CLI tools'.format(_get_plugin_version()), formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -316,6 +355,11 @@ class CliHandler:
 		desc = 'Migrate the database to the current version {}'.format(db_constants.DB_VERSION)
 		parser_migrate_db = subparsers.add_parser('migrate_db', help=desc, description=desc)
 
+		desc = 'Restore a database file from a database backup file created with the "online" backup method. The --db argument is not used'
+		parser_restore_db_backup = subparsers.add_parser('restore_db_backup', help=desc, description=desc)
+		parser_restore_db_backup.add_argument('input', help='The database backup file. For an incremental backup (*{}), all previous backups in its chain need to be in the same directory'.format(db_backup_utils.INCREMENTAL_BACKUP_SUFFIX))
+		parser_restore_db_backup.add_argument('output', help='The output database file. Example: {}'.format(db_constants.DB_FILE_NAME))
+
 		args = parser.parse_args()
 		if args.command is None:
 			parser.print_help()
@@ -337,6 +381,8 @@ class CliHandler:
 				handler.cmd_extract()
 			elif args.command == 'migrate_db':
 				handler.cmd_migrate_db()
+			elif args.command == 'restore_db_backup':
+				handler.cmd_restore_db_backup()
 			else:
 				logger.error('Unknown command {!r}'.format(args.command))
 		except BackupNotFound as e:
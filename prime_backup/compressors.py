@@ -1,15 +1,21 @@
 import contextlib
 import dataclasses
 import enum
+import io
 import shutil
+import threading
 from abc import abstractmethod, ABC
-from typing import BinaryIO, Union, ContextManager, Tuple
+from typing import BinaryIO, Union, ContextManager, Tuple, Optional, TYPE_CHECKING, Dict
 
 from typing_extensions import Protocol
 
 from prime_backup.utils.bypass_io import BypassReader, BypassWriter
 from prime_backup.utils.path_like import PathLike
 
+if TYPE_CHECKING:
+	import zstandard
+	from prime_backup.types.hash_method import HashMethod
+
 
 class Compressor(ABC):
 	@dataclasses.dataclass(frozen=True)
@@ -40,16 +46,37 @@ class Compressor(ABC):
 	def ensure_lib(cls):
 		...
 
-	def copy_compressed(self, source_path: PathLike, dest_path: PathLike, *, calc_hash: bool = False) -> CopyCompressResult:
+	def copy_compressed(self, source_path: PathLike, dest_path: PathLike, *, calc_hash: bool = False, hash_method: Optional['HashMethod'] = None) -> CopyCompressResult:
 		"""
 		source --[compress]--> destination
 		"""
 		with open(source_path, 'rb') as f_in, open(dest_path, 'wb') as f_out:
-			reader = BypassReader(f_in, calc_hash=calc_hash)
+			reader = BypassReader(f_in, calc_hash=calc_hash, hash_method=hash_method)
 			writer = BypassWriter(f_out)
 			self._copy_compressed(reader, writer)
 			return self.CopyCompressResult(reader.get_read_len(), reader.get_hash(), writer.get_write_len())
 
+	def copy_recompressed(self, source_path: PathLike, dest_path: PathLike, source_method: 'CompressMethod') -> CopyCompressResult:
+		"""
+		source --[decompress with source_method]--[compress]--> destination
+
+		Notes: the read_size of the result is the decompressed size of the source
+		"""
+		with Compressor.create(source_method).open_decompressed(source_path) as f_in, open(dest_path, 'wb') as f_out:
+			reader = BypassReader(f_in, calc_hash=False)
+			writer = BypassWriter(f_out)
+			self._copy_compressed(reader, writer)
+			return self.CopyCompressResult(reader.get_read_len(), reader.get_hash(), writer.get_write_len())
+
+	def compress_bytes(self, data: bytes) -> bytes:
+		"""
+		(data) --[compress]--> (result)
+		"""
+		buf = _UnclosableBytesIO()
+		with self.compress_stream(buf) as f_compressed:
+			f_compressed.write(data)
+		return buf.getvalue()
+
 	def copy_decompressed(self, source_path: PathLike, dest_path: PathLike):
 		"""
 		source --[decompress]--> destination
@@ -126,6 +153,15 @@ class Compressor(ABC):
 		...
 
 
+class _UnclosableBytesIO(io.BytesIO):
+	"""
+	Some compression libraries close the output file object on finish, which discards the content of a BytesIO
+	"""
+
+	def close(self):
+		pass
+
+
 class PlainCompressor(Compressor):
 	@classmethod
 	def ensure_lib(cls):
@@ -186,6 +222,109 @@ class ZstdCompressor(_GzipLikeCompressorBase):
 		return zstandard
 
 
+class ZstdDictCompressor(Compressor):
+	"""
+	zstd with a trained dictionary. It works much better than the plain zstd on small files with similar structures
+
+	The dictionary id is written in the zstd frame header, so the decompression always finds the correct dictionary by itself.
+	Dictionaries are stored in the database, see :class:`prime_backup.db.schema.CompressDict`
+	"""
+
+	__FRAME_HEADER_SIZE_MAX = 18
+	__dict_cache: Dict[int, 'zstandard.ZstdCompressionDict'] = {}
+	__latest_dict_id: Optional[int] = None  # None: unknown yet, 0: no dictionary
+	__lock = threading.Lock()
+
+	@classmethod
+	def _lib(cls):
+		import zstandard
+		return zstandard
+
+	@classmethod
+	def ensure_lib(cls):
+		cls._lib()
+
+	@classmethod
+	def register_dict(cls, dict_id: int, data: bytes, *, latest: bool = False):
+		with cls.__lock:
+			cls.__dict_cache[dict_id] = cls._lib().ZstdCompressionDict(data)
+			if latest:
+				cls.__latest_dict_id = dict_id
+
+	@classmethod
+	def clear_dict_cache(cls):
+		with cls.__lock:
+			cls.__dict_cache.clear()
+			cls.__latest_dict_id = None
+
+	@classmethod
+	def __get_dict(cls, dict_id: int) -> 'zstandard.ZstdCompressionDict':
+		with cls.__lock:
+			if (d := cls.__dict_cache.get(dict_id)) is not None:
+				return d
+
+		from prime_backup.db.access import DbAccess
+		with DbAccess.open_session() as session:
+			compress_dict = session.get_compress_dict_opt(dict_id)
+			if compress_dict is None:
+				raise ValueError('compress dictionary {} does not exist'.format(dict_id))
+			cls.register_dict(compress_dict.id, compress_dict.data)
+		return cls.__get_dict(dict_id)
+
+	@classmethod
+	def __get_latest_dict(cls) -> Optional['zstandard.ZstdCompressionDict']:
+		if cls.__latest_dict_id is None:
+			from prime_backup.db.access import DbAccess
+			with DbAccess.open_session() as session:
+				compress_dict = session.get_latest_compress_dict_opt()
+				if compress_dict is not None:
+					cls.register_dict(compress_dict.id, compress_dict.data, latest=True)
+				else:
+					with cls.__lock:
+						cls.__latest_dict_id = 0
+		if cls.__latest_dict_id == 0:
+			return None
+		return cls.__get_dict(cls.__latest_dict_id)
+
+	@contextlib.contextmanager
+	def compress_stream(self, f_out: BinaryIO) -> ContextManager[BinaryIO]:
+		zstandard = self._lib()
+		cctx = zstandard.ZstdCompressor(dict_data=self.__get_latest_dict())
+		with zstandard.open(f_out, 'wb', cctx=cctx) as compressed_out:
+			yield compressed_out
+
+	@contextlib.contextmanager
+	def decompress_stream(self, f_in: BinaryIO) -> ContextManager[BinaryIO]:
+		zstandard = self._lib()
+		header = f_in.read(self.__FRAME_HEADER_SIZE_MAX)
+		dict_id = zstandard.get_frame_parameters(header).dict_id
+		dctx = zstandard.ZstdDecompressor(dict_data=self.__get_dict(dict_id) if dict_id != 0 else None)
+		with zstandard.open(_PrefixedReader(header, f_in), 'rb', dctx=dctx) as compressed_in:
+			yield compressed_in
+
+
+class _PrefixedReader:
+	"""
+	A reader that reads the given prefix bytes first, then the rest of the given file object
+	"""
+
+	def __init__(self, prefix: bytes, file_obj: BinaryIO):
+		self.prefix = prefix
+		self.file_obj = file_obj
+
+	def read(self, n: int = -1) -> bytes:
+		if len(self.prefix) == 0:
+			return self.file_obj.read(n)
+		if n < 0:
+			data, self.prefix = self.prefix + self.file_obj.read(), b''
+		else:
+			data, self.prefix = self.prefix[:n], self.prefix[n:]
+		return data
+
+	def close(self):
+		pass
+
+
 class Lz4Compressor(_GzipLikeCompressorBase):
 	@classmethod
 	def _lib(cls):
@@ -200,6 +339,7 @@ class CompressMethod(enum.Enum):
 	lzma = LzmaCompressor
 	zstd = ZstdCompressor
 	lz4 = Lz4Compressor
+	zstd_dict = ZstdDictCompressor
 
 	def __repr__(self) -> str:
 		return '{}({!r})'.format(self.__class__.__name__, self.name)
@@ -20,6 +20,29 @@ class BackupConfig(Serializable):
 	hash_method: HashMethod = HashMethod.xxh128
 	compress_method: CompressMethod = CompressMethod.zstd
 	compress_threshold: int = 64
+	compress_process_pool_size: int = 0
+	compress_dict_enabled: bool = False
+	compress_dict_threshold: int = 16 * 1024  # 16KiB
+	compress_dict_size: int = 110 * 1024  # 110KiB
+	compress_probe_enabled: bool = False
+	compress_probe_sample_size: int = 16 * 1024  # 16KiB
+	compress_probe_ratio_cutoff: float = 0.9
+	stat_change_detection: bool = False
+	stat_change_detection_rehash_interval: int = 0
+	change_journal_enabled: bool = False
+	blob_index_enabled: bool = False
+	staged_snapshot_enabled: bool = False
+	log_creation_stats: bool = False
+	chunking_enabled: bool = False
+	chunking_threshold: int = 1024 * 1024  # 1MiB
+	chunking_avg_size: int = 64 * 1024  # 64KiB
+	region_chunking_enabled: bool = False
+	pack_enabled: bool = False
+	pack_threshold: int = 64 * 1024  # 64KiB
+	pack_max_size: int = 64 * 1024 * 1024  # 64MiB
+	pack_compact_threshold: float = 0.5
+	delta_file_set_enabled: bool = False
+	delta_file_set_max_chain_length: int = 16
 
 	def get_compress_method_from_size(self, file_size: int, *, compress_method_override: Optional[CompressMethod] = None) -> CompressMethod:
 		if file_size < self.compress_threshold:
@@ -27,9 +50,25 @@ class BackupConfig(Serializable):
 		else:
 			if compress_method_override is not None:
 				return compress_method_override
+			elif self.compress_dict_enabled and file_size < self.compress_dict_threshold:
+				return CompressMethod.zstd_dict
 			else:
 				return self.compress_method
 
+	def is_stat_change_detection_enabled(self) -> bool:
+		# the staged snapshot mode copies every file to be read, it relies on the stat to skip the unchanged files
+		return self.stat_change_detection or self.staged_snapshot_enabled
+
+	def should_probe_compressibility(self, file_size: int) -> bool:
+		# for files smaller than this, the probe costs about as much as the compression itself
+		return self.compress_probe_enabled and file_size >= 2 * self.compress_probe_sample_size
+
+	def should_use_chunking(self, file_size: int) -> bool:
+		return self.chunking_enabled and file_size >= self.chunking_threshold
+
+	def should_use_pack(self, file_size: int) -> bool:
+		return self.pack_enabled and file_size < self.pack_threshold
+
 	def is_file_ignore_by_deprecated_ignored_files(self, file_name: str) -> bool:
 		for item in self.ignored_files:
 			if len(item) > 0:
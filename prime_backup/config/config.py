@@ -9,6 +9,7 @@ from typing_extensions import Self
 from prime_backup.config.backup_config import BackupConfig
 from prime_backup.config.command_config import CommandConfig
 from prime_backup.config.database_config import DatabaseConfig
+from prime_backup.config.metrics_config import MetricsConfig
 from prime_backup.config.prune_config import PruneConfig
 from prime_backup.config.scheduled_backup_config import ScheduledBackupConfig
 from prime_backup.config.server_config import ServerConfig
@@ -26,6 +27,7 @@ class Config(Serializable):
 	scheduled_backup: ScheduledBackupConfig = ScheduledBackupConfig()
 	prune: PruneConfig = PruneConfig()
 	database: DatabaseConfig = DatabaseConfig()
+	metrics: MetricsConfig = MetricsConfig()
 
 	# ==================== Instance getters ====================
 
@@ -57,10 +59,24 @@ class Config(Serializable):
 	def blobs_path(self) -> Path:
 		return self.storage_path / 'blobs'
 
+	@property
+	def chunks_path(self) -> Path:
+		return self.storage_path / 'chunks'
+
+	@property
+	def packs_path(self) -> Path:
+		return self.storage_path / 'packs'
+
 	@property
 	def temp_path(self) -> Path:
 		return self.storage_path / 'temp'
 
+	@property
+	def metrics_textfile_path(self) -> Path:
+		if len(self.metrics.textfile_path) > 0:
+			return Path(self.metrics.textfile_path)
+		return self.storage_path / 'metrics' / 'prime_backup.prom'
+
 	@property
 	def source_path(self) -> Path:
 		if self.backup.source_root_use_mcdr_working_directory:
@@ -1,7 +1,9 @@
+import enum
+
 from mcdreforged.api.utils import Serializable
 
 from prime_backup.config.config_common import CrontabJobSetting
-from prime_backup.types.units import Duration
+from prime_backup.types.units import Duration, ByteCount
 
 
 class CompactDatabaseConfig(CrontabJobSetting):
@@ -11,13 +13,58 @@ class CompactDatabaseConfig(CrontabJobSetting):
 	jitter = Duration('1m')
 
 
+class DbBackupMethod(enum.Enum):
+	vacuum = enum.auto()  # VACUUM INTO a temp file, then compress it into a .tar.xz file
+	online = enum.auto()  # copy with the SQLite online backup API, then compress it into a .db.zst file, or a .pages.zst file in the incremental mode
+
+
 class BackUpDatabaseConfig(CrontabJobSetting):
 	enabled = True
 	interval = None
 	crontab = '0 6 * * 0'
 	jitter = Duration('1m')
 
+	method: DbBackupMethod = DbBackupMethod.vacuum
+	online_step_pages: int = 4096
+	online_step_sleep: Duration = Duration('10ms')
+	incremental: bool = False
+	incremental_max_chain_length: int = 6
+
+
+class SqliteJournalMode(enum.Enum):
+	# https://www.sqlite.org/pragma.html#pragma_journal_mode
+	delete = enum.auto()
+	truncate = enum.auto()
+	persist = enum.auto()
+	wal = enum.auto()
+
+
+class SqliteSynchronous(enum.Enum):
+	# https://www.sqlite.org/pragma.html#pragma_synchronous
+	off = enum.auto()
+	normal = enum.auto()
+	full = enum.auto()
+	extra = enum.auto()
+
+
+class SqliteTempStore(enum.Enum):
+	# https://www.sqlite.org/pragma.html#pragma_temp_store
+	default = enum.auto()
+	file = enum.auto()
+	memory = enum.auto()
+
+
+class DatabaseTuningConfig(Serializable):
+	journal_mode: SqliteJournalMode = SqliteJournalMode.wal
+	synchronous: SqliteSynchronous = SqliteSynchronous.normal
+	cache_size: ByteCount = ByteCount('32MiB')
+	mmap_size: ByteCount = ByteCount('0')
+	temp_store: SqliteTempStore = SqliteTempStore.default
+	busy_timeout: Duration = Duration('10s')
+	wal_autocheckpoint: int = 1000
+
 
 class DatabaseConfig(Serializable):
 	compact: CompactDatabaseConfig = CompactDatabaseConfig()
 	backup: BackUpDatabaseConfig = BackUpDatabaseConfig()
+	tuning: DatabaseTuningConfig = DatabaseTuningConfig()
@@ -0,0 +1,6 @@
+from mcdreforged.api.utils import Serializable
+
+
+class MetricsConfig(Serializable):
+	enabled: bool = False
+	textfile_path: str = ''  # empty means "metrics/prime_backup.prom" inside the storage root
@@ -1,11 +1,14 @@
 import contextlib
+import sqlite3
 from pathlib import Path
 from typing import Optional, ContextManager
 
-from sqlalchemy import create_engine, Engine
+from sqlalchemy import create_engine, Engine, event, text
 from sqlalchemy.orm import Session
 
+from prime_backup import logger
 from prime_backup.config.config import Config
+from prime_backup.config.database_config import SqliteJournalMode
 from prime_backup.db import db_constants
 from prime_backup.db.migration import DbMigration
 from prime_backup.db.session import DbSession
@@ -15,12 +18,15 @@ from prime_backup.types.hash_method import HashMethod
 class DbAccess:
 	__engine: Optional[Engine] = None
 	__db_file_path: Optional[Path] = None
+	__keep_journal_mode: bool = False
 
 	__hash_method: Optional[HashMethod] = None
 
 	@classmethod
-	def init(cls, create: bool, migrate: bool):
+	def init(cls, create: bool, migrate: bool, *, keep_journal_mode: bool = False):
 		"""
+		:param keep_journal_mode: do not apply the journal_mode in the database tuning config, use the one stored in the database file.
+			For external tools that do not own the database, e.g. the CLI
 		"""
 		db_dir = Config.get().storage_path
 		if create:
@@ -29,18 +35,69 @@ class DbAccess:
 		db_path = db_dir / db_constants.DB_FILE_NAME
 		cls.__engine = create_engine('sqlite:///' + str(db_path))
 		cls.__db_file_path = db_path
+		cls.__keep_journal_mode = keep_journal_mode
+		event.listen(cls.__engine, 'connect', cls.__on_connect)
 
 		migration = DbMigration(cls.__engine)
 		migration.check_and_migrate(create=create, migrate=migrate)
+		cls.checkpoint()  # so the db file itself contains the migrated schema
+
+		from prime_backup.compressors import ZstdDictCompressor
+		ZstdDictCompressor.clear_dict_cache()  # the dictionaries are bound to the database
 
 		cls.sync_hash_method()
 
+	@classmethod
+	def __on_connect(cls, dbapi_connection: sqlite3.Connection, _):
+		tuning = Config.get().database.tuning
+		pragmas = [
+			f'synchronous = {tuning.synchronous.name.upper()}',
+			f'cache_size = {-max(1, tuning.cache_size.value // 1024)}',  # negative value means KiB
+			f'mmap_size = {tuning.mmap_size.value}',
+			f'temp_store = {tuning.temp_store.name.upper()}',
+			f'busy_timeout = {int(tuning.busy_timeout.value * 1000)}',
+			f'wal_autocheckpoint = {tuning.wal_autocheckpoint}',
+		]
+		cursor = dbapi_connection.cursor()
+		try:
+			if not cls.__keep_journal_mode:
+				try:
+					# the journal mode is stored in the db file, it can only be changed if there's no other connections
+					cursor.execute(f'PRAGMA journal_mode = {tuning.journal_mode.name.upper()}')
+				except sqlite3.OperationalError as e:
+					logger.get().warning('Failed to set journal_mode to {}: {}'.format(tuning.journal_mode.name, e))
+			for pragma in pragmas:
+				cursor.execute(f'PRAGMA {pragma}')
+		finally:
+			cursor.close()
+
 	@classmethod
 	def shutdown(cls):
 		if (engine := cls.__engine) is not None:
+			try:
+				cls.checkpoint()
+			except Exception as e:
+				logger.get().warning('Checkpoint on shutdown failed: {}'.format(e))
 			engine.dispose()
 			cls.__engine = None
 
+	@classmethod
+	def checkpoint(cls):
+		"""
+		Move all the content in the WAL file into the db file, then truncate the WAL file,
+		so the db file can be copied or inspected alone. No-op if the WAL journal mode is not used
+
+		Notes: it waits for the ongoing transactions for at most busy_timeout. If the database is still busy,
+		the WAL file is only partially checkpointed
+		"""
+		with cls.__ensure_engine().connect() as conn:
+			if cls.__keep_journal_mode:
+				is_wal = str(conn.execute(text('PRAGMA journal_mode')).scalar_one()).lower() == SqliteJournalMode.wal.name
+			else:
+				is_wal = Config.get().database.tuning.journal_mode == SqliteJournalMode.wal
+			if is_wal:
+				conn.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+
 	@classmethod
 	def sync_hash_method(cls):
 		with cls.open_session() as session:
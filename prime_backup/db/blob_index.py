@@ -0,0 +1,172 @@
+import array
+import bisect
+import heapq
+import threading
+import time
+from typing import Optional, Set, List
+
+from prime_backup import logger
+from prime_backup.db.session import DbSession
+from prime_backup.types.blob_info import BlobInfo
+
+_MAX_PENDING_KEY_COUNT = 100000
+
+
+def _hash_key(h: str) -> int:
+	# the first 64 bits of the hex hash. The order of the keys matches the order of the hashes
+	return int(h[:16], 16)
+
+
+class _SortedKeySet:
+	"""
+	A compact set of uint64, stored as a sorted array, costs 8 bytes per key.
+	New keys are buffered in a python set, and merged into the array in batches
+	"""
+
+	def __init__(self, sorted_keys: Optional[array.array] = None):
+		self.__keys: array.array = sorted_keys if sorted_keys is not None else array.array('Q')
+		self.__pending: Set[int] = set()
+
+	def __contains__(self, key: int) -> bool:
+		if key in self.__pending:
+			return True
+		i = bisect.bisect_left(self.__keys, key)
+		return i < len(self.__keys) and self.__keys[i] == key
+
+	def add(self, key: int):
+		if key not in self:
+			self.__pending.add(key)
+			if len(self.__pending) >= _MAX_PENDING_KEY_COUNT:
+				self.merge()
+
+	def merge(self):
+		if len(self.__pending) > 0:
+			self.__keys = array.array('Q', heapq.merge(self.__keys, sorted(self.__pending)))
+			self.__pending.clear()
+
+	def get_memory_usage(self) -> int:
+		# roughly, a python int in a set takes ~64 bytes
+		return self.__keys.buffer_info()[1] * self.__keys.itemsize + len(self.__pending) * 64
+
+
+class BlobIndex:
+	"""
+	A process-wide in-memory index of the blob hashes and sizes, kept warm between backups,
+	so the blob existence lookups in the backup creation do not need to query the database
+
+	It only tells if a blob definitely does not exist. Keys are truncated to 64 bits, and the keys of the deleted blobs
+	are not removed, so a hit still needs to be confirmed with the database. Memory usage: about 8 bytes per blob for the hashes,
+	plus 8 bytes per distinct blob size
+
+	The index is built lazily on the first use, and is rebuilt when the blob count in the database mismatches,
+	e.g. the database was modified by another process, or when there are too many keys of the deleted blobs
+	"""
+
+	__inst: Optional['BlobIndex'] = None
+
+	@classmethod
+	def get_opt(cls) -> Optional['BlobIndex']:
+		return cls.__inst
+
+	def __init__(self):
+		self.logger = logger.get()
+		self.__lock = threading.Lock()
+
+		# protected by the lock
+		self.__hash_keys: Optional[_SortedKeySet] = None
+		self.__size_keys: Optional[_SortedKeySet] = None
+		self.__blob_count = 0
+		self.__stale_key_count = 0
+
+	def start(self):
+		cls = type(self)
+		if cls.__inst is not None:
+			raise ValueError('double initialization')
+		cls.__inst = self
+
+	def shutdown(self):
+		cls = type(self)
+		if cls.__inst is self:
+			cls.__inst = None
+		self.invalidate()
+
+	def invalidate(self):
+		"""
+		Drop the index. It will be rebuilt on the next :meth:`sync`
+		"""
+		with self.__lock:
+			self.__hash_keys = None
+			self.__size_keys = None
+			self.__blob_count = 0
+			self.__stale_key_count = 0
+
+	def sync(self, session: DbSession):
+		"""
+		Make sure the index is usable. Call it before the lookups in a session
+		"""
+		db_blob_count = session.get_blob_count()
+		with self.__lock:
+			if self.__hash_keys is not None and self.__blob_count == db_blob_count:
+				return
+
+			t = time.time()
+			hash_keys = array.array('Q')
+			sizes: Set[int] = set()
+			blob_count = 0
+			is_sorted = True
+			for blobs in session.iterate_blob_hash_and_size_batch():
+				for h, raw_size in blobs:
+					key = _hash_key(h)
+					if len(hash_keys) == 0 or hash_keys[-1] < key:
+						hash_keys.append(key)
+					elif hash_keys[-1] > key:
+						hash_keys.append(key)
+						is_sorted = False
+					sizes.add(raw_size)
+				blob_count += len(blobs)
+			if not is_sorted:  # should not happen, unless there are malformed hashes
+				hash_keys = array.array('Q', sorted(set(hash_keys)))
+
+			self.__hash_keys = _SortedKeySet(hash_keys)
+			self.__size_keys = _SortedKeySet(array.array('Q', sorted(sizes)))
+			self.__blob_count = blob_count
+			self.__stale_key_count = 0
+			self.logger.info('Built blob index for {} blobs in {}s, memory usage {}KiB'.format(
+				blob_count, round(time.time() - t, 2), self.__get_memory_usage() // 1024,
+			))
+
+	def __get_memory_usage(self) -> int:
+		return sum(keys.get_memory_usage() for keys in [self.__hash_keys, self.__size_keys] if keys is not None)
+
+	def may_have_hash(self, h: str) -> bool:
+		with self.__lock:
+			return self.__hash_keys is None or _hash_key(h) in self.__hash_keys
+
+	def may_have_size(self, raw_size: int) -> bool:
+		with self.__lock:
+			return self.__size_keys is None or raw_size in self.__size_keys
+
+	def on_blobs_created(self, blobs: List[BlobInfo]):
+		"""
+		Call it after the blobs are committed
+		"""
+		with self.__lock:
+			if self.__hash_keys is None:
+				return
+			for blob in blobs:
+				self.__hash_keys.add(_hash_key(blob.hash))
+				self.__size_keys.add(blob.raw_size)
+			self.__blob_count += len(blobs)
+
+	def on_blobs_deleted(self, count: int):
+		"""
+		Call it after the blobs are committed
+		"""
+		with self.__lock:
+			if self.__hash_keys is not None:
+				self.__blob_count -= count
+				self.__stale_key_count += count
+				# the keys of the deleted blobs are kept, rebuild the index if there are too many of them
+				if self.__stale_key_count > max(self.__blob_count, 100000):
+					self.__hash_keys = None
+					self.__size_keys = None
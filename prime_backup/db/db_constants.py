@@ -1,4 +1,7 @@
 DB_MAGIC_INDEX: int = 0
-DB_VERSION: int = 2
+DB_VERSION: int = 12
 
 DB_FILE_NAME = 'prime_backup.db'
+
+# file mode of the file rows in delta backups, which mark the files in the base backup as deleted
+DELETED_FILE_MODE: int = 0
@@ -1,12 +1,14 @@
+import posixpath
 from typing import Dict, Callable, Any, Optional
 
-from sqlalchemy import Engine, Inspector, select
+from sqlalchemy import Engine, Inspector, select, text, update, insert
 from sqlalchemy.orm import Session
 
 from prime_backup import logger
 from prime_backup.config.config import Config
 from prime_backup.db import schema, db_constants
 from prime_backup.exceptions import PrimeBackupError
+from prime_backup.utils import collection_utils
 
 
 class BadDbVersion(PrimeBackupError):
@@ -22,6 +24,16 @@ class DbMigration:
 		self.engine = engine
 		self.migrations: Dict[int, Callable[[Session], Any]] = {
 			2: self.__migrate_1_2,  # 1 -> 2
+			3: self.__migrate_2_3,  # 2 -> 3
+			4: self.__migrate_3_4,  # 3 -> 4
+			5: self.__migrate_4_5,  # 4 -> 5
+			6: self.__migrate_5_6,  # 5 -> 6
+			7: self.__migrate_6_7,  # 6 -> 7
+			8: self.__migrate_7_8,  # 7 -> 8
+			9: self.__migrate_8_9,  # 8 -> 9
+			10: self.__migrate_9_10,  # 9 -> 10
+			11: self.__migrate_10_11,  # 10 -> 11
+			12: self.__migrate_11_12,  # 11 -> 12
 		}
 
 	def check_and_migrate(self, *, create: bool, migrate: bool):
@@ -60,6 +72,7 @@ class DbMigration:
 				version=self.DB_VERSION,
 				hash_method=config.backup.hash_method.name,
 			))
+			session.add(schema.StorageStats(magic=self.DB_MAGIC_INDEX))
 
 	def __migrate_db(self, session: Session, dbm: schema.DbMeta, current_version, target_version):
 		self.logger.info('DB migration starts. current DB version: {}, target version: {}'.format(current_version, target_version))
@@ -77,14 +90,181 @@ class DbMigration:
 		"""
 		from prime_backup.types.backup_tags import BackupTagName
 
-		backups = session.execute(select(schema.Backup)).scalars().all()
+		# Only touch the columns that exist in the v1 backup table. The ORM model selects the columns added by later migrations
+		backup_table = schema.Backup.__table__
 		src_tag = 'pre_restore_backup'
 		dst_tag = BackupTagName.temporary.name
-		for backup in backups:
-			tags = dict(backup.tags)
+		for backup_id, tags in session.execute(select(backup_table.c.id, backup_table.c.tags)).all():
+			tags = dict(tags)
 			if src_tag in tags:
 				tags[dst_tag] = tags.pop(src_tag)
-				backup.tags = tags
+				session.execute(update(backup_table).where(backup_table.c.id == backup_id).values(tags=tags))
 				self.logger.info('Renaming tag {!r} to {!r} for backup #{}, new tags: {}'.format(
-					src_tag, dst_tag, backup.id, backup.tags,
+					src_tag, dst_tag, backup_id, tags,
 				))
+
+	def __migrate_2_3(self, session: Session):
+		"""
+		Stat-based change detection: added column "scan_timestamp" for backup.
+		It's NULL for existing backups, so the next backup reads all files once
+		"""
+		session.execute(text('ALTER TABLE backup ADD COLUMN scan_timestamp BIGINT'))
+
+	def __migrate_3_4(self, session: Session):
+		"""
+		Chunked blob storage: added column "storage_method" for blob and file, added table "chunk" and "blob_chunk"
+		"""
+		from prime_backup.types.blob_storage_method import BlobStorageMethod
+
+		direct = BlobStorageMethod.direct.name
+		session.execute(text('ALTER TABLE blob ADD COLUMN storage_method VARCHAR'))
+		session.execute(text('ALTER TABLE file ADD COLUMN blob_storage_method VARCHAR'))
+		session.execute(text('UPDATE blob SET storage_method = :sm').bindparams(sm=direct))
+		session.execute(text('UPDATE file SET blob_storage_method = :sm WHERE blob_hash IS NOT NULL').bindparams(sm=direct))
+
+		# use the chunk table definition of this version, since later migrations add columns to it
+		session.execute(text('''
+			CREATE TABLE chunk (
+				hash VARCHAR NOT NULL,
+				compress VARCHAR NOT NULL,
+				raw_size BIGINT NOT NULL,
+				stored_size BIGINT NOT NULL,
+				PRIMARY KEY (hash)
+			)
+		'''))
+		schema.BlobChunk.__table__.create(session.connection())
+
+	def __migrate_4_5(self, session: Session):
+		"""
+		Dictionary compression: added table "compress_dict"
+		"""
+		schema.CompressDict.__table__.create(session.connection())
+
+	def __migrate_5_6(self, session: Session):
+		"""
+		Pack files for small blobs and chunks: added table "pack" and "packed_blob", added column "pack_id" and "pack_offset" for chunk
+		"""
+		conn = session.connection()
+		schema.Pack.__table__.create(conn)
+		schema.PackedBlob.__table__.create(conn)
+		session.execute(text('ALTER TABLE chunk ADD COLUMN pack_id INTEGER REFERENCES pack (id)'))
+		session.execute(text('ALTER TABLE chunk ADD COLUMN pack_offset BIGINT'))
+		session.execute(text('CREATE INDEX ix_chunk_pack_id ON chunk (pack_id)'))
+
+	def __migrate_6_7(self, session: Session):
+		"""
+		Backup creation statistics: added column "creation_stats" for backup
+		"""
+		session.execute(text('ALTER TABLE backup ADD COLUMN creation_stats JSON'))
+
+	def __migrate_7_8(self, session: Session):
+		"""
+		Path dictionary: added table "path", column "path" of file is replaced with "path_id"
+		"""
+		conn = session.connection()
+		schema.FilePath.__table__.create(conn)
+
+		# collect all file paths and their parent paths, parents go first
+		parents: Dict[str, Optional[str]] = {}
+		for path in session.execute(text('SELECT DISTINCT path FROM file')).scalars():
+			while path not in parents:
+				parent = posixpath.dirname(path)
+				if parent in ('', path):
+					parents[path] = None
+					break
+				parents[path] = parent
+				path = parent
+		path_ids: Dict[str, int] = {}
+		rows = []
+		for path in sorted(parents.keys(), key=lambda p: (p.count('/'), p)):
+			path_ids[path] = len(path_ids) + 1
+			parent = parents[path]
+			rows.append(dict(id=path_ids[path], path=path, parent_id=path_ids[parent] if parent is not None else None))
+		for view in collection_utils.slicing_iterate(rows, 10000):
+			session.execute(insert(schema.FilePath.__table__), list(view))
+		self.logger.info('Created {} paths in the path table'.format(len(rows)))
+
+		# SQLite cannot alter the primary key, so rebuild the file table.
+		# Use the table definition of this version, in case the schema of the file table changes in the future
+		session.execute(text('DROP INDEX IF EXISTS ix_file_backup_id'))
+		session.execute(text('DROP INDEX IF EXISTS ix_file_blob_hash'))
+		session.execute(text('ALTER TABLE file RENAME TO file_old'))
+		session.execute(text('''
+			CREATE TABLE file (
+				backup_id INTEGER NOT NULL,
+				path_id INTEGER NOT NULL,
+				mode INTEGER NOT NULL,
+				content BLOB,
+				blob_hash VARCHAR,
+				blob_storage_method VARCHAR,
+				blob_compress VARCHAR,
+				blob_raw_size BIGINT,
+				blob_stored_size BIGINT,
+				uid INTEGER,
+				gid INTEGER,
+				ctime_ns BIGINT,
+				mtime_ns BIGINT,
+				atime_ns BIGINT,
+				PRIMARY KEY (backup_id, path_id),
+				FOREIGN KEY(backup_id) REFERENCES backup (id),
+				FOREIGN KEY(path_id) REFERENCES path (id),
+				FOREIGN KEY(blob_hash) REFERENCES blob (hash)
+			)
+		'''))
+		columns = [
+			'backup_id', 'mode', 'content',
+			'blob_hash', 'blob_storage_method', 'blob_compress', 'blob_raw_size', 'blob_stored_size',
+			'uid', 'gid', 'ctime_ns', 'mtime_ns', 'atime_ns',
+		]
+		session.execute(text('INSERT INTO file (path_id, {}) SELECT path.id, {} FROM file_old JOIN path ON path.path = file_old.path'.format(
+			', '.join(columns), ', '.join('file_old.' + c for c in columns),
+		)))
+		session.execute(text('DROP TABLE file_old'))
+		session.execute(text('CREATE INDEX ix_file_backup_id ON file (backup_id)'))
+		session.execute(text('CREATE INDEX ix_file_blob_hash ON file (blob_hash)'))
+		self.logger.info('File table rebuilt. You can run a database vacuum to reclaim the disk space')
+
+	def __migrate_8_9(self, session: Session):
+		"""
+		Delta backups: added column "base_backup_id" for backup
+		"""
+		session.execute(text('ALTER TABLE backup ADD COLUMN base_backup_id INTEGER REFERENCES backup (id)'))
+		session.execute(text('CREATE INDEX ix_backup_base_backup_id ON backup (base_backup_id)'))
+
+	def __migrate_9_10(self, session: Session):
+		"""
+		Blob reference counts: added column "ref_count" for blob
+		"""
+		session.execute(text('ALTER TABLE blob ADD COLUMN ref_count BIGINT NOT NULL DEFAULT 0'))
+		session.execute(text('UPDATE blob SET ref_count = (SELECT count(*) FROM file WHERE file.blob_hash = blob.hash)'))
+
+	def __migrate_10_11(self, session: Session):
+		"""
+		Indexed backup tags: added columns "tag_hidden", "tag_temporary", "tag_protected" and the (timestamp, id) index for backup
+		"""
+		from prime_backup.types.backup_tags import BackupTagName
+
+		for tag_name in BackupTagName:
+			session.execute(text('ALTER TABLE backup ADD COLUMN tag_{0} BOOLEAN'.format(tag_name.name)))
+			session.execute(text('CREATE INDEX ix_backup_tag_{0} ON backup (tag_{0})'.format(tag_name.name)))
+		session.execute(text('CREATE INDEX ix_backup_timestamp_id ON backup (timestamp, id)'))
+
+		# the json column is parsed in python, in case the SQLite does not support json query
+		for backup_id, tags in session.execute(select(schema.Backup.__table__.c.id, schema.Backup.__table__.c.tags)).all():
+			values = {}
+			for tag_name in BackupTagName:
+				value = (tags or {}).get(tag_name.name)
+				values['tag_' + tag_name.name] = value if isinstance(value, tag_name.value.type) else None
+			if any(value is not None for value in values.values()):
+				session.execute(update(schema.Backup.__table__).where(schema.Backup.__table__.c.id == backup_id).values(**values))
+
+	def __migrate_11_12(self, session: Session):
+		"""
+		Materialized storage statistics: added table "storage_stats"
+		"""
+		from prime_backup.db.session import DbSession
+
+		schema.StorageStats.__table__.create(session.connection())
+		session.add(schema.StorageStats(magic=self.DB_MAGIC_INDEX))
+		session.flush()
+		DbSession(session).reconcile_storage_stats()
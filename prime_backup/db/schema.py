@@ -1,7 +1,9 @@
 from typing import Optional, List, get_type_hints, Dict, Any
 
-from sqlalchemy import String, Integer, ForeignKey, BigInteger, JSON, LargeBinary
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy import String, Integer, ForeignKey, BigInteger, JSON, LargeBinary, Boolean, Index, select
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, column_property, validates
+
+from prime_backup.types.backup_tags import BackupTagName
 
 BackupTagDict = Dict[str, Any]
 
@@ -26,24 +28,118 @@ class DbMeta(Base):
 	hash_method: Mapped[str] = mapped_column(String)
 
 
+class StorageStats(Base):
+	"""
+	Statistics of the blob, chunk and file tables, so they do not need to be aggregated with full table scans.
+	It has only one row, which is updated along with the table changes in the same transaction. See DbSession.get_storage_stats
+	"""
+	__tablename__ = 'storage_stats'
+
+	magic: Mapped[int] = mapped_column(Integer, primary_key=True)
+	blob_count: Mapped[int] = mapped_column(BigInteger, default=0)
+	blob_raw_size_sum: Mapped[int] = mapped_column(BigInteger, default=0)
+	blob_stored_size_sum: Mapped[int] = mapped_column(BigInteger, default=0)
+	chunk_count: Mapped[int] = mapped_column(BigInteger, default=0)
+	chunk_raw_size_sum: Mapped[int] = mapped_column(BigInteger, default=0)
+	chunk_stored_size_sum: Mapped[int] = mapped_column(BigInteger, default=0)
+	file_count: Mapped[int] = mapped_column(BigInteger, default=0)  # stored file rows, excluding the deletion marks of delta backups
+	file_raw_size_sum: Mapped[int] = mapped_column(BigInteger, default=0)  # sum of Backup.file_raw_size_sum, i.e. including the inherited files
+
+
 class Blob(Base):
 	__tablename__ = 'blob'
 
 	hash: Mapped[str] = mapped_column(String, primary_key=True)
+	storage_method: Mapped[str] = mapped_column(String)  # see BlobStorageMethod
 	compress: Mapped[str] = mapped_column(String)
 	raw_size: Mapped[int] = mapped_column(BigInteger, index=True)
-	stored_size: Mapped[int] = mapped_column(BigInteger)
+	stored_size: Mapped[int] = mapped_column(BigInteger)  # for chunked blobs, it's the sum of the stored size of its chunks
+	ref_count: Mapped[int] = mapped_column(BigInteger)  # amount of the file rows using this blob. The blob is an orphan if it's 0
 
 	__fields_end__: bool
 
 	files: Mapped[List['File']] = relationship(back_populates='blob', viewonly=True)
 
 
+class Chunk(Base):
+	__tablename__ = 'chunk'
+
+	hash: Mapped[str] = mapped_column(String, primary_key=True)
+	compress: Mapped[str] = mapped_column(String)
+	raw_size: Mapped[int] = mapped_column(BigInteger)
+	stored_size: Mapped[int] = mapped_column(BigInteger)
+	pack_id: Mapped[Optional[int]] = mapped_column(ForeignKey('pack.id'), index=True)  # None for chunks stored as individual chunk files
+	pack_offset: Mapped[Optional[int]] = mapped_column(BigInteger)  # the data length in the pack is the stored_size
+
+
+class BlobChunk(Base):
+	"""
+	The ordered chunk list of a chunked blob
+	"""
+	__tablename__ = 'blob_chunk'
+
+	blob_hash: Mapped[str] = mapped_column(ForeignKey('blob.hash'), primary_key=True)
+	offset: Mapped[int] = mapped_column(BigInteger, primary_key=True)  # offset of the chunk in the raw blob content
+	chunk_hash: Mapped[str] = mapped_column(ForeignKey('chunk.hash'), index=True)
+
+
+class Pack(Base):
+	"""
+	An append-only file in the pack store, which contains the stored data of many small blobs and chunks
+	"""
+	__tablename__ = 'pack'
+	__table_args__ = {'sqlite_autoincrement': True}
+
+	id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+	size: Mapped[int] = mapped_column(BigInteger)  # size of the valid data. Bytes after it are leftovers of interrupted writes
+
+
+class PackedBlob(Base):
+	"""
+	The location of the stored data of a packed blob
+	"""
+	__tablename__ = 'packed_blob'
+
+	blob_hash: Mapped[str] = mapped_column(ForeignKey('blob.hash'), primary_key=True)
+	pack_id: Mapped[int] = mapped_column(ForeignKey('pack.id'), index=True)
+	offset: Mapped[int] = mapped_column(BigInteger)
+	length: Mapped[int] = mapped_column(BigInteger)
+
+
+class CompressDict(Base):
+	"""
+	Trained zstd dictionaries, used by the compress method "zstd_dict".
+	The id is also the dictionary id in the zstd frame headers, which is how a blob references its dictionary
+	"""
+	__tablename__ = 'compress_dict'
+
+	id: Mapped[int] = mapped_column(Integer, primary_key=True)
+	data: Mapped[bytes] = mapped_column(LargeBinary)
+	sample_count: Mapped[int] = mapped_column(Integer)  # amount of blobs used in the training
+	candidate_count: Mapped[int] = mapped_column(Integer)  # amount of blobs that could be used in the training
+	timestamp: Mapped[int] = mapped_column(BigInteger)  # timestamp in nanosecond
+
+
+class FilePath(Base):
+	"""
+	The dictionary of file paths, so the path strings are stored only once instead of in every backup
+	"""
+	__tablename__ = 'path'
+
+	id: Mapped[int] = mapped_column(Integer, primary_key=True)
+	path: Mapped[str] = mapped_column(String, unique=True)
+	parent_id: Mapped[Optional[int]] = mapped_column(ForeignKey('path.id'))  # None for top-level paths
+
+
 class File(Base):
 	__tablename__ = 'file'
 
 	backup_id: Mapped[int] = mapped_column(ForeignKey('backup.id'), primary_key=True, index=True)
-	path: Mapped[str] = mapped_column(String, primary_key=True)
+	path_id: Mapped[int] = mapped_column(ForeignKey('path.id'), primary_key=True)
+
+	# read-only, loaded from the path table. For transient files, it's assigned on creation,
+	# and will be resolved into path_id on insertion. See DbSession.get_or_create_path_ids
+	path: Mapped[str] = column_property(select(FilePath.path).where(FilePath.id == path_id).correlate_except(FilePath).scalar_subquery())
 
 	mode: Mapped[int] = mapped_column(Integer)
 
@@ -52,6 +148,7 @@ class File(Base):
 
 	# store all Blob fields here to speed up blob attribute accessing
 	blob_hash: Mapped[Optional[str]] = mapped_column(ForeignKey('blob.hash'), index=True)
+	blob_storage_method: Mapped[Optional[str]] = mapped_column(String)
 	blob_compress: Mapped[Optional[str]] = mapped_column(String)
 	blob_raw_size: Mapped[Optional[int]] = mapped_column(BigInteger)
 	blob_stored_size: Mapped[Optional[int]] = mapped_column(BigInteger)
@@ -70,7 +167,10 @@ class File(Base):
 
 class Backup(Base):
 	__tablename__ = 'backup'
-	__table_args__ = {'sqlite_autoincrement': True}
+	__table_args__ = (
+		Index('ix_backup_timestamp_id', 'timestamp', 'id'),  # for the "ORDER BY timestamp, id" in backup listing
+		{'sqlite_autoincrement': True},
+	)
 
 	id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True, index=True)
 	timestamp: Mapped[int] = mapped_column(BigInteger)  # timestamp in nanosecond
@@ -83,6 +183,30 @@ class Backup(Base):
 	file_raw_size_sum: Mapped[Optional[int]] = mapped_column(BigInteger)
 	file_stored_size_sum: Mapped[Optional[int]] = mapped_column(BigInteger)
 
+	scan_timestamp: Mapped[Optional[int]] = mapped_column(BigInteger)  # timestamp in nanosecond when the file scan started. None for imported backups
+	creation_stats: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSON)  # see BackupCreationStats. None for imported backups
+
+	# If set, the backup only stores the files that are added, changed or deleted (see DELETED_FILE_MODE) against its base backup,
+	# and the rest of the files are inherited from the base backup. See DbSession.get_backup_files
+	base_backup_id: Mapped[Optional[int]] = mapped_column(ForeignKey('backup.id'), index=True)
+
 	__fields_end__: bool
 
+	# Copies of the well-known tags in BackupTagName, NULL if the tag does not exist. They are indexed for the backup tag filters,
+	# which cannot use an index on the json column. They are synced from the "tags" column automatically, see __sync_tag_columns
+	tag_hidden: Mapped[Optional[bool]] = mapped_column(Boolean, index=True)
+	tag_temporary: Mapped[Optional[bool]] = mapped_column(Boolean, index=True)
+	tag_protected: Mapped[Optional[bool]] = mapped_column(Boolean, index=True)
+
 	files: Mapped[List['File']] = relationship(back_populates='backup', viewonly=True)
+
+	@classmethod
+	def get_tag_column(cls, tag_name: BackupTagName) -> Mapped[Any]:
+		return getattr(cls, 'tag_' + tag_name.name)
+
+	@validates('tags')
+	def __sync_tag_columns(self, _key: str, tags: BackupTagDict) -> BackupTagDict:
+		for tag_name in BackupTagName:
+			value = tags.get(tag_name.name)
+			setattr(self, 'tag_' + tag_name.name, value if isinstance(value, tag_name.value.type) else None)
+		return tags
@@ -1,18 +1,22 @@
+import collections
 import contextlib
 import functools
+import posixpath
 import shutil
 import sqlite3
 import time
 from pathlib import Path
-from typing import Optional, Sequence, Dict, ContextManager, Iterator, Callable
+from typing import Optional, Sequence, Dict, ContextManager, Iterator, Callable, Set, Tuple, Iterable, Any, Type
 from typing import TypeVar, List
 
-from sqlalchemy import select, delete, desc, func, Select, JSON, text
+from sqlalchemy import select, delete, update, insert, desc, func, Select, text, inspect, literal, bindparam, and_, or_, ColumnElement, String, event
 from sqlalchemy.orm import Session
 
 from prime_backup.db import schema, db_constants
+from prime_backup.db.temp_table import TempKeyTable
 from prime_backup.exceptions import BackupNotFound, BackupFileNotFound, BlobNotFound, PrimeBackupError
 from prime_backup.types.backup_filter import BackupFilter, BackupTagFilter
+from prime_backup.types.blob_storage_method import BlobStorageMethod
 from prime_backup.utils import collection_utils, db_utils
 
 _T = TypeVar('_T')
@@ -40,8 +44,15 @@ class DbSession:
 		self.session = session
 		self.db_path = db_path
 
-		# the limit in old sqlite (https://www.sqlite.org/limits.html#max_variable_number)
-		self.__safe_var_limit = 999 - 20
+		# https://www.sqlite.org/limits.html#max_variable_number
+		self.__safe_var_limit = self.__get_max_variable_number() - 20
+		# IN lists larger than this are replaced with a temporary table, see __iterate_in_conditions
+		self.__temp_table_threshold = min(self.__safe_var_limit, 10000)
+
+		# changes of the storage statistics, written to the database right before the commit. See __add_storage_stats
+		self.__storage_stats_deltas: Dict[str, int] = collections.Counter()
+		event.listen(self.session, 'before_commit', self.__on_before_commit)
+		event.listen(self.session, 'after_rollback', self.__on_after_rollback)
 
 	@classmethod
 	def __check_support(cls, check_func: Callable[[], bool], msg: str):
@@ -53,8 +64,8 @@ class DbSession:
 
 	@classmethod
 	@functools.lru_cache
-	def __supports_json_query(cls) -> bool:
-		return cls.__check_support(db_utils.check_sqlite_json_query_support, 'SQLite backend does not support json query. Inefficient manual query is used as the fallback')
+	def __get_max_variable_number(cls) -> int:
+		return db_utils.get_sqlite_max_variable_number()
 
 	@classmethod
 	@functools.lru_cache
@@ -75,6 +86,60 @@ class DbSession:
 	def flush(self):
 		self.session.flush()
 
+	def __iterate_by_keyset(self, s: Select, keys: Sequence[ColumnElement], batch_size: int, expunge: bool, *, scalars: bool = True) -> Iterator[list]:
+		"""
+		Iterate the rows of the given select statement in batches, with the keyset pagination (a.k.a. seek method)
+
+		Unlike LIMIT/OFFSET, the rows before the current batch are skipped with an index seek,
+		so every batch costs the same regardless of its position in the table
+
+		:param keys: the unique key columns, the rows are iterated in the order of them
+		:param expunge: expunge the yielded objects from the session when the next batch is requested,
+			so the memory usage does not grow with the table size. Do not use it if the yielded objects will be modified
+		:param scalars: yield the first column of the rows only. Set it to False for selecting multiple columns
+		"""
+		s = s.order_by(*keys).limit(batch_size)
+		last: Optional[tuple] = None
+		while True:
+			st = s
+			if last is not None:
+				# (k0, k1, ...) > (v0, v1, ...), expanded for SQLite without row value support (< 3.15.0)
+				# the leading "k0 >= v0" lets SQLite seek the index directly
+				cond = keys[-1] > last[-1]
+				for key, value in zip(reversed(keys[:-1]), reversed(last[:-1])):
+					cond = or_(key > value, and_(key == value, cond))
+				st = st.where(and_(keys[0] >= last[0], cond))
+			result = self.session.execute(st)
+			objs = _list_it(result.scalars().all() if scalars else result.all())
+			if len(objs) == 0:
+				break
+			if scalars and not isinstance(objs[-1], schema.Base):  # select of a single column
+				last = (objs[-1],)
+			else:
+				last = tuple(getattr(objs[-1], key.key) for key in keys)
+			yield objs
+			if expunge:
+				for obj in objs:
+					self.session.expunge(obj)
+			if len(objs) < batch_size:
+				break
+
+	def __iterate_in_conditions(self, column: ColumnElement, values: List[Any]) -> Iterator[ColumnElement]:
+		"""
+		Yield "column IN (...)" conditions, which select the given values as a whole
+
+		If there are too many values for a single statement, they are inserted into a temporary table,
+		so a single "column IN (SELECT ...)" condition still does the job, with one query plan and one round trip
+		"""
+		if len(values) == 0:
+			return
+		if len(values) <= self.__temp_table_threshold:
+			yield column.in_(values)
+		else:
+			with self.temp_key_table(key_type=column.type) as table:
+				table.insert_keys(values)
+				yield column.in_(select(table.key))
+
 	def flush_and_expunge_all(self):
 		self.flush()
 		self.expunge_all()
@@ -82,6 +147,20 @@ class DbSession:
 	def commit(self):
 		self.session.commit()
 
+	def bulk_insert(self, objects: Sequence[schema.Base]):
+		"""
+		Insert transient objects of the same type with a Core-level executemany, bypassing the ORM unit of work.
+		The objects are not added to the session, and their server-generated values will not be populated
+		"""
+		if len(objects) == 0:
+			return
+		model = type(objects[0])
+		# skip the column properties that are not columns of the table, e.g. File.path
+		keys = [attr.key for attr in inspect(model).column_attrs if attr.key in model.__table__.columns]
+		# read the instance dict directly, to skip the attribute instrumentation
+		self.session.execute(insert(model.__table__), [{key: obj.__dict__.get(key) for key in keys} for obj in objects])
+		self.__add_object_storage_stats(model, objects, 1)
+
 	@contextlib.contextmanager
 	def no_auto_flush(self) -> ContextManager[None]:
 		with self.session.no_autoflush:
@@ -95,6 +174,7 @@ class DbSession:
 			elif allow_vacuum_into_fallback:
 				self.session.execute(text('VACUUM'))
 				self.session.commit()
+				self.session.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))  # make sure the db file is complete in WAL mode
 				if self.db_path is None:
 					raise RuntimeError('db_path undefined')
 				shutil.copyfile(self.db_path, into_file)
@@ -103,6 +183,42 @@ class DbSession:
 		else:
 			self.session.execute(text('VACUUM'))
 
+	def online_backup(self, into_file: str, *, step_pages: int, step_sleep: float, progress: Optional[Callable[[int, int], Any]] = None):
+		"""
+		Copy the database into the given file with the SQLite online backup API (https://www.sqlite.org/backup.html)
+
+		Unlike "VACUUM INTO", the pages are copied as they are, and the database is only locked during each step,
+		so other connections can access the database between the steps.
+		Notes: if the database is modified by other connections during the copy, the copy restarts from the beginning
+
+		:param step_pages: amount of pages to copy in each step
+		:param step_sleep: time to sleep between the steps in seconds, to reduce the IO pressure
+		:param progress: a callback invoked after each step, with arguments (copied page count, total page count)
+		"""
+		def on_progress(_status: int, remaining: int, total: int):
+			if progress is not None:
+				progress(total - remaining, total)
+			if remaining > 0 and step_sleep > 0:
+				time.sleep(step_sleep)
+
+		source: sqlite3.Connection = self.session.connection().connection.dbapi_connection
+		with contextlib.closing(sqlite3.connect(into_file)) as target:
+			source.backup(target, pages=step_pages, progress=on_progress)
+
+	# =============================== Temporary Table ================================
+
+	@contextlib.contextmanager
+	def temp_key_table(self, key_type=String) -> ContextManager[TempKeyTable]:
+		"""
+		Create a temporary key table for the current connection. It's dropped on exit
+		"""
+		table = TempKeyTable(self.session, key_type=key_type, var_limit=self.__safe_var_limit)
+		table.create()
+		try:
+			yield table
+		finally:
+			table.drop()
+
 	# ==================================== DbMeta ====================================
 
 	def get_db_meta(self) -> schema.DbMeta:
@@ -111,11 +227,95 @@ class DbSession:
 			raise ValueError('None db meta')
 		return meta
 
+	# ============================== Storage Statistics ==============================
+
+	def __on_before_commit(self, _session: Session):
+		self.__write_storage_stats()
+
+	def __on_after_rollback(self, _session: Session):
+		self.__storage_stats_deltas.clear()
+
+	def __add_storage_stats(self, **deltas: int):
+		"""
+		The changes are accumulated, and written to the database once per transaction, instead of once per object
+		"""
+		self.__storage_stats_deltas.update(deltas)
+
+	def __add_object_storage_stats(self, model: Type[schema.Base], objects: Sequence[schema.Base], sign: int):
+		"""
+		:param sign: 1 for inserted objects, -1 for deleted objects
+		"""
+		if model is schema.Blob:
+			self.__add_storage_stats(
+				blob_count=sign * len(objects),
+				blob_raw_size_sum=sign * sum(obj.raw_size for obj in objects),
+				blob_stored_size_sum=sign * sum(obj.stored_size for obj in objects),
+			)
+		elif model is schema.Chunk:
+			self.__add_storage_stats(
+				chunk_count=sign * len(objects),
+				chunk_raw_size_sum=sign * sum(obj.raw_size for obj in objects),
+				chunk_stored_size_sum=sign * sum(obj.stored_size for obj in objects),
+			)
+		elif model is schema.File:
+			# the deletion marks of the delta backups are not files. The file raw size sum is maintained along with the backups,
+			# since a file row of a delta backup might be inherited by many backups, see set_backup_file_size_sums
+			self.__add_storage_stats(file_count=sign * sum(1 for obj in objects if obj.mode != db_constants.DELETED_FILE_MODE))
+
+	def __write_storage_stats(self):
+		deltas = {key: delta for key, delta in self.__storage_stats_deltas.items() if delta != 0}
+		self.__storage_stats_deltas.clear()
+		if len(deltas) > 0:
+			table = schema.StorageStats.__table__
+			self.session.execute(
+				update(table).
+				where(table.c.magic == db_constants.DB_MAGIC_INDEX).
+				values(**{key: table.c[key] + delta for key, delta in deltas.items()})
+			)
+
+	def get_storage_stats(self) -> schema.StorageStats:
+		"""
+		:return: the statistics of the blob, chunk and file tables, without scanning the tables
+		"""
+		self.__write_storage_stats()
+		stats: Optional[schema.StorageStats] = self.session.get(schema.StorageStats, db_constants.DB_MAGIC_INDEX, populate_existing=True)
+		if stats is None:
+			raise ValueError('None storage stats')
+		return stats
+
+	def reconcile_storage_stats(self) -> Dict[str, Tuple[int, int]]:
+		"""
+		Recalculate the storage statistics with full table scans, and overwrite the stored values
+
+		:return: the incorrect fields, field name -> (stored value, actual value)
+		"""
+		stats = self.get_storage_stats()
+		actual_values = {
+			'blob_count': self.get_blob_count(),
+			'blob_raw_size_sum': self.get_blob_raw_size_sum(),
+			'blob_stored_size_sum': self.get_blob_stored_size_sum(),
+			'chunk_count': self.get_chunk_count(),
+			'chunk_raw_size_sum': self.get_chunk_raw_size_sum(),
+			'chunk_stored_size_sum': self.get_chunk_stored_size_sum(),
+			'file_count': self.get_file_count(),
+			'file_raw_size_sum': self.get_file_raw_size_sum(),
+		}
+		incorrect_fields = {}
+		for key, actual_value in actual_values.items():
+			if (stored_value := getattr(stats, key)) != actual_value:
+				incorrect_fields[key] = (stored_value, actual_value)
+				setattr(stats, key, actual_value)
+		return incorrect_fields
+
 	# ===================================== Blob =====================================
 
-	def create_blob(self, **kwargs) -> schema.Blob:
+	def create_blob(self, *, add_to_session: bool = True, **kwargs) -> schema.Blob:
+		# the reference count is increased when the file rows are inserted, see add_blob_ref_counts
+		kwargs.setdefault('ref_count', 0)
 		blob = schema.Blob(**kwargs)
-		self.session.add(blob)
+		if add_to_session:
+			self.session.add(blob)
+			self.__add_object_storage_stats(schema.Blob, [blob], 1)
 		return blob
 
 	def get_blob_count(self) -> int:
@@ -135,8 +335,8 @@ class DbSession:
 		:return: a dict, hash -> optional blob. All given hashes are in the dict
 		"""
 		result: Dict[str, Optional[schema.Blob]] = {h: None for h in hashes}
-		for view in collection_utils.slicing_iterate(hashes, self.__safe_var_limit):
-			for blob in self.session.execute(select(schema.Blob).where(schema.Blob.hash.in_(view))).scalars().all():
+		for cond in self.__iterate_in_conditions(schema.Blob.hash, hashes):
+			for blob in self.session.execute(select(schema.Blob).where(cond)).scalars().all():
 				result[blob.hash] = blob
 		return result
 
@@ -152,18 +352,23 @@ class DbSession:
 		s = select(schema.Blob).where(schema.Blob.hash.startswith(hash_prefix, autoescape=True)).limit(limit)
 		return _list_it(self.session.execute(s).scalars().all())
 
-	def iterate_blob_batch(self, *, batch_size: int = 5000) -> Iterator[List[schema.Blob]]:
-		limit, offset = batch_size, 0
-		while True:
-			blobs = self.list_blobs(limit=limit, offset=offset)
-			if len(blobs) == 0:
-				break
-			yield blobs
-			offset += limit
+	def iterate_blob_batch(self, *, batch_size: int = 5000, expunge: bool = False) -> Iterator[List[schema.Blob]]:
+		"""
+		Iterate all blobs in the order of their hashes. See :meth:`__iterate_by_keyset` for the argument details
+		"""
+		yield from self.__iterate_by_keyset(select(schema.Blob), [schema.Blob.hash], batch_size, expunge)
+
+	def iterate_blob_hash_batch(self, *, batch_size: int = 5000) -> Iterator[List[str]]:
+		"""
+		Iterate all blob hashes in ascending order, without loading all of them into memory
+		"""
+		yield from self.__iterate_by_keyset(select(schema.Blob.hash), [schema.Blob.hash], batch_size, False)
 
-	def get_all_blob_hashes(self) -> List[str]:
-		# TODO: don't load all blob into memory?
-		return _list_it(self.session.execute(select(schema.Blob.hash)).scalars().all())
+	def iterate_blob_hash_and_size_batch(self, *, batch_size: int = 5000) -> Iterator[List[Tuple[str, int]]]:
+		"""
+		Iterate (hash, raw_size) of all blobs in the ascending order of the hashes
+		"""
+		yield from self.__iterate_by_keyset(select(schema.Blob.hash, schema.Blob.raw_size), [schema.Blob.hash], batch_size, False, scalars=False)
 
 	def has_blob_with_size(self, raw_size: int) -> bool:
 		q = self.session.query(schema.Blob).filter_by(raw_size=raw_size).exists()
@@ -171,54 +376,437 @@ class DbSession:
 
 	def has_blob_with_size_batched(self, sizes: List[int]) -> Dict[int, bool]:
 		result = {s: False for s in sizes}
-		for view in collection_utils.slicing_iterate(sizes, self.__safe_var_limit):
-			for size in self.session.execute(select(schema.Blob.raw_size).where(schema.Blob.raw_size.in_(view)).distinct()).scalars().all():
+		for cond in self.__iterate_in_conditions(schema.Blob.raw_size, sizes):
+			for size in self.session.execute(select(schema.Blob.raw_size).where(cond).distinct()).scalars().all():
 				result[size] = True
 		return result
 
-	def get_blob_stored_size_sum(self) -> int:
-		return _int_or_0(self.session.execute(func.sum(schema.Blob.stored_size).select()).scalar_one())
+	def get_blob_stored_size_sum(self, storage_method: Optional[BlobStorageMethod] = None) -> int:
+		s = func.sum(schema.Blob.stored_size).select()
+		if storage_method is not None:
+			s = s.where(schema.Blob.storage_method == storage_method.name)
+		return _int_or_0(self.session.execute(s).scalar_one())
 
 	def get_blob_raw_size_sum(self) -> int:
 		return _int_or_0(self.session.execute(func.sum(schema.Blob.raw_size).select()).scalar_one())
 
 	def delete_blob(self, blob: schema.Blob):
 		self.session.delete(blob)
+		self.__add_object_storage_stats(schema.Blob, [blob], -1)
 
 	def delete_blobs(self, hashes: List[str]):
-		for view in collection_utils.slicing_iterate(hashes, self.__safe_var_limit):
-			self.session.execute(delete(schema.Blob).where(schema.Blob.hash.in_(view)))
+		for cond in self.__iterate_in_conditions(schema.Blob.hash, hashes):
+			cnt, raw_size_sum, stored_size_sum = self.session.execute(
+				select(func.count(), func.sum(schema.Blob.raw_size), func.sum(schema.Blob.stored_size)).where(cond)
+			).one()
+			self.session.execute(delete(schema.Blob).where(cond))
+			self.__add_storage_stats(blob_count=-cnt, blob_raw_size_sum=-_int_or_0(raw_size_sum), blob_stored_size_sum=-_int_or_0(stored_size_sum))
 
 	def filtered_orphan_blob_hashes(self, hashes: List[str]) -> List[str]:
+		"""
+		:return: hashes of the existing blobs with 0 reference count in the given hashes
+		"""
+		orphan_hashes = set()
+		for cond in self.__iterate_in_conditions(schema.Blob.hash, hashes):
+			orphan_hashes.update(
+				self.session.execute(
+					select(schema.Blob.hash).where(cond, schema.Blob.ref_count <= 0)
+				).scalars().all()
+			)
+		return list(filter(lambda h: h in orphan_hashes, hashes))
+
+	def iterate_orphan_blob_hash_batch(self, *, batch_size: int = 5000) -> Iterator[List[str]]:
+		"""
+		Iterate the hashes of the blobs with 0 reference count in ascending order.
+		It's fine to delete the yielded blobs during the iteration
+		"""
+		yield from self.__iterate_by_keyset(select(schema.Blob.hash).where(schema.Blob.ref_count <= 0), [schema.Blob.hash], batch_size, False)
+
+	def add_blob_ref_counts(self, deltas: Dict[str, int]):
+		"""
+		:param deltas: blob hash -> the amount of file rows added (positive) or removed (negative)
+		"""
+		params = [{'h': h, 'delta': delta} for h, delta in deltas.items() if delta != 0]
+		if len(params) == 0:
+			return
+		blob_table = schema.Blob.__table__
+		self.session.execute(
+			update(blob_table).
+			where(blob_table.c.hash == bindparam('h')).
+			values(ref_count=blob_table.c.ref_count + bindparam('delta')),
+			params,
+		)
+
+	def calc_blob_ref_counts(self, hashes: List[str]) -> Dict[str, int]:
+		"""
+		Count the file rows of the given blobs, i.e. the actual reference counts
+
+		:return: a dict, blob hash -> the amount of file rows using the blob. All given hashes are in the dict
+		"""
+		result: Dict[str, int] = {h: 0 for h in hashes}
+		for cond in self.__iterate_in_conditions(schema.File.blob_hash, hashes):
+			for h, cnt in self.session.execute(
+				select(schema.File.blob_hash, func.count()).
+				where(cond).
+				group_by(schema.File.blob_hash)
+			).all():
+				result[h] = cnt
+		return result
+
+	def rebuild_blob_ref_counts(self) -> int:
+		"""
+		Recalculate the reference counts of all blobs from the file table
+
+		:return: the amount of blobs whose reference count was incorrect
+		"""
+		blob_table = schema.Blob.__table__
+		actual_ref_count = (
+			select(func.count()).
+			select_from(schema.File.__table__).
+			where(schema.File.__table__.c.blob_hash == blob_table.c.hash).
+			scalar_subquery()
+		)
+		result = self.session.execute(
+			update(blob_table).
+			where(blob_table.c.ref_count.is_distinct_from(actual_ref_count)).
+			values(ref_count=actual_ref_count)
+		)
+		return result.rowcount
+
+	# ===================================== Chunk ====================================
+
+	def create_chunk(self, **kwargs) -> schema.Chunk:
+		chunk = schema.Chunk(**kwargs)
+		self.session.add(chunk)
+		self.__add_object_storage_stats(schema.Chunk, [chunk], 1)
+		return chunk
+
+	def get_chunk_count(self) -> int:
+		return _int_or_0(self.session.execute(select(func.count()).select_from(schema.Chunk)).scalar_one())
+
+	def get_chunk_opt(self, h: str) -> Optional[schema.Chunk]:
+		return self.session.get(schema.Chunk, h)
+
+	def get_chunks(self, hashes: List[str]) -> Dict[str, Optional[schema.Chunk]]:
+		"""
+		:return: a dict, hash -> optional chunk. All given hashes are in the dict
+		"""
+		result: Dict[str, Optional[schema.Chunk]] = {h: None for h in hashes}
+		for cond in self.__iterate_in_conditions(schema.Chunk.hash, hashes):
+			for chunk in self.session.execute(select(schema.Chunk).where(cond)).scalars().all():
+				result[chunk.hash] = chunk
+		return result
+
+	def list_chunks(self, limit: Optional[int] = None, offset: Optional[int] = None) -> List[schema.Chunk]:
+		s = select(schema.Chunk)
+		if limit is not None:
+			s = s.limit(limit)
+		if offset is not None:
+			s = s.offset(offset)
+		return _list_it(self.session.execute(s).scalars().all())
+
+	def iterate_chunk_batch(self, *, batch_size: int = 5000, expunge: bool = False) -> Iterator[List[schema.Chunk]]:
+		"""
+		Iterate all chunks in the order of their hashes. See :meth:`__iterate_by_keyset` for the argument details
+		"""
+		yield from self.__iterate_by_keyset(select(schema.Chunk), [schema.Chunk.hash], batch_size, expunge)
+
+	def iterate_chunk_hash_batch(self, *, batch_size: int = 5000) -> Iterator[List[str]]:
+		"""
+		Iterate all chunk hashes in ascending order, without loading all of them into memory
+		"""
+		yield from self.__iterate_by_keyset(select(schema.Chunk.hash), [schema.Chunk.hash], batch_size, False)
+
+	def get_chunk_stored_size_sum(self) -> int:
+		return _int_or_0(self.session.execute(func.sum(schema.Chunk.stored_size).select()).scalar_one())
+
+	def get_chunk_raw_size_sum(self) -> int:
+		return _int_or_0(self.session.execute(func.sum(schema.Chunk.raw_size).select()).scalar_one())
+
+	def delete_chunks(self, hashes: List[str]):
+		for cond in self.__iterate_in_conditions(schema.Chunk.hash, hashes):
+			cnt, raw_size_sum, stored_size_sum = self.session.execute(
+				select(func.count(), func.sum(schema.Chunk.raw_size), func.sum(schema.Chunk.stored_size)).where(cond)
+			).one()
+			self.session.execute(delete(schema.Chunk).where(cond))
+			self.__add_storage_stats(chunk_count=-cnt, chunk_raw_size_sum=-_int_or_0(raw_size_sum), chunk_stored_size_sum=-_int_or_0(stored_size_sum))
+
+	def get_packed_chunks_in_pack(self, pack_id: int) -> List[schema.Chunk]:
+		"""
+		:return: the chunks stored in the given pack, ordered by the offset
+		"""
+		s = select(schema.Chunk).where(schema.Chunk.pack_id == pack_id).order_by(schema.Chunk.pack_offset)
+		return _list_it(self.session.execute(s).scalars().all())
+
+	def filtered_orphan_chunk_hashes(self, hashes: List[str]) -> List[str]:
 		good_hashes = set()
-		for view in collection_utils.slicing_iterate(hashes, self.__safe_var_limit):
+		for cond in self.__iterate_in_conditions(schema.BlobChunk.chunk_hash, hashes):
 			good_hashes.update(
 				self.session.execute(
-					select(schema.File.blob_hash).where(schema.File.blob_hash.in_(view)).distinct()
+					select(schema.BlobChunk.chunk_hash).where(cond).distinct()
 				).scalars().all()
 			)
 		return list(filter(lambda h: h not in good_hashes, hashes))
 
+	# =================================== BlobChunk ==================================
+
+	def create_blob_chunk(self, **kwargs) -> schema.BlobChunk:
+		blob_chunk = schema.BlobChunk(**kwargs)
+		self.session.add(blob_chunk)
+		return blob_chunk
+
+	def get_blob_chunks(self, blob_hashes: List[str]) -> Dict[str, List[schema.Chunk]]:
+		"""
+		:return: a dict, blob hash -> chunks of the blob, ordered by the chunk offset. Blobs without chunks are absent in the dict
+		"""
+		result: Dict[str, List[schema.Chunk]] = {}
+		for cond in self.__iterate_in_conditions(schema.BlobChunk.blob_hash, blob_hashes):
+			s = (
+				select(schema.BlobChunk.blob_hash, schema.Chunk).
+				join(schema.Chunk, schema.BlobChunk.chunk_hash == schema.Chunk.hash).
+				where(cond).
+				order_by(schema.BlobChunk.blob_hash, schema.BlobChunk.offset)
+			)
+			for blob_hash, chunk in self.session.execute(s).all():
+				result.setdefault(blob_hash, []).append(chunk)
+		return result
+
+	def get_blob_chunks_by_blob_hashes(self, blob_hashes: List[str]) -> List[schema.BlobChunk]:
+		result = []
+		for cond in self.__iterate_in_conditions(schema.BlobChunk.blob_hash, blob_hashes):
+			result.extend(self.session.execute(select(schema.BlobChunk).where(cond)).scalars().all())
+		return result
+
+	def get_blob_chunks_by_chunk_hashes(self, chunk_hashes: List[str]) -> List[schema.BlobChunk]:
+		result = []
+		for cond in self.__iterate_in_conditions(schema.BlobChunk.chunk_hash, chunk_hashes):
+			result.extend(self.session.execute(select(schema.BlobChunk).where(cond)).scalars().all())
+		return result
+
+	def calc_blob_chunk_stored_size_sum(self, blob_hash: str) -> int:
+		return _int_or_0(self.session.execute(
+			select(func.sum(schema.Chunk.stored_size)).
+			join(schema.BlobChunk, schema.BlobChunk.chunk_hash == schema.Chunk.hash).
+			where(schema.BlobChunk.blob_hash == blob_hash)
+		).scalar_one())
+
+	def delete_blob_chunks(self, blob_hashes: List[str]):
+		for cond in self.__iterate_in_conditions(schema.BlobChunk.blob_hash, blob_hashes):
+			self.session.execute(delete(schema.BlobChunk).where(cond))
+
+	# ===================================== Pack =====================================
+
+	def create_pack(self, **kwargs) -> schema.Pack:
+		pack = schema.Pack(**kwargs)
+		self.session.add(pack)
+		self.session.flush()  # generate the pack id
+		return pack
+
+	def get_pack_count(self) -> int:
+		return _int_or_0(self.session.execute(select(func.count()).select_from(schema.Pack)).scalar_one())
+
+	def get_pack_opt(self, pack_id: int) -> Optional[schema.Pack]:
+		return self.session.get(schema.Pack, pack_id)
+
+	def get_latest_pack_opt(self) -> Optional[schema.Pack]:
+		s = select(schema.Pack).order_by(desc(schema.Pack.id)).limit(1)
+		return self.session.execute(s).scalar_one_or_none()
+
+	def list_packs(self) -> List[schema.Pack]:
+		return _list_it(self.session.execute(select(schema.Pack).order_by(schema.Pack.id)).scalars().all())
+
+	def get_pack_size_sum(self) -> int:
+		return _int_or_0(self.session.execute(func.sum(schema.Pack.size).select()).scalar_one())
+
+	def get_pack_live_sizes(self) -> Dict[int, int]:
+		"""
+		:return: a dict, pack id -> sum of the length of the packed blobs and chunks in the pack. Packs without packed objects are absent in the dict
+		"""
+		result: Dict[int, int] = collections.defaultdict(int)
+		s = select(schema.PackedBlob.pack_id, func.sum(schema.PackedBlob.length)).group_by(schema.PackedBlob.pack_id)
+		for pack_id, size in self.session.execute(s).all():
+			result[pack_id] += _int_or_0(size)
+		s = select(schema.Chunk.pack_id, func.sum(schema.Chunk.stored_size)).where(schema.Chunk.pack_id.is_not(None)).group_by(schema.Chunk.pack_id)
+		for pack_id, size in self.session.execute(s).all():
+			result[pack_id] += _int_or_0(size)
+		return dict(result)
+
+	def delete_pack(self, pack: schema.Pack):
+		self.session.delete(pack)
+
+	# ================================== PackedBlob ==================================
+
+	def create_packed_blob(self, **kwargs) -> schema.PackedBlob:
+		packed_blob = schema.PackedBlob(**kwargs)
+		self.session.add(packed_blob)
+		return packed_blob
+
+	def get_packed_blobs(self, blob_hashes: List[str]) -> Dict[str, schema.PackedBlob]:
+		"""
+		:return: a dict, blob hash -> location of the blob. Blobs that are not packed are absent in the dict
+		"""
+		result: Dict[str, schema.PackedBlob] = {}
+		for cond in self.__iterate_in_conditions(schema.PackedBlob.blob_hash, blob_hashes):
+			for packed_blob in self.session.execute(select(schema.PackedBlob).where(cond)).scalars().all():
+				result[packed_blob.blob_hash] = packed_blob
+		return result
+
+	def get_packed_blobs_in_pack(self, pack_id: int) -> List[schema.PackedBlob]:
+		"""
+		:return: the packed blobs in the given pack, ordered by the offset
+		"""
+		s = select(schema.PackedBlob).where(schema.PackedBlob.pack_id == pack_id).order_by(schema.PackedBlob.offset)
+		return _list_it(self.session.execute(s).scalars().all())
+
+	def delete_packed_blobs(self, blob_hashes: List[str]):
+		for cond in self.__iterate_in_conditions(schema.PackedBlob.blob_hash, blob_hashes):
+			self.session.execute(delete(schema.PackedBlob).where(cond))
+
+	def get_direct_blob_hashes_smaller_than(self, max_size: int) -> List[str]:
+		s = select(schema.Blob.hash).where(
+			schema.Blob.storage_method == BlobStorageMethod.direct.name,
+			schema.Blob.raw_size < max_size,
+		)
+		return _list_it(self.session.execute(s).scalars().all())
+
+	# ================================= CompressDict =================================
+
+	def create_compress_dict(self, **kwargs) -> schema.CompressDict:
+		compress_dict = schema.CompressDict(**kwargs)
+		self.session.add(compress_dict)
+		return compress_dict
+
+	def get_compress_dict_opt(self, dict_id: int) -> Optional[schema.CompressDict]:
+		return self.session.get(schema.CompressDict, dict_id)
+
+	def get_latest_compress_dict_opt(self) -> Optional[schema.CompressDict]:
+		s = select(schema.CompressDict).order_by(desc(schema.CompressDict.id)).limit(1)
+		return self.session.execute(s).scalar_one_or_none()
+
+	def get_unchunked_blob_count_in_size_range(self, min_size: int, max_size: int) -> int:
+		"""
+		:return: the amount of direct or packed blobs with min_size <= raw_size < max_size
+		"""
+		s = select(func.count()).select_from(schema.Blob).where(
+			schema.Blob.storage_method != BlobStorageMethod.chunked.name,
+			schema.Blob.raw_size >= min_size,
+			schema.Blob.raw_size < max_size,
+		)
+		return _int_or_0(self.session.execute(s).scalar_one())
+
+	def sample_unchunked_blobs_in_size_range(self, min_size: int, max_size: int, limit: int) -> List[schema.Blob]:
+		"""
+		:return: at most {limit} random direct or packed blobs with min_size <= raw_size < max_size
+		"""
+		s = select(schema.Blob).where(
+			schema.Blob.storage_method != BlobStorageMethod.chunked.name,
+			schema.Blob.raw_size >= min_size,
+			schema.Blob.raw_size < max_size,
+		).order_by(func.random()).limit(limit)
+		return _list_it(self.session.execute(s).scalars().all())
+
+	# =================================== FilePath ===================================
+
+	def get_path_count(self) -> int:
+		return _int_or_0(self.session.execute(select(func.count()).select_from(schema.FilePath)).scalar_one())
+
+	def get_or_create_path_ids(self, paths: Sequence[str]) -> Dict[str, int]:
+		"""
+		Get the ids of the given paths, the missing paths and their missing parent paths will be created
+
+		:return: a dict of path -> path id. It contains the given paths and all their parent paths
+		"""
+		parents: Dict[str, Optional[str]] = {}
+		for path in paths:
+			while path not in parents:
+				parent = posixpath.dirname(path)
+				if parent in ('', path):
+					parents[path] = None
+					break
+				parents[path] = parent
+				path = parent
+
+		path_ids: Dict[str, int] = {}
+		for cond in self.__iterate_in_conditions(schema.FilePath.path, list(parents.keys())):
+			for path, path_id in self.session.execute(select(schema.FilePath.path, schema.FilePath.id).where(cond)):
+				path_ids[path] = path_id
+
+		# parents go first, so their ids are available when creating their children
+		missing = sorted((path for path in parents.keys() if path not in path_ids), key=lambda p: p.count('/'))
+		if len(missing) > 0:
+			next_id = _int_or_0(self.session.execute(select(func.max(schema.FilePath.id))).scalar_one()) + 1
+			rows = []
+			for path in missing:
+				path_ids[path] = next_id
+				next_id += 1
+				parent = parents[path]
+				rows.append(dict(id=path_ids[path], path=path, parent_id=path_ids[parent] if parent is not None else None))
+			self.session.execute(insert(schema.FilePath.__table__), rows)
+		return path_ids
+
+	def delete_orphan_paths(self) -> int:
+		"""
+		Delete the paths that are neither used by any file, nor the parent of any other path
+
+		:return: the amount of the deleted paths
+		"""
+		used_by_file = select(schema.File.path_id)
+		used_as_parent = select(schema.FilePath.parent_id).where(schema.FilePath.parent_id.is_not(None))
+		# repeat until no more paths are deleted, since a deletion might make the parent path an orphan
+		total = 0
+		while True:
+			result = self.session.execute(
+				delete(schema.FilePath).
+				where(schema.FilePath.id.not_in(used_by_file), schema.FilePath.id.not_in(used_as_parent)).
+				execution_options(synchronize_session=False)
+			)
+			if result.rowcount <= 0:
+				break
+			total += result.rowcount
+		return total
+
 	# ===================================== File =====================================
 
 	def create_file(self, *, add_to_session: bool = True, blob: Optional[schema.Blob] = None, **kwargs) -> schema.File:
 		if blob is not None:
 			kwargs.update(
 				blob_hash=blob.hash,
+				blob_storage_method=blob.storage_method,
 				blob_compress=blob.compress,
 				blob_raw_size=blob.raw_size,
 				blob_stored_size=blob.stored_size,
 			)
+		if add_to_session and 'path' in kwargs and 'path_id' not in kwargs:
+			kwargs['path_id'] = self.get_or_create_path_ids([kwargs['path']])[kwargs['path']]
 		file = schema.File(**kwargs)
 		if add_to_session:
 			self.session.add(file)
+			self.__add_object_storage_stats(schema.File, [file], 1)
 		return file
 
 	def get_file_count(self) -> int:
-		return _int_or_0(self.session.execute(select(func.count()).select_from(schema.File)).scalar_one())
+		"""
+		:return: the amount of the stored file rows, excluding the deletion marks of the delta backups
+		"""
+		return _int_or_0(self.session.execute(select(func.count()).select_from(schema.File).where(schema.File.mode != db_constants.DELETED_FILE_MODE)).scalar_one())
 
 	def get_file_opt(self, backup_id: int, path: str) -> Optional[schema.File]:
-		return self.session.get(schema.File, dict(backup_id=backup_id, path=path))
+		"""
+		Notes: for delta backups, the file might be inherited from a base backup, see :meth:`get_backup_files`
+		"""
+		if (backup := self.get_backup_opt(backup_id)) is None:
+			return None
+		chain_ids = [b.id for b in self.get_backup_chain(backup)]
+		s = (
+			select(schema.File).
+			join(schema.FilePath, schema.File.path_id == schema.FilePath.id).
+			where(schema.File.backup_id.in_(chain_ids), schema.FilePath.path == path)
+		)
+		files: Dict[int, schema.File] = {file.backup_id: file for file in self.session.execute(s).scalars().all()}
+		for chain_id in chain_ids:
+			if (file := files.get(chain_id)) is not None:
+				return file if file.mode != db_constants.DELETED_FILE_MODE else None
+		return None
 
 	def get_file(self, backup_id: int, path: str) -> schema.File:
 		file = self.get_file_opt(backup_id, path)
@@ -226,14 +814,32 @@ class DbSession:
 			raise BackupFileNotFound(backup_id, path)
 		return file
 
+	def get_backup_files(self, backup: schema.Backup) -> List[schema.File]:
+		"""
+		Resolve the effective files of the backup. For delta backups, the files are merged along the backup chain
+
+		Notes: the inherited files are rows of the base backups, i.e. their backup_id is not the id of the given backup
+		"""
+		if backup.base_backup_id is None:
+			return _list_it(backup.files)
+
+		files: Dict[int, schema.File] = {}  # path id -> file
+		for chain_backup in reversed(self.get_backup_chain(backup)):
+			for file in self.session.execute(select(schema.File).where(schema.File.backup_id == chain_backup.id)).scalars().all():
+				files[file.path_id] = file
+		return [file for file in files.values() if file.mode != db_constants.DELETED_FILE_MODE]
+
 	def get_file_raw_size_sum(self) -> int:
-		return _int_or_0(self.session.execute(func.sum(schema.File.blob_raw_size).select()).scalar_one())
+		"""
+		:return: the raw size sum of the files in all backups, including the files that delta backups inherit from their base backups
+		"""
+		return _int_or_0(self.session.execute(func.sum(schema.Backup.file_raw_size_sum).select()).scalar_one())
 
 	def get_file_by_blob_hashes(self, hashes: List[str], *, limit: Optional[int] = None) -> List[schema.File]:
 		hashes = collection_utils.deduplicated_list(hashes)
 		result = []
-		for view in collection_utils.slicing_iterate(hashes, self.__safe_var_limit):
-			st = select(schema.File).where(schema.File.blob_hash.in_(view))
+		for cond in self.__iterate_in_conditions(schema.File.blob_hash, hashes):
+			st = select(schema.File).where(cond)
 			if limit is not None:
 				st = st.limit(max(0, limit - len(result)))
 			result.extend(self.session.execute(st).scalars().all())
@@ -243,11 +849,11 @@ class DbSession:
 
 	def get_file_count_by_blob_hashes(self, hashes: List[str]) -> int:
 		cnt = 0
-		for view in collection_utils.slicing_iterate(hashes, self.__safe_var_limit):
+		for cond in self.__iterate_in_conditions(schema.File.blob_hash, hashes):
 			cnt += _int_or_0(self.session.execute(
 				select(func.count()).
 				select_from(schema.File).
-				where(schema.File.blob_hash.in_(view))
+				where(cond)
 			).scalar_one())
 		return cnt
 
@@ -259,17 +865,21 @@ class DbSession:
 			s = s.offset(offset)
 		return _list_it(self.session.execute(s).scalars().all())
 
-	def iterate_file_batch(self, *, batch_size: int = 5000) -> Iterator[List[schema.File]]:
-		limit, offset = batch_size, 0
-		while True:
-			files = self.list_files(limit=limit, offset=offset)
-			if len(files) == 0:
-				break
-			yield files
-			offset += limit
+	def iterate_file_batch(self, *, batch_size: int = 5000, expunge: bool = False) -> Iterator[List[schema.File]]:
+		"""
+		Iterate all file rows in the order of their primary keys. See :meth:`__iterate_by_keyset` for the argument details
+
+		Notes: the deletion marks of the delta backups are included
+		"""
+		yield from self.__iterate_by_keyset(select(schema.File), [schema.File.backup_id, schema.File.path_id], batch_size, expunge)
 
 	def delete_file(self, file: schema.File):
 		self.session.delete(file)
+		self.__add_object_storage_stats(schema.File, [file], -1)
+
+	def update_file_blob_storage_method(self, blob_hashes: List[str], storage_method: BlobStorageMethod):
+		for cond in self.__iterate_in_conditions(schema.File.blob_hash, blob_hashes):
+			self.session.execute(update(schema.File).where(cond).values(blob_storage_method=storage_method.name))
 
 	def has_file_with_hash(self, h: str):
 		q = self.session.query(schema.File).filter_by(blob_hash=h).exists()
@@ -277,6 +887,9 @@ class DbSession:
 		return exists
 
 	def calc_file_stored_size_sum(self, backup_id: int) -> int:
+		backup = self.get_backup(backup_id)
+		if backup.base_backup_id is not None:
+			return sum(file.blob_stored_size or 0 for file in self.get_backup_files(backup))
 		return _int_or_0(self.session.execute(
 			select(func.sum(schema.File.blob_stored_size)).
 			where(schema.File.backup_id == backup_id)
@@ -284,65 +897,23 @@ class DbSession:
 
 	# ==================================== Backup ====================================
 
-	@classmethod
-	def __needs_manual_backup_tag_filter(cls, backup_filter: Optional[BackupFilter]) -> bool:
-		"""
-		SQLite does not support json query, and the backup filter contains tag filter
-		"""
-		return not cls.__supports_json_query() and backup_filter is not None and len(backup_filter.tag_filters) > 0
-
-	@classmethod
-	def __manual_backup_tag_filter(cls, backup: schema.Backup, backup_filter: BackupFilter) -> bool:
-		tags: schema.BackupTagDict = backup.tags
-		for tf in backup_filter.tag_filters:
-			def check_one() -> bool:
-				if tf.policy == BackupTagFilter.Policy.exists:
-					return tf.name.name in tags
-				elif tf.policy == BackupTagFilter.Policy.not_exists:
-					return tf.name.name not in tags
-				elif tf.policy == BackupTagFilter.Policy.equals:
-					return tf.name.name in tags and tags[tf.name.name] == tf.value
-				elif tf.policy == BackupTagFilter.Policy.not_equals:
-					return tf.name.name not in tags or tags[tf.name.name] != tf.value
-				elif tf.policy == BackupTagFilter.Policy.exists_and_not_equals:
-					return tf.name.name in tags and tags[tf.name.name] != tf.value
-				else:
-					raise ValueError(tf.policy)
-			if not check_one():
-				return False
-		return True
-
 	@classmethod
 	def __sql_backup_tag_filter(cls, s: Select[_T], backup_filter: BackupFilter) -> Select[_T]:
+		# use the indexed tag columns instead of the json column, see schema.Backup.get_tag_column
 		for tf in backup_filter.tag_filters:
-			element = schema.Backup.tags[tf.name.name]
+			column = schema.Backup.get_tag_column(tf.name)
 			if tf.policy == BackupTagFilter.Policy.exists:
-				s = s.filter(element != JSON.NULL)
+				s = s.where(column.is_not(None))
 			elif tf.policy == BackupTagFilter.Policy.not_exists:
-				s = s.filter(element == JSON.NULL)
+				s = s.where(column.is_(None))
 			elif tf.policy in [BackupTagFilter.Policy.equals, BackupTagFilter.Policy.not_equals, BackupTagFilter.Policy.exists_and_not_equals]:
-				value_type = tf.name.value.type
-				if value_type == bool:
-					js_value, value = element.as_boolean(), bool(tf.value)
-				elif value_type == str:
-					js_value, value = element.as_string(), str(tf.value)
-				elif value_type == float:
-					js_value, value = element.as_float(), float(tf.value)
-				elif value_type == int:
-					js_value, value = element.as_integer(), int(tf.value)
-				else:
-					raise TypeError(value_type)
-
+				value = tf.name.value.type(tf.value)
 				if tf.policy == BackupTagFilter.Policy.equals:
-					filter_ = js_value == value
+					s = s.where(column == value)
 				elif tf.policy == BackupTagFilter.Policy.not_equals:
-					filter_ = (js_value != value) | (element == JSON.NULL)
-				elif tf.policy == BackupTagFilter.Policy.exists_and_not_equals:
-					filter_ = js_value != value
-				else:
-					raise ValueError(tf.policy)
-
-				s = s.filter(filter_)
+					s = s.where(or_(column != value, column.is_(None)))
+				else:  # exists_and_not_equals. NULL != value is not true in SQL
+					s = s.where(column != value)
 			else:
 				raise ValueError(tf.policy)
 		return s
@@ -359,8 +930,7 @@ class DbSession:
 			s = s.where(schema.Backup.timestamp >= backup_filter.timestamp_start)
 		if backup_filter.timestamp_end is not None:
 			s = s.where(schema.Backup.timestamp <= backup_filter.timestamp_end)
-		if cls.__supports_json_query():
-			s = cls.__sql_backup_tag_filter(s, backup_filter)
+		s = cls.__sql_backup_tag_filter(s, backup_filter)
 		return s
 
 	def create_backup(self, **kwargs) -> schema.Backup:
@@ -379,15 +949,10 @@ class DbSession:
 		return backup
 
 	def get_backup_count(self, backup_filter: Optional[BackupFilter] = None) -> int:
-		if self.__needs_manual_backup_tag_filter(backup_filter):
-			s = self.__apply_backup_filter(select(schema.Backup), backup_filter)
-			backups = [backup for backup in self.session.execute(s).scalars().all() if self.__manual_backup_tag_filter(backup, backup_filter)]
-			return len(backups)
-		else:
-			s = select(func.count()).select_from(schema.Backup)
-			if backup_filter is not None:
-				s = self.__apply_backup_filter(s, backup_filter)
-			return _int_or_0(self.session.execute(s).scalar_one())
+		s = select(func.count()).select_from(schema.Backup)
+		if backup_filter is not None:
+			s = self.__apply_backup_filter(s, backup_filter)
+		return _int_or_0(self.session.execute(s).scalar_one())
 
 	def get_backup_opt(self, backup_id: int) -> Optional[schema.Backup]:
 		return self.session.get(schema.Backup, backup_id)
@@ -403,51 +968,118 @@ class DbSession:
 		:return: a dict, backup id -> optional Backup. All given ids are in the dict
 		"""
 		result: Dict[int, Optional[schema.Backup]] = {bid: None for bid in backup_ids}
-		for view in collection_utils.slicing_iterate(backup_ids, self.__safe_var_limit):
-			for backup in self.session.execute(select(schema.Backup).where(schema.Backup.id.in_(view))).scalars().all():
+		for cond in self.__iterate_in_conditions(schema.Backup.id, backup_ids):
+			for backup in self.session.execute(select(schema.Backup).where(cond)).scalars().all():
 				result[backup.id] = backup
 		return result
 
 	def get_backup_ids_by_blob_hashes(self, hashes: List[str]) -> List[int]:
-		backup_ids = set()
-		for view in collection_utils.slicing_iterate(hashes, self.__safe_var_limit):
-			backup_ids.update(
-				self.session.execute(
-					select(schema.File.backup_id).
-					where(schema.File.blob_hash.in_(view)).
-					distinct()
-				).scalars().all()
+		file_keys: Set[Tuple[int, int]] = set()
+		for cond in self.__iterate_in_conditions(schema.File.blob_hash, hashes):
+			file_keys.update(
+				(backup_id, path_id)
+				for backup_id, path_id in self.session.execute(
+					select(schema.File.backup_id, schema.File.path_id).
+					where(cond)
+				).all()
 			)
+		return self.get_backup_ids_by_file_keys(file_keys)
+
+	def get_backup_ids_by_file_keys(self, file_keys: Iterable[Tuple[int, int]]) -> List[int]:
+		"""
+		:param file_keys: primary keys of file rows, i.e. (backup_id, path_id) pairs
+		:return: ids of the backups that contain any of the given file rows,
+			including the delta backups that inherit the file rows from their base backups
+		"""
+		backup_ids: Set[int] = set()
+		pending: Dict[int, Set[int]] = collections.defaultdict(set)  # backup id -> path ids
+		for backup_id, path_id in file_keys:
+			pending[backup_id].add(path_id)
+		while len(pending) > 0:
+			backup_id, path_ids = pending.popitem()
+			backup_ids.add(backup_id)
+			for child in self.get_delta_child_backups(backup_id):
+				inherited = set(path_ids)
+				for cond in self.__iterate_in_conditions(schema.File.path_id, list(path_ids)):
+					inherited.difference_update(self.session.execute(
+						select(schema.File.path_id).
+						where(schema.File.backup_id == child.id, cond)
+					).scalars().all())
+				if len(inherited) > 0:
+					pending[child.id].update(inherited)
 		return list(sorted(backup_ids))
 
+	def get_backup_chain(self, backup: schema.Backup) -> List[schema.Backup]:
+		"""
+		:return: the given backup, its base backup, the base backup of its base backup, ..., until a non-delta backup
+		"""
+		chain = [backup]
+		while (base_backup_id := chain[-1].base_backup_id) is not None:
+			chain.append(self.get_backup(base_backup_id))
+		return chain
+
+	def get_delta_child_backups(self, backup_id: int) -> List[schema.Backup]:
+		return _list_it(self.session.execute(select(schema.Backup).where(schema.Backup.base_backup_id == backup_id)).scalars().all())
+
+	def rebase_delta_child_backups(self, backup: schema.Backup) -> List[int]:
+		"""
+		Rebase the delta backups that are based on the given backup onto the base backup of the given backup,
+		so the given backup can be deleted without breaking the backup chains.
+		The files of the given backup that are not overridden by the child backup are copied into the child backup
+
+		:return: ids of the rebased backups
+		"""
+		file_table = schema.File.__table__
+		columns = [column for column in file_table.columns if column.key != 'backup_id']
+		children = self.get_delta_child_backups(backup.id)
+		for child in children:
+			overridden_path_ids = select(schema.File.path_id).where(schema.File.backup_id == child.id)
+			inherited = and_(file_table.c.backup_id == backup.id, file_table.c.path_id.not_in(overridden_path_ids))
+			self.add_blob_ref_counts(dict(self.session.execute(
+				select(file_table.c.blob_hash, func.count()).
+				where(inherited, file_table.c.blob_hash.is_not(None)).
+				group_by(file_table.c.blob_hash)
+			).all()))
+			cnt = self.session.execute(select(func.count()).where(inherited, file_table.c.mode != db_constants.DELETED_FILE_MODE)).scalar_one()
+			self.__add_storage_stats(file_count=cnt)
+			self.session.execute(insert(file_table).from_select(
+				['backup_id', *[column.key for column in columns]],
+				select(literal(child.id), *columns).where(inherited),
+			))
+			if backup.base_backup_id is None:
+				# the child backup becomes a non-delta backup, the deletion marks are no longer needed
+				self.session.execute(delete(schema.File).where(schema.File.backup_id == child.id, schema.File.mode == db_constants.DELETED_FILE_MODE))
+			child.base_backup_id = backup.base_backup_id
+		return [child.id for child in children]
+
+	def get_last_backup_opt(self) -> Optional[schema.Backup]:
+		"""
+		:return: the backup with the largest id, i.e. the latest created backup
+		"""
+		return self.session.execute(select(schema.Backup).order_by(desc(schema.Backup.id)).limit(1)).scalars().first()
+
 	def list_backup(self, backup_filter: Optional[BackupFilter] = None, limit: Optional[int] = None, offset: Optional[int] = None) -> List[schema.Backup]:
 		s = select(schema.Backup)
 		if backup_filter is not None:
 			s = self.__apply_backup_filter(s, backup_filter)
 		s = s.order_by(desc(schema.Backup.timestamp), desc(schema.Backup.id))
+		if offset is not None:
+			s = s.offset(offset)
+		if limit is not None:
+			s = s.limit(limit)
+		return _list_it(self.session.execute(s).scalars().all())
 
-		if self.__needs_manual_backup_tag_filter(backup_filter):
-			backups = [backup for backup in self.session.execute(s).scalars().all() if self.__manual_backup_tag_filter(backup, backup_filter)]
-			if offset is not None:
-				backups = backups[offset:]
-			if limit is not None:
-				backups = backups[:limit]
-			return backups
-		else:
-			if offset is not None:
-				s = s.offset(offset)
-			if limit is not None:
-				s = s.limit(limit)
-			return _list_it(self.session.execute(s).scalars().all())
+	def iterate_backup_batch(self, *, batch_size: int = 5000, expunge: bool = False) -> Iterator[List[schema.Backup]]:
+		"""
+		Iterate all backups in the order of their ids. See :meth:`__iterate_by_keyset` for the argument details
+		"""
+		yield from self.__iterate_by_keyset(select(schema.Backup), [schema.Backup.id], batch_size, expunge)
 
-	def iterate_backup_batch(self, *, batch_size: int = 5000) -> Iterator[List[schema.Backup]]:
-		limit, offset = batch_size, 0
-		while True:
-			backups = self.list_backup(limit=limit, offset=offset)
-			if len(backups) == 0:
-				break
-			yield backups
-			offset += limit
+	def set_backup_file_size_sums(self, backup: schema.Backup, raw_size_sum: int, stored_size_sum: int):
+		self.__add_storage_stats(file_raw_size_sum=raw_size_sum - (backup.file_raw_size_sum or 0))
+		backup.file_raw_size_sum = raw_size_sum
+		backup.file_stored_size_sum = stored_size_sum
 
 	def delete_backup(self, backup: schema.Backup):
+		self.__add_storage_stats(file_raw_size_sum=-(backup.file_raw_size_sum or 0))
 		self.session.delete(backup)
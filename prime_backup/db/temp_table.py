@@ -0,0 +1,76 @@
+import itertools
+from typing import List, Iterable, Iterator, Optional, Any
+
+from sqlalchemy import Table, MetaData, Column, String, select, insert, func
+from sqlalchemy.orm import Session
+
+from prime_backup.utils import collection_utils
+
+_name_counter = itertools.count()
+
+
+class TempKeyTable:
+	"""
+	A SQLite temporary table with a single primary key column, bound to the connection of the session
+
+	It holds a key set on the database side, so a large key set can be processed in bounded memory,
+	or be joined with other tables, instead of being passed around as python lists
+	"""
+
+	def __init__(self, session: Session, *, key_type=String, var_limit: int):
+		self.__session = session
+		self.__var_limit = var_limit
+		self.__insert_batch_size = 5000
+		self.table = Table(
+			'pb_temp_keys_{}'.format(next(_name_counter)), MetaData(),
+			Column('key', key_type, primary_key=True),
+			prefixes=['TEMPORARY'],
+		)
+
+	@property
+	def key(self) -> Column:
+		return self.table.c.key
+
+	def create(self):
+		self.table.create(bind=self.__session.connection())
+
+	def drop(self):
+		# the table is already gone if the transaction was rolled back
+		self.table.drop(bind=self.__session.connection(), checkfirst=True)
+
+	def insert_keys(self, keys: Iterable[Any]):
+		"""
+		Duplicated keys are ignored
+		"""
+		s = insert(self.table).prefix_with('OR IGNORE')
+		it = iter(keys)
+		while len(batch := list(itertools.islice(it, self.__insert_batch_size))) > 0:
+			self.__session.execute(s, [{'key': key} for key in batch])
+
+	def count(self) -> int:
+		return int(self.__session.execute(select(func.count()).select_from(self.table)).scalar_one())
+
+	def iterate_key_batch(self, batch_size: int) -> Iterator[List[Any]]:
+		"""
+		Iterate the keys in ascending order, with the keyset pagination
+		"""
+		s = select(self.key).order_by(self.key).limit(batch_size)
+		last: Optional[Any] = None
+		while True:
+			st = s if last is None else s.where(self.key > last)
+			keys = list(self.__session.execute(st).scalars().all())
+			if len(keys) == 0:
+				break
+			last = keys[-1]
+			yield keys
+			if len(keys) < batch_size:
+				break
+
+	def filter_contained(self, keys: List[Any]) -> List[Any]:
+		"""
+		:return: the given keys that exist in the table, in their original order
+		"""
+		contained = set()
+		for view in collection_utils.slicing_iterate(keys, self.__var_limit):
+			contained.update(self.__session.execute(select(self.key).where(self.key.in_(list(view)))).scalars().all())
+		return [key for key in keys if key in contained]
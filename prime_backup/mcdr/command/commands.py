@@ -30,6 +30,8 @@ from prime_backup.mcdr.task.crontab.show_crontab_task import ShowCrontabJobTask
 from prime_backup.mcdr.task.db.inspect_object_tasks import InspectBackupTask, InspectFileTask, InspectBlobTask
 from prime_backup.mcdr.task.db.migrate_compress_method_task import MigrateCompressMethodTask
 from prime_backup.mcdr.task.db.migrate_hash_method_task import MigrateHashMethodTask
+from prime_backup.mcdr.task.db.rebuild_blob_ref_counts_task import RebuildBlobRefCountsTask
+from prime_backup.mcdr.task.db.reconcile_storage_stats_task import ReconcileStorageStatsTask
 from prime_backup.mcdr.task.db.show_db_overview_task import ShowDbOverviewTask
 from prime_backup.mcdr.task.db.vacuum_sqlite_task import VacuumSqliteTask
 from prime_backup.mcdr.task.db.validate_db_task import ValidateDbTask, ValidateParts
@@ -93,6 +95,12 @@ class CommandManager:
 	def cmd_db_vacuum(self, source: CommandSource, _: CommandContext):
 		self.task_manager.add_task(VacuumSqliteTask(source))
 
+	def cmd_db_rebuild_ref_counts(self, source: CommandSource, _: CommandContext):
+		self.task_manager.add_task(RebuildBlobRefCountsTask(source))
+
+	def cmd_db_reconcile_stats(self, source: CommandSource, _: CommandContext):
+		self.task_manager.add_task(ReconcileStorageStatsTask(source))
+
 	def cmd_db_migrate_compress_method(self, source: CommandSource, context: CommandContext):
 		new_compress_method = context['compress_method']
 		self.task_manager.add_task(MigrateCompressMethodTask(source, new_compress_method))
@@ -296,6 +304,8 @@ class CommandManager:
 		builder.command('database validate blobs', functools.partial(self.cmd_db_validate, parts=ValidateParts.blobs))
 		builder.command('database validate files', functools.partial(self.cmd_db_validate, parts=ValidateParts.files))
 		builder.command('database vacuum', self.cmd_db_vacuum)
+		builder.command('database rebuild_ref_counts', self.cmd_db_rebuild_ref_counts)
+		builder.command('database reconcile_stats', self.cmd_db_reconcile_stats)
 		builder.command('database migrate_compress_method <compress_method>', self.cmd_db_migrate_compress_method)
 		builder.command('database migrate_hash_method <hash_method>', self.cmd_db_migrate_hash_method)
 
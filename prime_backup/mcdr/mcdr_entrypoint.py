@@ -4,21 +4,28 @@ from typing import Optional
 
 from mcdreforged.api.all import *
 
+from prime_backup.chunkers import FastCdcChunker
 from prime_backup.compressors import CompressMethod
 from prime_backup.config.config import Config, set_config_instance
 from prime_backup.db.access import DbAccess
+from prime_backup.db.blob_index import BlobIndex
 from prime_backup.mcdr import mcdr_globals
 from prime_backup.mcdr.command.commands import CommandManager
 from prime_backup.mcdr.crontab_manager import CrontabManager
+from prime_backup.mcdr.metrics_exporter import MetricsExporter
 from prime_backup.mcdr.online_player_counter import OnlinePlayerCounter
 from prime_backup.mcdr.task_manager import TaskManager
 from prime_backup.utils import misc_utils
+from prime_backup.utils.change_journal import ChangeJournal
 
 config: Optional[Config] = None
 task_manager: Optional[TaskManager] = None
 command_manager: Optional[CommandManager] = None
 crontab_manager: Optional[CrontabManager] = None
 online_player_counter: Optional[OnlinePlayerCounter] = None
+change_journal: Optional[ChangeJournal] = None
+blob_index: Optional[BlobIndex] = None
+metrics_exporter: Optional[MetricsExporter] = None
 mcdr_globals.load()
 init_ok = False
 
@@ -32,6 +39,8 @@ def __check_config(server: PluginServerInterface):
 	if (cm := config.backup.compress_method) == CompressMethod.lzma:
 		server.logger.warning('WARN: Using {} as the compress method might significantly increase the backup time'.format(cm.name))
 	cm.value.ensure_lib()
+	if config.backup.chunking_enabled:
+		FastCdcChunker.ensure_lib()
 
 
 def is_enabled() -> bool:
@@ -39,7 +48,7 @@ def is_enabled() -> bool:
 
 
 def on_load(server: PluginServerInterface, old):
-	global config, task_manager, command_manager, crontab_manager, online_player_counter
+	global config, task_manager, command_manager, crontab_manager, online_player_counter, change_journal, blob_index, metrics_exporter
 	try:
 		config = server.load_config_simple(target_class=Config, failure_policy='raise')
 		set_config_instance(config)
@@ -55,6 +64,19 @@ def on_load(server: PluginServerInterface, old):
 		command_manager = CommandManager(server, task_manager, crontab_manager)
 		online_player_counter = OnlinePlayerCounter(server)
 
+		if config.backup.change_journal_enabled:
+			if ChangeJournal.is_supported():
+				change_journal = ChangeJournal(config.source_path)
+				change_journal.start()
+			else:
+				server.logger.warning('Change journal is not supported on the current platform, it requires Linux inotify')
+		if config.backup.blob_index_enabled:
+			blob_index = BlobIndex()
+			blob_index.start()
+		if config.metrics.enabled:
+			metrics_exporter = MetricsExporter(config.metrics_textfile_path)
+			metrics_exporter.start()
+
 		task_manager.start()
 		crontab_manager.start()
 		command_manager.register_commands()
@@ -85,7 +107,7 @@ def on_unload(server: PluginServerInterface):
 	global task_manager, crontab_manager
 
 	def shutdown():
-		global task_manager, crontab_manager
+		global task_manager, crontab_manager, change_journal, blob_index, metrics_exporter
 		try:
 			if command_manager is not None:
 				command_manager.close_the_door()
@@ -95,6 +117,15 @@ def on_unload(server: PluginServerInterface):
 			if task_manager is not None:
 				task_manager.shutdown()
 				task_manager = None
+			if change_journal is not None:
+				change_journal.shutdown()
+				change_journal = None
+			if blob_index is not None:
+				blob_index.shutdown()
+				blob_index = None
+			if metrics_exporter is not None:
+				metrics_exporter.shutdown()
+				metrics_exporter = None
 			DbAccess.shutdown()
 		finally:
 			shutdown_event.set()
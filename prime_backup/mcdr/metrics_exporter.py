@@ -0,0 +1,184 @@
+import dataclasses
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, List, Tuple, Union
+
+from prime_backup import logger
+from prime_backup.action.get_db_overview_action import GetDbOverviewAction, DbOverviewResult
+from prime_backup.action.list_backup_action import ListBackupAction
+from prime_backup.mcdr.task import Task
+from prime_backup.mcdr.task.basic_task import HeavyTask
+from prime_backup.types.backup_info import BackupInfo
+
+_Labels = Dict[str, str]
+_Value = Union[int, float]
+
+
+@dataclasses.dataclass
+class _TaskMetrics:
+	ok_count: int = 0
+	error_count: int = 0
+	duration_sum: float = 0
+	last_duration: float = 0
+
+
+@dataclasses.dataclass(frozen=True)
+class _ValidationMetrics:
+	timestamp: float
+	validated: int
+	bad: int
+
+
+class _PrometheusTextWriter:
+	"""
+	Builds a text in the Prometheus text-based exposition format
+	"""
+
+	def __init__(self):
+		self.__lines: List[str] = []
+
+	@classmethod
+	def __escape(cls, value: str) -> str:
+		return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+	def add(self, name: str, metric_type: str, help_text: str, samples: List[Tuple[_Labels, _Value]]):
+		self.__lines.append('# HELP {} {}'.format(name, help_text))
+		self.__lines.append('# TYPE {} {}'.format(name, metric_type))
+		for labels, value in samples:
+			if len(labels) > 0:
+				label_str = ','.join('{}="{}"'.format(k, self.__escape(v)) for k, v in labels.items())
+				self.__lines.append('{}{{{}}} {}'.format(name, label_str, value))
+			else:
+				self.__lines.append('{} {}'.format(name, value))
+
+	def add_gauge(self, name: str, help_text: str, value: _Value):
+		self.add(name, 'gauge', help_text, [({}, value)])
+
+	def get_text(self) -> str:
+		return '\n'.join(self.__lines) + '\n'
+
+
+class MetricsExporter:
+	"""
+	Writes the metrics of Prime Backup into a textfile in the Prometheus text-based format after every task,
+	so they can be collected by the textfile collector of the Prometheus node_exporter
+
+	Task metrics are counted since the plugin load. Storage metrics are queried from the database,
+	and they are only refreshed after heavy tasks, since other tasks do not change the storage
+	"""
+
+	__inst: Optional['MetricsExporter'] = None
+
+	@classmethod
+	def get_opt(cls) -> Optional['MetricsExporter']:
+		return cls.__inst
+
+	def __init__(self, textfile_path: Path):
+		self.logger = logger.get()
+		self.textfile_path = textfile_path
+		self.__lock = threading.Lock()
+
+		# protected by the lock
+		self.__task_metrics: Dict[str, _TaskMetrics] = {}
+		self.__validation_metrics: Dict[str, _ValidationMetrics] = {}
+		self.__db_overview: Optional[DbOverviewResult] = None
+		self.__last_backup: Optional[BackupInfo] = None
+		self.__storage_dirty = True
+
+	def start(self):
+		cls = type(self)
+		if cls.__inst is not None:
+			raise ValueError('double initialization')
+		cls.__inst = self
+
+	def shutdown(self):
+		cls = type(self)
+		if cls.__inst is self:
+			cls.__inst = None
+
+	def record_validation(self, part: str, validated: int, bad: int):
+		"""
+		:param part: the validated part, e.g. "blobs", "files"
+		"""
+		with self.__lock:
+			self.__validation_metrics[part] = _ValidationMetrics(timestamp=time.time(), validated=validated, bad=bad)
+
+	def on_task_done(self, task: Task, cost: float, ok: bool):
+		with self.__lock:
+			tm = self.__task_metrics.setdefault(task.id, _TaskMetrics())
+			if ok:
+				tm.ok_count += 1
+			else:
+				tm.error_count += 1
+			tm.duration_sum += cost
+			tm.last_duration = cost
+			if isinstance(task, HeavyTask):
+				self.__storage_dirty = True
+
+			try:
+				if self.__storage_dirty:
+					self.__refresh_storage_metrics()
+				self.__write_textfile()
+			except Exception as e:
+				self.logger.warning('Export metrics to {!r} failed: {}'.format(self.textfile_path.as_posix(), e))
+
+	def __refresh_storage_metrics(self):
+		self.__db_overview = GetDbOverviewAction().run()
+		backups = ListBackupAction(limit=1).run()
+		self.__last_backup = backups[0] if len(backups) > 0 else None
+		self.__storage_dirty = False
+
+	def __write_textfile(self):
+		writer = _PrometheusTextWriter()
+
+		writer.add('prime_backup_task_runs_total', 'counter', 'Amount of the finished tasks since the plugin load', [
+			({'task': task_id, 'result': result}, cnt)
+			for task_id, tm in sorted(self.__task_metrics.items())
+			for result, cnt in [('ok', tm.ok_count), ('error', tm.error_count)]
+		])
+		writer.add('prime_backup_task_duration_seconds_total', 'counter', 'Total time cost of the tasks since the plugin load', [
+			({'task': task_id}, tm.duration_sum)
+			for task_id, tm in sorted(self.__task_metrics.items())
+		])
+		writer.add('prime_backup_task_last_duration_seconds', 'gauge', 'Time cost of the last run of the tasks', [
+			({'task': task_id}, tm.last_duration)
+			for task_id, tm in sorted(self.__task_metrics.items())
+		])
+
+		if (ov := self.__db_overview) is not None:
+			writer.add_gauge('prime_backup_db_file_size_bytes', 'Size of the database file', ov.db_file_size)
+			writer.add_gauge('prime_backup_backup_count', 'Amount of backups', ov.backup_count)
+			writer.add_gauge('prime_backup_file_count', 'Amount of the stored file records. Delta backups only store the changed files', ov.file_count)
+			writer.add_gauge('prime_backup_blob_count', 'Amount of blobs', ov.blob_count)
+			writer.add_gauge('prime_backup_chunk_count', 'Amount of chunks', ov.chunk_count)
+			writer.add_gauge('prime_backup_file_raw_size_bytes', 'Raw size sum of the files in all backups, i.e. the bytes ingested', ov.file_raw_size_sum)
+			writer.add_gauge('prime_backup_blob_raw_size_bytes', 'Raw size sum of the blobs, i.e. the ingested bytes after deduplication', ov.blob_raw_size_sum)
+			writer.add_gauge('prime_backup_blob_stored_size_bytes', 'Stored size sum of the blobs', ov.blob_stored_size_sum)
+			writer.add_gauge('prime_backup_chunk_raw_size_bytes', 'Raw size sum of the chunks', ov.chunk_raw_size_sum)
+			writer.add_gauge('prime_backup_chunk_stored_size_bytes', 'Stored size sum of the chunks', ov.chunk_stored_size_sum)
+			writer.add_gauge('prime_backup_dedup_ratio', 'Raw size sum of the files divided by the raw size sum of the blobs', ov.file_raw_size_sum / ov.blob_raw_size_sum if ov.blob_raw_size_sum > 0 else 1)
+
+		if (backup := self.__last_backup) is not None:
+			writer.add_gauge('prime_backup_last_backup_id', 'ID of the latest backup', backup.id)
+			writer.add_gauge('prime_backup_last_backup_timestamp_seconds', 'Creation timestamp of the latest backup', backup.timestamp_ns / 1e9)
+			writer.add_gauge('prime_backup_last_backup_raw_size_bytes', 'Raw size of the latest backup', backup.raw_size)
+			writer.add_gauge('prime_backup_last_backup_stored_size_bytes', 'Stored size of the latest backup', backup.stored_size)
+			if (cs := backup.creation_stats) is not None:
+				writer.add_gauge('prime_backup_last_backup_creation_seconds', 'Time cost of the creation of the latest backup', cs.total_cost)
+				writer.add_gauge('prime_backup_last_backup_read_bytes', 'Bytes read during the creation of the latest backup', cs.bytes_read)
+				writer.add_gauge('prime_backup_last_backup_written_bytes', 'Bytes written during the creation of the latest backup', cs.bytes_written)
+
+		if len(self.__validation_metrics) > 0:
+			vms = sorted(self.__validation_metrics.items())
+			writer.add('prime_backup_validation_timestamp_seconds', 'gauge', 'Timestamp of the last validation', [({'part': part}, vm.timestamp) for part, vm in vms])
+			writer.add('prime_backup_validation_validated_objects', 'gauge', 'Amount of the validated objects in the last validation', [({'part': part}, vm.validated) for part, vm in vms])
+			writer.add('prime_backup_validation_bad_objects', 'gauge', 'Amount of the bad objects found in the last validation', [({'part': part}, vm.bad) for part, vm in vms])
+
+		# write to a temp file then rename, so the collector never reads a partial file
+		self.textfile_path.parent.mkdir(parents=True, exist_ok=True)
+		temp_path = self.textfile_path.parent / (self.textfile_path.name + '.tmp')
+		with open(temp_path, 'w', encoding='utf8') as f:
+			f.write(writer.get_text())
+		os.replace(temp_path, self.textfile_path)
@@ -32,6 +32,16 @@ class CreateBackupTask(HeavyTask[None]):
 		if self.server.is_server_running() and self.config.server.turn_off_auto_save and len(cmds.auto_save_off) > 0:
 			self.server.execute(cmds.auto_save_off)
 			applied_auto_save_off = True
+		cost_staged: Optional[float] = None
+
+		def on_staged():
+			# the source files are copied into the staging area, no need to keep the auto-save off
+			nonlocal applied_auto_save_off, cost_staged
+			cost_staged = timer.get_elapsed()
+			if applied_auto_save_off and len(cmds.auto_save_on) > 0:
+				self.server.execute(cmds.auto_save_on)
+				applied_auto_save_off = False
+
 		try:
 			timer = Timer()
 			if self.server.is_server_running():
@@ -47,13 +57,15 @@ class CreateBackupTask(HeavyTask[None]):
 				self.broadcast(self.tr('abort.unloaded').set_color(RColor.red))
 				return
 
-			action = CreateBackupAction(self.operator, self.comment)
+			action = CreateBackupAction(self.operator, self.comment, on_staged=on_staged)
 			backup = action.run()
 			bls = action.get_new_blobs_summary()
 			cost_create = timer.get_elapsed()
 			cost_total = cost_save_wait + cost_create
 
 			self.logger.info('Time costs: save wait {}s, create backup {}s'.format(round(cost_save_wait, 2), round(cost_create, 2)))
+			if cost_staged is not None:
+				self.logger.info('Staged snapshot mode: source files were released after {}s'.format(round(cost_staged, 2)))
 			self.broadcast(self.tr(
 				'completed',
 				TextComponents.backup_id(backup.id),
@@ -8,6 +8,7 @@ from typing import List, Dict, Union, Optional, Callable
 import pytz
 from mcdreforged.api.all import *
 
+from prime_backup.action.compact_packs_action import CompactPacksAction
 from prime_backup.action.delete_backup_action import DeleteBackupAction
 from prime_backup.action.list_backup_action import ListBackupAction
 from prime_backup.config.prune_config import PruneSetting
@@ -255,6 +256,11 @@ class PruneBackupTask(HeavyTask[PruneBackupResult]):
 					ByteCount(result.deleted_blobs.stored_size).auto_str(), ByteCount(result.deleted_blobs.raw_size).auto_str(),
 				))
 
+			if result.deleted_backup_count > 0 and self.config.backup.pack_enabled:
+				# reclaim the dead spaces left by the deleted packed blobs
+				sd = CompactPacksAction().run()
+				prune_logger.info('Compact packs done, pack store size {} -> {}'.format(ByteCount(sd.before).auto_str(), ByteCount(sd.after).auto_str()))
+
 		if self.verbose >= _PruneVerbose.delete:
 			self.reply_tr(
 				'done',
@@ -3,6 +3,7 @@ from mcdreforged.api.all import *
 from prime_backup.action.get_backup_action import GetBackupAction
 from prime_backup.mcdr.task.basic_task import LightTask
 from prime_backup.mcdr.text_components import TextComponents
+from prime_backup.types.backup_creation_stats import BackupCreationPhase
 from prime_backup.types.backup_tags import BackupTagName
 from prime_backup.types.operator import Operator, PrimeBackupOperatorNames
 from prime_backup.utils.mcdr_utils import mkcmd
@@ -41,6 +42,24 @@ class ShowBackupTask(LightTask[None]):
 			c(RAction.suggest_command, mkcmd(cmd_creator))
 		)
 
+		if (cs := backup.creation_stats) is not None:
+			self.reply_tr('creation_stats.title')
+			self.reply_tr('creation_stats.cost', TextComponents.number(f'{round(cs.total_cost, 2)}s'))
+			self.reply_tr('creation_stats.phases', RTextBase.join(', ', [
+				RTextBase.format('{} {}', phase.name, TextComponents.number(f'{round(cost, 2)}s'))
+				for phase in BackupCreationPhase
+				if (cost := cs.get_phase_cost(phase)) is not None
+			]))
+			self.reply_tr('creation_stats.io', TextComponents.file_size(cs.bytes_read), TextComponents.file_size(cs.bytes_written))
+			self.reply_tr('creation_stats.blob', TextComponents.number(cs.blob_reused), TextComponents.number(cs.blob_created))
+			if cs.probe_hit + cs.probe_miss > 0:
+				self.reply_tr('creation_stats.probe', TextComponents.number(cs.probe_hit), TextComponents.file_size(cs.probe_hit_raw_size), TextComponents.number(cs.probe_miss))
+			if len(cs.policy_counts) > 0:
+				self.reply_tr('creation_stats.policy', RTextBase.join(', ', [
+					RTextBase.format('{} {}', name, TextComponents.number(cnt))
+					for name, cnt in cs.policy_counts.items()
+				]))
+
 		if len(backup.tags) > 0:
 			self.reply_tr('tag.title', TextComponents.number(len(backup.tags)))
 			for k, v in backup.tags.items():
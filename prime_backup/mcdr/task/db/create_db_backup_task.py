@@ -2,13 +2,16 @@ import tarfile
 import threading
 import time
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Callable
 
+from prime_backup.action.online_backup_sqlite_action import OnlineBackupSqliteAction
 from prime_backup.action.vacuum_sqlite_action import VacuumSqliteAction
+from prime_backup.config.database_config import DbBackupMethod
 from prime_backup.db import db_constants
 from prime_backup.mcdr.task.basic_task import HeavyTask
 from prime_backup.types.units import ByteCount
-from prime_backup.utils import misc_utils
+from prime_backup.utils import misc_utils, db_backup_utils
+from prime_backup.utils.db_backup_utils import PageHashManifest
 
 
 class CreateDbBackupTask(HeavyTask[None]):
@@ -18,31 +21,70 @@ class CreateDbBackupTask(HeavyTask[None]):
 	def id(self) -> str:
 		return 'db_backup'
 
+	def __compress_tar_xz(self, db_backup_root: Path, temp_db_path: Path) -> Path:
+		db_backup_file = db_backup_root / time.strftime('db_backup_%Y%m%d_%H%M%S.tar.xz')
+		self.logger.info('db backup: Compressing database backup {}'.format(db_backup_file.name))
+		with tarfile.open(db_backup_file, 'w:xz') as tar:
+			tar.add(temp_db_path, db_constants.DB_FILE_NAME)
+		return db_backup_file
+
+	def __compress_zstd(self, db_backup_root: Path, temp_db_path: Path) -> Path:
+		backup_config = self.config.database.backup
+		manifest_path = db_backup_root / 'page_hashes.manifest'
+
+		base: Optional[PageHashManifest] = None
+		if backup_config.incremental:
+			base = PageHashManifest.load_opt(manifest_path)
+			if base is None:
+				self.logger.info('db backup: No page hashes of the previous database backup, creating a full backup')
+			elif not (db_backup_root / base.backup_file_name).is_file():
+				self.logger.info('db backup: The previous database backup {} does not exist, creating a full backup'.format(base.backup_file_name))
+				base = None
+			elif base.chain_length >= backup_config.incremental_max_chain_length:
+				self.logger.info('db backup: Incremental backup chain length reached {}, creating a full backup'.format(base.chain_length))
+				base = None
+			elif base.page_size != db_backup_utils.get_sqlite_page_size(temp_db_path):
+				self.logger.info('db backup: Database page size changed, creating a full backup')
+				base = None
+
+		suffix = db_backup_utils.INCREMENTAL_BACKUP_SUFFIX if base is not None else db_backup_utils.FULL_BACKUP_SUFFIX
+		db_backup_file = db_backup_root / (time.strftime('db_backup_%Y%m%d_%H%M%S') + suffix)
+		self.logger.info('db backup: Compressing database backup {}{}'.format(db_backup_file.name, ' based on {}'.format(base.backup_file_name) if base is not None else ''))
+		result = db_backup_utils.write_db_backup(temp_db_path, db_backup_file, base=base, threads=self.config.get_effective_concurrency())
+		self.logger.info('db backup: Stored {} / {} pages'.format(result.written_page_count, result.page_count))
+
+		if backup_config.incremental:
+			result.manifest.save(manifest_path)
+		return db_backup_file
+
 	def run(self) -> Optional[threading.Thread]:
 		if not self.__task_sem.acquire(blocking=False):
 			self.logger.warning('Another {} is running, skipped'.format(self.__class__.__name__))
 			return None
 
 		try:
+			backup_config = self.config.database.backup
 			db_backup_root: Path = self.config.storage_path / 'db_backup'
 			temp_db_path = db_backup_root / 'temp.db'
 
-			self.logger.info('db backup: Vacuum database to {}'.format(temp_db_path.as_posix()))
 			if temp_db_path.is_file():
 				temp_db_path.unlink()
-			VacuumSqliteAction(temp_db_path).run()
+			compress_func: Callable[[Path, Path], Path]
+			if backup_config.method == DbBackupMethod.online:
+				self.logger.info('db backup: Copy database to {}'.format(temp_db_path.as_posix()))
+				OnlineBackupSqliteAction(temp_db_path, step_pages=backup_config.online_step_pages, step_sleep=backup_config.online_step_sleep.value).run()
+				compress_func = self.__compress_zstd
+			else:
+				self.logger.info('db backup: Vacuum database to {}'.format(temp_db_path.as_posix()))
+				VacuumSqliteAction(temp_db_path).run()
+				compress_func = self.__compress_tar_xz
 			db_size = temp_db_path.stat().st_size
-			self.logger.info('db backup: Vacuum database done, start a new thread for compressing')
+			self.logger.info('db backup: Database copy done, start a new thread for compressing')
 
-			def tar_thread():
+			def compress_thread():
 				try:
 					t = time.time()
-					db_backup_file = db_backup_root / time.strftime('db_backup_%Y%m%d_%H%M%S.tar.xz')
-
-					self.logger.info('db backup: Compressing database backup {}'.format(db_backup_file.name))
-					with tarfile.open(db_backup_file, 'w:xz') as tar:
-						tar.add(temp_db_path, db_constants.DB_FILE_NAME)
-
+					db_backup_file = compress_func(db_backup_root, temp_db_path)
 					backup_size = db_backup_file.stat().st_size
 					cost = time.time() - t
 					self.logger.info('db backup: Compress database backup done, path {!r}, cost {:.2f}s, size {} ({})'.format(
@@ -52,7 +94,7 @@ class CreateDbBackupTask(HeavyTask[None]):
 					self.__task_sem.release()
 					temp_db_path.unlink(missing_ok=True)
 
-			thread = threading.Thread(target=tar_thread, name=misc_utils.make_thread_name('db-backup'), daemon=True)
+			thread = threading.Thread(target=compress_thread, name=misc_utils.make_thread_name('db-backup'), daemon=True)
 			thread.start()
 			return thread
 
@@ -103,6 +103,7 @@ class InspectFileTask(_InspectObjectTaskBase):
 			self.reply_tr('content', self._jsonfy(file.content_str))
 		if file.blob is not None:
 			self.reply_tr('blob.hash', self._gt_blob_hash(file.blob.hash))
+			self.reply_tr('blob.storage_method', file.blob.storage_method.name)
 			self.reply_tr('blob.compress', file.blob.compress.name)
 			self.reply_tr('blob.raw_size', RText(file.blob.raw_size, TextColors.byte_count), TextComponents.file_size(file.blob.raw_size))
 			self.reply_tr('blob.stored_size', RText(file.blob.stored_size, TextColors.byte_count), TextComponents.file_size(file.blob.stored_size))
@@ -140,6 +141,7 @@ class InspectBlobTask(_InspectObjectTaskBase):
 		self.reply(TextComponents.title(self.tr('title', self._gt_blob_hash(blob.hash, shorten_hash=True))))
 
 		self.reply_tr('hash', self._gt_blob_hash(blob.hash))
+		self.reply_tr('storage_method', blob.storage_method.name)
 		self.reply_tr('compress', blob.compress.name)
 		self.reply_tr('raw_size', RText(blob.raw_size, TextColors.byte_count), TextComponents.file_size(blob.raw_size))
 		self.reply_tr('stored_size', RText(blob.stored_size, TextColors.byte_count), TextComponents.file_size(blob.stored_size))
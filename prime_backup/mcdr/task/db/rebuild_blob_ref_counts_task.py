@@ -0,0 +1,28 @@
+import time
+
+from prime_backup.action.delete_backup_action import DeleteOrphanBlobsAction
+from prime_backup.action.rebuild_blob_ref_counts_action import RebuildBlobRefCountsAction
+from prime_backup.mcdr.task.basic_task import HeavyTask
+from prime_backup.mcdr.text_components import TextComponents
+from prime_backup.types.blob_info import BlobListSummary
+
+
+class RebuildBlobRefCountsTask(HeavyTask[None]):
+	@property
+	def id(self) -> str:
+		return 'db_rebuild_ref_counts'
+
+	def run(self) -> None:
+		self.reply_tr('start')
+		t = time.time()
+		fixed_cnt = RebuildBlobRefCountsAction().run()
+		# blobs with wrong reference counts might actually be orphans
+		bls = DeleteOrphanBlobsAction(None).run() if fixed_cnt > 0 else BlobListSummary.zero()
+		cost = time.time() - t
+		self.reply_tr(
+			'done',
+			TextComponents.number(f'{cost:.2f}s'),
+			TextComponents.number(fixed_cnt),
+			TextComponents.number(bls.count),
+			TextComponents.blob_list_summary_store_size(bls),
+		)
@@ -0,0 +1,20 @@
+import time
+
+from prime_backup.action.reconcile_storage_stats_action import ReconcileStorageStatsAction
+from prime_backup.mcdr.task.basic_task import HeavyTask
+from prime_backup.mcdr.text_components import TextComponents
+
+
+class ReconcileStorageStatsTask(HeavyTask[None]):
+	@property
+	def id(self) -> str:
+		return 'db_reconcile_stats'
+
+	def run(self) -> None:
+		self.reply_tr('start')
+		t = time.time()
+		incorrect_fields = ReconcileStorageStatsAction().run()
+		cost = time.time() - t
+		for key, (stored_value, actual_value) in incorrect_fields.items():
+			self.reply_tr('fixed_field', key, TextComponents.number(stored_value), TextComponents.number(actual_value))
+		self.reply_tr('done', TextComponents.number(f'{cost:.2f}s'), TextComponents.number(len(incorrect_fields)))
@@ -24,3 +24,7 @@ class ShowDbOverviewTask(LightTask[None]):
 		self.reply_tr('blob_count', TextComponents.number(result.blob_count))
 		self.reply_tr('blob_stored_size', make_size(result.blob_stored_size_sum), TextComponents.percent(result.blob_stored_size_sum, result.blob_raw_size_sum))
 		self.reply_tr('blob_raw_size', make_size(result.blob_raw_size_sum))
+		if result.chunk_count > 0:
+			self.reply_tr('chunk_count', TextComponents.number(result.chunk_count))
+			self.reply_tr('chunk_stored_size', make_size(result.chunk_stored_size_sum), TextComponents.percent(result.chunk_stored_size_sum, result.chunk_raw_size_sum))
+			self.reply_tr('chunk_raw_size', make_size(result.chunk_raw_size_sum))
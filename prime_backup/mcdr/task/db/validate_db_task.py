@@ -9,6 +9,7 @@ from prime_backup.action import Action
 from prime_backup.action.get_object_counts_action import GetObjectCountsAction
 from prime_backup.action.validate_blobs_action import ValidateBlobsAction, BadBlobItem
 from prime_backup.action.validate_files_action import ValidateFilesAction, BadFileItem
+from prime_backup.mcdr.metrics_exporter import MetricsExporter
 from prime_backup.mcdr.task.basic_task import HeavyTask
 from prime_backup.mcdr.text_components import TextComponents
 from prime_backup.utils import log_utils
@@ -47,6 +48,8 @@ class ValidateDbTask(HeavyTask[None]):
 
 		vlogger.info('Validate blobs result: total={} validated={} ok={}'.format(result.total, result.validated, result.ok))
 		self.reply_tr('validate_blobs.done', TextComponents.number(result.validated), TextComponents.number(result.total))
+		if (exporter := MetricsExporter.get_opt()) is not None:
+			exporter.record_validation('blobs', result.validated, result.validated - result.ok)
 		if result.ok == result.validated:
 			self.reply(self.tr('validate_blobs.all_ok', TextComponents.number(result.validated)).set_color(RColor.green))
 			return
@@ -94,6 +97,8 @@ class ValidateDbTask(HeavyTask[None]):
 
 		vlogger.info('Validate files result: total={} validated={} ok={}'.format(result.total, result.validated, result.ok))
 		self.reply_tr('validate_files.done', TextComponents.number(result.validated), TextComponents.number(result.total))
+		if (exporter := MetricsExporter.get_opt()) is not None:
+			exporter.record_validation('files', result.validated, result.validated - result.ok)
 		if result.ok == result.validated:
 			self.reply(self.tr('validate_files.all_ok', TextComponents.number(result.validated)).set_color(RColor.green))
 			return
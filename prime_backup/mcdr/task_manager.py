@@ -3,6 +3,7 @@ import dataclasses
 import enum
 import sqlite3
 import threading
+import time
 from concurrent import futures
 from typing import Optional, Callable, Any, TypeVar
 
@@ -11,6 +12,7 @@ from sqlalchemy.exc import OperationalError
 
 from prime_backup import logger
 from prime_backup.exceptions import BackupNotFound, BackupFileNotFound, BlobNotFound, BlobHashNotUnique
+from prime_backup.mcdr.metrics_exporter import MetricsExporter
 from prime_backup.mcdr.task import TaskEvent, Task
 from prime_backup.mcdr.task.basic_task import HeavyTask, LightTask, ImmediateTask
 from prime_backup.mcdr.task_queue import TaskQueue, TaskHolder, TaskCallback
@@ -75,6 +77,8 @@ class _TaskWorker:
 
 	@classmethod
 	def run_task(cls, holder: TaskHolder) -> Optional[Exception]:
+		start_time = time.time()
+		ok = False
 		try:
 			ret = holder.task.run()
 		except Exception as e:
@@ -89,7 +93,11 @@ class _TaskWorker:
 			else:
 				reply_message(holder.source, tr('error.generic', holder.task_name()).set_color(RColor.red))
 		else:
+			ok = True
 			holder.on_done(ret, None)
+		finally:
+			if (exporter := MetricsExporter.get_opt()) is not None:
+				exporter.on_task_done(holder.task, time.time() - start_time, ok)
 
 	def __task_loop(self):
 		self.logger.info('Worker %s started', self.name)
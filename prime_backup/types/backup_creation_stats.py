@@ -0,0 +1,48 @@
+import dataclasses
+import enum
+from typing import Dict, Optional
+
+
+class BackupCreationPhase(enum.Enum):
+	scan = enum.auto()            # scan the files in the backup targets
+	pre_calculate = enum.auto()   # stat-based change detection, staged snapshot copying
+	hash = enum.auto()            # hash the files before the blob existence lookups. Worker thread time
+	lookup = enum.auto()          # query the database for the existence of blobs
+	compress_write = enum.auto()  # compress and write the blobs and chunks. Worker thread time
+	db_flush = enum.auto()        # insert the blobs and files into the database
+	db_commit = enum.auto()       # commit the database transaction
+
+
+@dataclasses.dataclass
+class BackupCreationStats:
+	"""
+	The time costs and the IO statistics of a backup creation
+
+	Notes: the :attr:`BackupCreationPhase.hash` and :attr:`BackupCreationPhase.compress_write` phases run in the worker threads,
+	their costs are the sum of the cost in each thread, so they might be larger than the total cost
+	"""
+	total_cost: float = 0  # in seconds
+	phase_costs: Dict[str, float] = dataclasses.field(default_factory=dict)  # phase name -> cost in seconds
+	file_count: int = 0
+	bytes_read: int = 0
+	bytes_written: int = 0
+	blob_reused: int = 0
+	blob_created: int = 0
+	policy_counts: Dict[str, int] = dataclasses.field(default_factory=dict)  # blob create policy name -> attempt count
+	probe_hit: int = 0  # amount of the probed files that are incompressible, which are stored without compression
+	probe_hit_raw_size: int = 0  # raw size sum of the probe hit files
+	probe_miss: int = 0  # amount of the probed files that are compressible, which are compressed as usual
+
+	def get_phase_cost(self, phase: BackupCreationPhase) -> Optional[float]:
+		return self.phase_costs.get(phase.name)
+
+	def to_dict(self) -> dict:
+		return {
+			'_version': 1,
+			**dataclasses.asdict(self),
+		}
+
+	@classmethod
+	def from_dict(cls, dt: dict) -> 'BackupCreationStats':
+		field_names = {field.name for field in dataclasses.fields(cls)}
+		return cls(**{k: v for k, v in dt.items() if k in field_names})
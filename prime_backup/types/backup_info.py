@@ -1,11 +1,12 @@
 import dataclasses
 import datetime
 import functools
-from typing import List, TYPE_CHECKING
+from typing import List, TYPE_CHECKING, Optional
 
 from typing_extensions import Self
 
 from prime_backup.db import schema
+from prime_backup.types.backup_creation_stats import BackupCreationStats
 from prime_backup.types.backup_tags import BackupTags
 from prime_backup.types.operator import Operator
 from prime_backup.utils import conversion_utils
@@ -29,6 +30,8 @@ class BackupInfo:
 
 	files: List['FileInfo']
 
+	creation_stats: Optional[BackupCreationStats] = None  # None for imported backups, or backups created before the stats were introduced
+
 	@functools.cached_property
 	def date(self) -> datetime.datetime:
 		return conversion_utils.timestamp_to_local_date(self.timestamp_ns)
@@ -38,9 +41,11 @@ class BackupInfo:
 		return conversion_utils.timestamp_to_local_date_str(self.timestamp_ns)
 
 	@classmethod
-	def of(cls, backup: schema.Backup, *, with_files: bool = False) -> 'Self':
+	def of(cls, backup: schema.Backup, *, files: Optional[List[schema.File]] = None) -> 'Self':
 		"""
 		Notes: should be inside a session
+
+		:param files: the effective files of the backup, see :meth:`prime_backup.db.session.DbSession.get_backup_files`
 		"""
 		from prime_backup.types.file_info import FileInfo
 		return cls(
@@ -52,5 +57,6 @@ class BackupInfo:
 			tags=BackupTags(backup.tags),
 			raw_size=backup.file_raw_size_sum or 0,
 			stored_size=backup.file_stored_size_sum or 0,
-			files=list(map(FileInfo.of, backup.files)) if with_files else [],
+			files=[FileInfo.of(file, backup_id=backup.id) for file in files] if files is not None else [],
+			creation_stats=BackupCreationStats.from_dict(backup.creation_stats) if backup.creation_stats is not None else None,
 		)
@@ -4,12 +4,14 @@ from typing import Iterable
 
 from prime_backup.compressors import CompressMethod
 from prime_backup.db import schema
+from prime_backup.types.blob_storage_method import BlobStorageMethod
 from prime_backup.utils import misc_utils
 
 
 @dataclasses.dataclass(frozen=True)
 class BlobInfo:
 	hash: str
+	storage_method: BlobStorageMethod
 	compress: CompressMethod
 	raw_size: int
 	stored_size: int
@@ -23,14 +25,24 @@ class BlobInfo:
 		"""
 		return BlobInfo(
 			hash=blob.hash,
+			storage_method=BlobStorageMethod[blob.storage_method],
 			compress=CompressMethod[blob.compress],
 			raw_size=blob.raw_size,
 			stored_size=blob.stored_size,
 			file_count=file_count,
 		)
 
+	def is_chunked(self) -> bool:
+		return self.storage_method == BlobStorageMethod.chunked
+
+	def is_packed(self) -> bool:
+		return self.storage_method == BlobStorageMethod.packed
+
 	@property
 	def blob_path(self) -> Path:
+		"""
+		Notes: only direct blobs have the blob file. For chunked blobs, see its chunks. For packed blobs, see table packed_blob
+		"""
 		from prime_backup.utils import blob_utils
 		return blob_utils.get_blob_path(self.hash)
 
@@ -0,0 +1,7 @@
+import enum
+
+
+class BlobStorageMethod(enum.Enum):
+	direct = enum.auto()   # the blob content is stored in a single blob file in the blob store
+	chunked = enum.auto()  # the blob content is split into chunks, stored in the chunk store
+	packed = enum.auto()   # the blob content is stored in a pack file in the pack store, together with other small blobs
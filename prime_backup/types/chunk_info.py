@@ -0,0 +1,48 @@
+import dataclasses
+from pathlib import Path
+from typing import Optional
+
+from prime_backup.compressors import CompressMethod
+from prime_backup.db import schema
+
+
+@dataclasses.dataclass(frozen=True)
+class ChunkInfo:
+	hash: str
+	compress: CompressMethod
+	raw_size: int
+	stored_size: int
+	pack_id: Optional[int]
+	pack_offset: Optional[int]
+
+	@classmethod
+	def of(cls, chunk: schema.Chunk) -> 'ChunkInfo':
+		"""
+		Notes: should be inside a session
+		"""
+		return ChunkInfo(
+			hash=chunk.hash,
+			compress=CompressMethod[chunk.compress],
+			raw_size=chunk.raw_size,
+			stored_size=chunk.stored_size,
+			pack_id=chunk.pack_id,
+			pack_offset=chunk.pack_offset,
+		)
+
+	def is_packed(self) -> bool:
+		return self.pack_id is not None
+
+	@property
+	def chunk_path(self) -> Path:
+		"""
+		Notes: only non-packed chunks have the chunk file. For packed chunks, see :meth:`pack_path`
+		"""
+		from prime_backup.utils import chunk_utils
+		return chunk_utils.get_chunk_path(self.hash)
+
+	@property
+	def pack_path(self) -> Path:
+		from prime_backup.utils import pack_utils
+		if self.pack_id is None:
+			raise ValueError('chunk {} is not packed'.format(self.hash))
+		return pack_utils.get_pack_path(self.pack_id)
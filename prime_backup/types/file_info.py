@@ -7,6 +7,7 @@ from typing import Optional
 from prime_backup.compressors import CompressMethod
 from prime_backup.db import schema
 from prime_backup.types.blob_info import BlobInfo
+from prime_backup.types.blob_storage_method import BlobStorageMethod
 
 
 class FileType(enum.Enum):
@@ -32,24 +33,30 @@ class FileInfo:
 	atime_ns: Optional[int] = None
 
 	@classmethod
-	def of(cls, file: schema.File) -> 'FileInfo':
+	def of(cls, file: schema.File, *, backup_id: Optional[int] = None) -> 'FileInfo':
 		"""
 		Notes: should be inside a session
+
+		:param backup_id: overrides the backup id of the file row, for files inherited from the base backup of a delta backup
 		"""
 		blob: Optional[BlobInfo] = None
 		if file.blob_hash is not None:
 			if file.blob_compress not in CompressMethod.__members__:
 				from prime_backup import logger
 				logger.get().warning('Bad blob_compress {!r} for file {!r}'.format(file.blob_compress, file))
+			elif file.blob_storage_method not in BlobStorageMethod.__members__:
+				from prime_backup import logger
+				logger.get().warning('Bad blob_storage_method {!r} for file {!r}'.format(file.blob_storage_method, file))
 			else:
 				blob = BlobInfo(
 					hash=str(file.blob_hash),
+					storage_method=BlobStorageMethod[file.blob_storage_method],
 					compress=CompressMethod[file.blob_compress],
 					raw_size=file.blob_raw_size,
 					stored_size=file.blob_stored_size,
 				)
 		return FileInfo(
-			backup_id=file.backup_id,
+			backup_id=backup_id if backup_id is not None else file.backup_id,
 			path=file.path,
 			mode=file.mode,
 			content=file.content,
@@ -0,0 +1,29 @@
+import dataclasses
+from pathlib import Path
+
+from prime_backup.db import schema
+
+
+@dataclasses.dataclass(frozen=True)
+class PackedBlobInfo:
+	blob_hash: str
+	pack_id: int
+	offset: int
+	length: int
+
+	@classmethod
+	def of(cls, packed_blob: schema.PackedBlob) -> 'PackedBlobInfo':
+		"""
+		Notes: should be inside a session
+		"""
+		return PackedBlobInfo(
+			blob_hash=packed_blob.blob_hash,
+			pack_id=packed_blob.pack_id,
+			offset=packed_blob.offset,
+			length=packed_blob.length,
+		)
+
+	@property
+	def pack_path(self) -> Path:
+		from prime_backup.utils import pack_utils
+		return pack_utils.get_pack_path(self.pack_id)
@@ -1,5 +1,11 @@
+import contextlib
+import io
 from pathlib import Path
-from typing import Iterator
+from typing import Iterator, Optional, Union, ContextManager, BinaryIO, TYPE_CHECKING
+
+if TYPE_CHECKING:
+	from prime_backup.compressors import CompressMethod
+	from prime_backup.types.packed_blob_info import PackedBlobInfo
 
 
 def get_blob_store() -> Path:
@@ -23,3 +29,22 @@ def iterate_blob_directories() -> Iterator[Path]:
 def prepare_blob_directories():
 	for p in iterate_blob_directories():
 		p.mkdir(parents=True, exist_ok=True)
+
+
+@contextlib.contextmanager
+def open_blob_decompressed(blob_hash: str, compress: Union[str, 'CompressMethod'], packed_blob: Optional['PackedBlobInfo'] = None) -> ContextManager[BinaryIO]:
+	"""
+	Open a non-chunked blob for reading its raw content.
+	Loose blobs are read from their blob files, packed blobs are read from the pack files
+
+	:param packed_blob: the location of the blob in the pack store, if it's a packed blob
+	"""
+	from prime_backup.compressors import Compressor
+	compressor = Compressor.create(compress)
+	if packed_blob is not None:
+		from prime_backup.utils import pack_utils
+		with compressor.decompress_stream(io.BytesIO(pack_utils.read_packed_blob(packed_blob))) as f:
+			yield f
+	else:
+		with compressor.open_decompressed(get_blob_path(blob_hash)) as f:
+			yield f
@@ -0,0 +1,279 @@
+import os
+import select
+import threading
+from pathlib import Path
+from typing import Optional, Set, Dict, Hashable, FrozenSet
+
+from prime_backup import logger
+from prime_backup.utils import misc_utils, inotify
+from prime_backup.utils.inotify import Inotify, InotifyEvent
+
+_WATCH_MASK = (
+		inotify.IN_MODIFY | inotify.IN_ATTRIB |
+		inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO |
+		inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF |
+		inotify.IN_ONLYDIR | inotify.IN_DONT_FOLLOW
+)
+_MAX_DIRTY_PATH_COUNT = 100000
+
+
+class ChangeJournal:
+	"""
+	Watches the backup targets with Linux inotify, and records the changed paths since the last backup,
+	so the backup creation only needs to re-scan the changed parts, and reuses the file list of the previous backup for the rest
+
+	The journal is relative to a "base" backup, i.e. the last backup whose scan started after all watches were set up.
+	It becomes unusable, which means a full scan is required, when:
+
+	- the journal is just started, e.g. after a plugin reload
+	- events are lost, e.g. the kernel event queue overflowed, or too many paths are changed
+	- a directory is moved, or a watched target is created / removed. All watches are set up again in this case
+	"""
+
+	class Snapshot:
+		"""
+		The changed paths since the base backup, taken at the beginning of a file scan
+		"""
+
+		def __init__(
+				self, *, usable: bool, ready: bool, overflowed: bool,
+				base_backup_id: Optional[int], base_scan_key: Optional[Hashable],
+				roots: FrozenSet[Path], dirty_paths: Set[Path], dirty_trees: Set[Path],
+		):
+			self.usable = usable
+			self.ready = ready  # if all watches were set up at the beginning of the scan
+			self.overflowed = overflowed
+			self.base_backup_id = base_backup_id
+			self.base_scan_key = base_scan_key
+			self.roots = roots
+			self.dirty_paths = dirty_paths  # paths whose stat or children list might be changed
+			self.dirty_trees = dirty_trees  # paths whose whole subtree might be changed
+
+		def is_clean(self, path: Path) -> bool:
+			"""
+			:return: if the stat of the given path, and the children list for directories, are unchanged since the base backup
+			"""
+			if not self.usable or path in self.dirty_paths:
+				return False
+			for p in (path, *path.parents):
+				if p in self.dirty_trees:
+					return False
+				if p in self.roots:
+					return True
+			return False
+
+	__inst: Optional['ChangeJournal'] = None
+
+	@classmethod
+	def get_opt(cls) -> Optional['ChangeJournal']:
+		return cls.__inst
+
+	def __init__(self, source_path: Path):
+		self.logger = logger.get()
+		self.source_path = source_path
+		self.__lock = threading.Lock()
+		self.__stop_event = threading.Event()
+		self.__thread = threading.Thread(target=self.__watch_loop, name=misc_utils.make_thread_name('change-journal'), daemon=True)
+
+		# accessed in the watcher thread only, or in begin_scan() when ready
+		self.__inotify: Optional[Inotify] = None
+		self.__watches: Dict[int, Path] = {}
+
+		# protected by the lock
+		self.__ready = False
+		self.__need_reset = True
+		self.__roots: FrozenSet[Path] = frozenset()
+		self.__overflowed = False
+		self.__dirty_paths: Set[Path] = set()
+		self.__dirty_trees: Set[Path] = set()
+		self.__base_backup_id: Optional[int] = None
+		self.__base_scan_key: Optional[Hashable] = None
+
+	@classmethod
+	def is_supported(cls) -> bool:
+		return inotify.is_supported()
+
+	def start(self):
+		cls = type(self)
+		if cls.__inst is not None:
+			raise ValueError('double initialization')
+		cls.__inst = self
+		self.__thread.start()
+
+	def shutdown(self):
+		cls = type(self)
+		if cls.__inst is self:
+			cls.__inst = None
+		self.__stop_event.set()
+		if self.__thread.is_alive():
+			self.__thread.join()
+		if self.__inotify is not None:
+			self.__inotify.close()
+			self.__inotify = None
+
+	def __get_roots(self) -> FrozenSet[Path]:
+		from prime_backup.config.config import Config
+		roots = set()
+		for target in Config.get().backup.targets:
+			path = self.source_path / target
+			if path.is_dir() and not path.is_symlink():
+				roots.add(path)
+		return frozenset(roots)
+
+	# ================================ Watcher ================================
+
+	def __invalidate(self, reason: str, *, need_reset: bool = False):
+		if not self.__overflowed:
+			self.logger.info('Change journal invalidated, the next backup will do a full scan: {}'.format(reason))
+		self.__overflowed = True
+		self.__dirty_paths.clear()
+		self.__dirty_trees.clear()
+		if need_reset:
+			self.__need_reset = True
+
+	def __add_watch_tree(self, root: Path):
+		stack = [root]
+		while len(stack) > 0:
+			path = stack.pop()
+			try:
+				wd = self.__inotify.add_watch(os.fsencode(path), _WATCH_MASK)
+			except (FileNotFoundError, NotADirectoryError):
+				continue
+			self.__watches[wd] = path
+			try:
+				with os.scandir(path) as it:
+					for entry in it:
+						if entry.is_dir(follow_symlinks=False):
+							stack.append(Path(entry.path))
+			except (FileNotFoundError, NotADirectoryError):
+				pass
+
+	def __reset_watches(self):
+		with self.__lock:
+			self.__ready = False
+			self.__need_reset = False
+			self.__overflowed = True  # events were not recorded before the watches are set up
+			self.__dirty_paths.clear()
+			self.__dirty_trees.clear()
+			roots = self.__roots = self.__get_roots()
+
+		if self.__inotify is not None:
+			self.__inotify.close()
+		self.__inotify = Inotify()
+		self.__watches.clear()
+		for root in roots:
+			self.__add_watch_tree(root)
+
+		with self.__lock:
+			self.__ready = True
+		self.logger.info('Change journal is watching {} directories in {} targets'.format(len(self.__watches), len(roots)))
+
+	def __on_event(self, event: InotifyEvent):
+		if event.mask & inotify.IN_Q_OVERFLOW:
+			self.__invalidate('inotify event queue overflowed')
+			return
+		if (dir_path := self.__watches.get(event.wd)) is None:
+			return
+		if event.mask & inotify.IN_IGNORED:
+			self.__watches.pop(event.wd, None)
+			return
+		if event.mask & (inotify.IN_MOVE_SELF | inotify.IN_UNMOUNT) or (event.mask & inotify.IN_DELETE_SELF and dir_path in self.__roots):
+			self.__invalidate('watched directory {!r} is moved or removed'.format(dir_path.as_posix()), need_reset=True)
+			return
+		if len(event.name) == 0:
+			self.__dirty_paths.add(dir_path)
+			return
+
+		path = dir_path / os.fsdecode(event.name)
+		if event.mask & inotify.IN_ISDIR:
+			if event.mask & (inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO):
+				# the moved watches are still bound to the old paths
+				self.__invalidate('directory {!r} is moved'.format(path.as_posix()), need_reset=True)
+				return
+			self.__dirty_trees.add(path)
+			self.__dirty_paths.add(dir_path)
+			if event.mask & inotify.IN_CREATE:
+				self.__add_watch_tree(path)
+		else:
+			self.__dirty_paths.add(path)
+			if event.mask & (inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO):
+				self.__dirty_paths.add(dir_path)
+
+		if len(self.__dirty_paths) + len(self.__dirty_trees) > _MAX_DIRTY_PATH_COUNT:
+			self.__invalidate('too many changed paths')
+
+	def __drain(self):
+		while len(events := self.__inotify.read_events()) > 0:
+			for event in events:
+				self.__on_event(event)
+
+	def __watch_loop(self):
+		while not self.__stop_event.is_set():
+			if self.__need_reset:
+				try:
+					self.__reset_watches()
+				except OSError as e:
+					self.logger.warning('Change journal setup failed, it is disabled until the next plugin reload. Is fs.inotify.max_user_watches too low? Error: {}'.format(e))
+					return
+
+			select.select([self.__inotify.fileno()], [], [], 1.0)
+			try:
+				with self.__lock:
+					self.__drain()
+			except OSError as e:
+				self.logger.warning('Change journal read events failed: {}'.format(e))
+				with self.__lock:
+					self.__invalidate('read events failed', need_reset=True)
+
+	# ============================== Scan APIs ==============================
+
+	def begin_scan(self, scan_key: Hashable) -> Snapshot:
+		"""
+		Take the changed paths since the base backup, and start recording the changes for the new backup.
+		The returned snapshot should be passed to :meth:`end_scan` after the backup creation, no matter if it succeeded
+
+		:param scan_key: a fingerprint of the scan settings, e.g. the ignore patterns. The snapshot is unusable if it differs from the base one
+		"""
+		with self.__lock:
+			if self.__ready and not self.__need_reset:
+				self.__drain()  # all changes happened before the scan should be in the snapshot
+				if self.__get_roots() != self.__roots:
+					self.__invalidate('backup targets changed', need_reset=True)
+
+			ready = self.__ready and not self.__need_reset
+			snapshot = self.Snapshot(
+				usable=ready and not self.__overflowed and self.__base_backup_id is not None and self.__base_scan_key == scan_key,
+				ready=ready,
+				overflowed=self.__overflowed,
+				base_backup_id=self.__base_backup_id,
+				base_scan_key=self.__base_scan_key,
+				roots=self.__roots,
+				dirty_paths=self.__dirty_paths,
+				dirty_trees=self.__dirty_trees,
+			)
+
+			self.__overflowed = not ready
+			self.__dirty_paths = set()
+			self.__dirty_trees = set()
+			self.__base_backup_id = None
+			self.__base_scan_key = None
+			return snapshot
+
+	def end_scan(self, snapshot: Snapshot, scan_key: Hashable, backup_id: Optional[int]):
+		"""
+		:param backup_id: the id of the created backup, or None if the backup creation failed
+		"""
+		with self.__lock:
+			if backup_id is not None:
+				if snapshot.ready:
+					self.__base_backup_id = backup_id
+					self.__base_scan_key = scan_key
+			else:
+				# the backup was not created, put the changes back
+				self.__base_backup_id = snapshot.base_backup_id
+				self.__base_scan_key = snapshot.base_scan_key
+				self.__overflowed |= snapshot.overflowed
+				self.__dirty_paths.update(snapshot.dirty_paths)
+				self.__dirty_trees.update(snapshot.dirty_trees)
+				if len(self.__dirty_paths) + len(self.__dirty_trees) > _MAX_DIRTY_PATH_COUNT:
+					self.__invalidate('too many changed paths')
@@ -0,0 +1,105 @@
+import contextlib
+import io
+from pathlib import Path
+from typing import Iterator, List, Optional, BinaryIO, ContextManager, TYPE_CHECKING
+
+if TYPE_CHECKING:
+	from prime_backup.types.chunk_info import ChunkInfo
+
+
+def get_chunk_store() -> Path:
+	from prime_backup.config.config import Config
+	return Config.get().chunks_path
+
+
+def get_chunk_path(h: str) -> Path:
+	if len(h) <= 2:
+		raise ValueError(f'hash {h!r} too short')
+
+	return get_chunk_store() / h[:2] / h
+
+
+def iterate_chunk_directories() -> Iterator[Path]:
+	chunk_store = get_chunk_store()
+	for i in range(0, 256):
+		yield chunk_store / hex(i)[2:].rjust(2, '0')
+
+
+def prepare_chunk_directories():
+	for p in iterate_chunk_directories():
+		p.mkdir(parents=True, exist_ok=True)
+
+
+@contextlib.contextmanager
+def open_chunk_decompressed(chunk: 'ChunkInfo') -> ContextManager[BinaryIO]:
+	"""
+	Open a chunk for reading its raw content.
+	Loose chunks are read from their chunk files, packed chunks are read from the pack files
+	"""
+	from prime_backup.compressors import Compressor
+	compressor = Compressor.create(chunk.compress)
+	if chunk.is_packed():
+		from prime_backup.utils import pack_utils
+		with compressor.decompress_stream(io.BytesIO(pack_utils.read_packed_chunk(chunk))) as f:
+			yield f
+	else:
+		with compressor.open_decompressed(chunk.chunk_path) as f:
+			yield f
+
+
+class ChunkListReader:
+	"""
+	A read-only stream that decompresses and concatenates the given chunks in order
+	"""
+
+	def __init__(self, chunks: List['ChunkInfo']):
+		self.__chunks = chunks
+		self.__chunk_idx = 0
+		self.__exit_stack = contextlib.ExitStack()
+		self.__stream: Optional[BinaryIO] = None
+
+	def __next_stream(self) -> Optional[BinaryIO]:
+		self.__exit_stack.close()
+		self.__stream = None
+		if self.__chunk_idx < len(self.__chunks):
+			chunk = self.__chunks[self.__chunk_idx]
+			self.__chunk_idx += 1
+			self.__stream = self.__exit_stack.enter_context(open_chunk_decompressed(chunk))
+		return self.__stream
+
+	def read(self, n: int = -1) -> bytes:
+		if n is None or n < 0:
+			bufs = []
+			while (buf := self.read(1024 * 1024)) != b'':
+				bufs.append(buf)
+			return b''.join(bufs)
+
+		# keep reading until n bytes are read or EOF is reached, since some readers (e.g. tarfile) treat short reads as EOF
+		bufs = []
+		if self.__stream is None and self.__next_stream() is None:
+			return b''
+		while n > 0:
+			buf = self.__stream.read(n)
+			if len(buf) > 0:
+				bufs.append(buf)
+				n -= len(buf)
+			elif self.__next_stream() is None:
+				break
+		return b''.join(bufs)
+
+	def close(self):
+		self.__exit_stack.close()
+		self.__stream = None
+		self.__chunk_idx = len(self.__chunks)
+
+
+@contextlib.contextmanager
+def open_chunks_decompressed(chunks: List['ChunkInfo']) -> ContextManager[BinaryIO]:
+	"""
+	chunks --[decompress]--[concat]--> (reader)
+	"""
+	reader = ChunkListReader(chunks)
+	try:
+		yield reader
+	finally:
+		reader.close()
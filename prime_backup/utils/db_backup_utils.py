@@ -0,0 +1,223 @@
+import dataclasses
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Optional, BinaryIO, Iterator, List, Tuple
+
+FULL_BACKUP_SUFFIX = '.db.zst'
+INCREMENTAL_BACKUP_SUFFIX = '.pages.zst'
+
+_PAGES_FORMAT = 'prime_backup_db_pages'
+_PAGES_FORMAT_VERSION = 1
+_PAGE_HASH_SIZE = 8
+_UINT32 = struct.Struct('>I')
+
+
+def get_sqlite_page_size(db_path: Path) -> int:
+	# https://www.sqlite.org/fileformat.html#page_size
+	with open(db_path, 'rb') as f:
+		header = f.read(100)
+	if len(header) < 100 or not header.startswith(b'SQLite format 3\x00'):
+		raise ValueError('{!r} is not a SQLite database file'.format(db_path.as_posix()))
+	page_size = int.from_bytes(header[16:18], 'big')
+	return 65536 if page_size == 1 else page_size
+
+
+def _iterate_pages(db_path: Path, page_size: int) -> Iterator[bytes]:
+	with open(db_path, 'rb') as f:
+		while len(page := f.read(page_size)) > 0:
+			yield page
+
+
+def _hash_page(page: bytes) -> bytes:
+	import xxhash
+	return xxhash.xxh3_64_digest(page)
+
+
+@dataclasses.dataclass(frozen=True)
+class PageHashManifest:
+	"""
+	Page hashes of the database content in the latest database backup.
+	The next incremental database backup only stores the pages whose hash differs from it
+	"""
+	backup_file_name: str
+	chain_length: int  # amount of incremental backups since the full backup, 0 if the backup itself is a full backup
+	page_size: int
+	page_hashes: bytes
+
+	def get_page_hash(self, page_index: int) -> Optional[bytes]:
+		if (page_index + 1) * _PAGE_HASH_SIZE > len(self.page_hashes):
+			return None
+		return self.page_hashes[page_index * _PAGE_HASH_SIZE:(page_index + 1) * _PAGE_HASH_SIZE]
+
+	@classmethod
+	def load_opt(cls, path: Path) -> Optional['PageHashManifest']:
+		"""
+		:return: None if the manifest file does not exist
+		"""
+		if not path.is_file():
+			return None
+		with open(path, 'rb') as f:
+			header = json.loads(_read_exactly(f, _UINT32.unpack(_read_exactly(f, _UINT32.size))[0]))
+			return cls(
+				backup_file_name=header['backup_file_name'],
+				chain_length=header['chain_length'],
+				page_size=header['page_size'],
+				page_hashes=f.read(),
+			)
+
+	def save(self, path: Path):
+		header = json.dumps({
+			'backup_file_name': self.backup_file_name,
+			'chain_length': self.chain_length,
+			'page_size': self.page_size,
+		}).encode('utf8')
+		temp_path = path.parent / (path.name + '.tmp')
+		with open(temp_path, 'wb') as f:
+			f.write(_UINT32.pack(len(header)))
+			f.write(header)
+			f.write(self.page_hashes)
+		os.replace(temp_path, path)
+
+
+def _read_exactly(f: BinaryIO, n: int) -> bytes:
+	buf = f.read(n)
+	while 0 < len(buf) < n and len(more := f.read(n - len(buf))) > 0:  # stream readers might return less data than requested
+		buf += more
+	if len(buf) != n:
+		raise EOFError('expect {} bytes, read {}'.format(n, len(buf)))
+	return buf
+
+
+def _open_zstd_writer(f: BinaryIO, threads: int):
+	import zstandard
+	# threads=0 means compressing in the caller thread, and a positive value means the amount of the worker threads
+	cctx = zstandard.ZstdCompressor(threads=threads if threads > 1 else 0)
+	return cctx.stream_writer(f, closefd=False)
+
+
+def _open_zstd_reader(f: BinaryIO):
+	import zstandard
+	return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=False)
+
+
+@dataclasses.dataclass(frozen=True)
+class DbBackupWriteResult:
+	manifest: PageHashManifest
+	page_count: int
+	written_page_count: int
+
+
+def write_db_backup(db_path: Path, output_path: Path, *, base: Optional[PageHashManifest], threads: int) -> DbBackupWriteResult:
+	"""
+	Compress the given database file into a zstd compressed file in a single pass
+
+	:param db_path: a database file that is not being modified, e.g. a copy of the database
+	:param output_path: its file name should end with :data:`FULL_BACKUP_SUFFIX` or :data:`INCREMENTAL_BACKUP_SUFFIX`
+	:param base: the manifest of the previous database backup. If given, an incremental backup is written,
+		which only contains the pages that are changed since the previous database backup
+	:param threads: amount of the zstd worker threads
+	"""
+	page_size = get_sqlite_page_size(db_path)
+	if base is not None and base.page_size != page_size:
+		raise ValueError('page size mismatch, base {}, current {}'.format(base.page_size, page_size))
+
+	incremental = base is not None
+	page_count = os.path.getsize(db_path) // page_size
+	page_hashes = bytearray()
+	written_page_count = 0
+	temp_path = output_path.parent / (output_path.name + '.tmp')
+	try:
+		with open(temp_path, 'wb') as f, _open_zstd_writer(f, threads) as writer:
+			if incremental:
+				header = json.dumps({
+					'format': _PAGES_FORMAT,
+					'version': _PAGES_FORMAT_VERSION,
+					'base': base.backup_file_name,
+					'page_size': page_size,
+					'page_count': page_count,
+				}).encode('utf8')
+				writer.write(_UINT32.pack(len(header)))
+				writer.write(header)
+
+			for i, page in enumerate(_iterate_pages(db_path, page_size)):
+				page_hash = _hash_page(page)
+				page_hashes += page_hash
+				if not incremental:
+					writer.write(page)
+					written_page_count += 1
+				elif base.get_page_hash(i) != page_hash:
+					writer.write(_UINT32.pack(i))
+					writer.write(page)
+					written_page_count += 1
+		os.replace(temp_path, output_path)
+	finally:
+		temp_path.unlink(missing_ok=True)
+
+	return DbBackupWriteResult(
+		manifest=PageHashManifest(
+			backup_file_name=output_path.name,
+			chain_length=base.chain_length + 1 if incremental else 0,
+			page_size=page_size,
+			page_hashes=bytes(page_hashes),
+		),
+		page_count=page_count,
+		written_page_count=written_page_count,
+	)
+
+
+def _read_incremental_header(f: BinaryIO) -> dict:
+	header = json.loads(_read_exactly(f, _UINT32.unpack(_read_exactly(f, _UINT32.size))[0]))
+	if header.get('format') != _PAGES_FORMAT or header.get('version') != _PAGES_FORMAT_VERSION:
+		raise ValueError('unsupported incremental database backup format {!r} version {!r}'.format(header.get('format'), header.get('version')))
+	return header
+
+
+def get_db_backup_chain(backup_path: Path) -> List[Path]:
+	"""
+	:return: the database backup files needed to restore the given backup, starting from the full backup
+	"""
+	chain: List[Path] = []
+	path = backup_path
+	while path.name.endswith(INCREMENTAL_BACKUP_SUFFIX):
+		if path in chain:
+			raise ValueError('circular database backup chain at {!r}'.format(path.as_posix()))
+		chain.append(path)
+		with open(path, 'rb') as f, _open_zstd_reader(f) as reader:
+			path = path.parent / _read_incremental_header(reader)['base']
+		if not path.is_file():
+			raise FileNotFoundError('the base database backup {!r} of {!r} does not exist'.format(path.as_posix(), chain[-1].as_posix()))
+	if not path.name.endswith(FULL_BACKUP_SUFFIX):
+		raise ValueError('unknown database backup file {!r}'.format(path.as_posix()))
+	chain.append(path)
+	chain.reverse()
+	return chain
+
+
+def restore_db_backup(backup_path: Path, output_path: Path) -> Tuple[int, int]:
+	"""
+	Restore a database backup created by :func:`write_db_backup` into a database file.
+	For an incremental backup, all backups in its chain are needed, see :func:`get_db_backup_chain`
+
+	:return: a tuple of (amount of the backup files used, page count of the restored database)
+	"""
+	chain = get_db_backup_chain(backup_path)
+	with open(output_path, 'wb') as f_out:
+		with open(chain[0], 'rb') as f, _open_zstd_reader(f) as reader:
+			while len(buf := reader.read(1024 * 1024)) > 0:
+				f_out.write(buf)
+
+		for path in chain[1:]:
+			with open(path, 'rb') as f, _open_zstd_reader(f) as reader:
+				header = _read_incremental_header(reader)
+				page_size, page_count = header['page_size'], header['page_count']
+				while len(buf := reader.read(_UINT32.size)) > 0:
+					if len(buf) < _UINT32.size:
+						buf += _read_exactly(reader, _UINT32.size - len(buf))
+					page_index = _UINT32.unpack(buf)[0]
+					f_out.seek(page_index * page_size)
+					f_out.write(_read_exactly(reader, page_size))
+			f_out.truncate(page_count * page_size)
+
+	return len(chain), output_path.stat().st_size // get_sqlite_page_size(output_path)
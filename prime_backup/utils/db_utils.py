@@ -1,24 +1,22 @@
+import contextlib
 import sqlite3
-
-
-def check_sqlite_json_query_support() -> bool:
-	try:
-		with sqlite3.connect(':memory:') as conn:
-			cursor = conn.cursor()
-			cursor.execute('SELECT JSON(\'{"a": "b"}\')')
-			cursor.fetchone()
-			cursor.close()
-	except sqlite3.OperationalError:
-		return False
-	else:
-		return True
+import sys
 
 
 def check_sqlite_vacuum_into_support() -> bool:
 	return sqlite3.sqlite_version_info >= (3, 27, 0)
 
 
+def get_sqlite_max_variable_number() -> int:
+	# https://www.sqlite.org/limits.html#max_variable_number
+	if sys.version_info >= (3, 11):
+		with contextlib.closing(sqlite3.connect(':memory:')) as conn:
+			return conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+	# the default value, which is increased from 999 to 32766 in 3.32.0
+	return 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+
 if __name__ == '__main__':
 	print('version:', sqlite3.sqlite_version)
-	print('json query:', check_sqlite_json_query_support())
 	print('vacuum into:', check_sqlite_vacuum_into_support())
+	print('max variable number:', get_sqlite_max_variable_number())
@@ -0,0 +1,117 @@
+import ctypes
+import ctypes.util
+import dataclasses
+import errno
+import os
+import struct
+import sys
+from typing import Optional, List
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o4000
+
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+_READ_SIZE = 64 * 1024
+
+
+@dataclasses.dataclass(frozen=True)
+class InotifyEvent:
+	wd: int
+	mask: int
+	cookie: int
+	name: bytes  # empty for the events of the watched directory itself
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+	if not sys.platform.startswith('linux'):
+		return None
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		_ = libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+	except (OSError, AttributeError):
+		return None
+	return libc
+
+
+_libc = _load_libc()
+
+
+def is_supported() -> bool:
+	return _libc is not None
+
+
+def _raise_errno(what: str):
+	err = ctypes.get_errno()
+	raise OSError(err, '{}: {}'.format(what, os.strerror(err)))
+
+
+class Inotify:
+	"""
+	A minimal non-blocking Linux inotify binding with ctypes
+	"""
+
+	def __init__(self):
+		if _libc is None:
+			raise OSError(errno.ENOSYS, 'inotify is not supported on this platform')
+		fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+		if fd < 0:
+			_raise_errno('inotify_init1')
+		self.__fd: int = fd
+
+	def fileno(self) -> int:
+		return self.__fd
+
+	def add_watch(self, path: bytes, mask: int) -> int:
+		wd = _libc.inotify_add_watch(self.__fd, path, ctypes.c_uint32(mask))
+		if wd < 0:
+			_raise_errno('inotify_add_watch {!r}'.format(path))
+		return wd
+
+	def rm_watch(self, wd: int):
+		if _libc.inotify_rm_watch(self.__fd, wd) < 0:
+			_raise_errno('inotify_rm_watch {}'.format(wd))
+
+	def read_events(self) -> List[InotifyEvent]:
+		"""
+		:return: the pending events, an empty list if there's nothing to read
+		"""
+		try:
+			buf = os.read(self.__fd, _READ_SIZE)
+		except BlockingIOError:
+			return []
+
+		events = []
+		offset = 0
+		while offset + _EVENT_HEADER.size <= len(buf):
+			wd, mask, cookie, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+			offset += _EVENT_HEADER.size
+			name = buf[offset:offset + name_len].rstrip(b'\0')
+			offset += name_len
+			events.append(InotifyEvent(wd, mask, cookie, name))
+		return events
+
+	def close(self):
+		if self.__fd >= 0:
+			os.close(self.__fd)
+			self.__fd = -1
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
@@ -0,0 +1,156 @@
+from pathlib import Path
+from typing import Iterator, Tuple, Optional, BinaryIO, Dict, Collection, TYPE_CHECKING
+
+if TYPE_CHECKING:
+	from prime_backup.db.session import DbSession
+	from prime_backup.types.chunk_info import ChunkInfo
+	from prime_backup.types.packed_blob_info import PackedBlobInfo
+
+_PACK_FILE_SUFFIX = '.pack'
+
+
+def get_pack_store() -> Path:
+	from prime_backup.config.config import Config
+	return Config.get().packs_path
+
+
+def get_pack_path(pack_id: int) -> Path:
+	return get_pack_store() / f'{pack_id}{_PACK_FILE_SUFFIX}'
+
+
+def iterate_pack_files() -> Iterator[Tuple[int, Path]]:
+	"""
+	:return: an iterator of (pack id, pack path) of all pack files in the pack store
+	"""
+	pack_store = get_pack_store()
+	if not pack_store.is_dir():
+		return
+	for path in pack_store.iterdir():
+		if path.name.endswith(_PACK_FILE_SUFFIX) and (stem := path.name[:-len(_PACK_FILE_SUFFIX)]).isdigit():
+			yield int(stem), path
+
+
+def prepare_pack_directory():
+	get_pack_store().mkdir(parents=True, exist_ok=True)
+
+
+def read_pack_data(pack_id: int, offset: int, length: int) -> bytes:
+	with open(get_pack_path(pack_id), 'rb') as f:
+		f.seek(offset)
+		data = f.read(length)
+	if len(data) != length:
+		raise EOFError('pack {} is truncated, expect {} bytes at offset {}, read {}'.format(pack_id, length, offset, len(data)))
+	return data
+
+
+def read_packed_blob(packed_blob: 'PackedBlobInfo') -> bytes:
+	"""
+	Read the stored data of the packed blob, i.e. the compressed blob content
+	"""
+	return read_pack_data(packed_blob.pack_id, packed_blob.offset, packed_blob.length)
+
+
+def read_packed_chunk(chunk: 'ChunkInfo') -> bytes:
+	"""
+	Read the stored data of the packed chunk, i.e. the compressed chunk content
+	"""
+	if chunk.pack_id is None or chunk.pack_offset is None:
+		raise ValueError('chunk {} is not packed'.format(chunk.hash))
+	return read_pack_data(chunk.pack_id, chunk.pack_offset, chunk.stored_size)
+
+
+class PackWriter:
+	"""
+	Appends the stored data of blobs and chunks to pack files, and keeps the sizes in the related :class:`prime_backup.db.schema.Pack` rows updated
+
+	It's not thread-safe, and should only be used in the thread that owns the session.
+	If the session is not going to be committed, :meth:`rollback` should be called to cut off the written data
+	"""
+
+	def __init__(self, session: 'DbSession', max_pack_size: int, *, excluded_pack_ids: Collection[int] = ()):
+		self.__session = session
+		self.__max_pack_size = max_pack_size
+		self.__excluded_pack_ids = set(excluded_pack_ids)
+		self.__pack_id: Optional[int] = None
+		self.__pack_size = 0
+		self.__file: Optional[BinaryIO] = None
+		self.__original_sizes: Dict[int, Optional[int]] = {}  # pack id -> size before the writing, None for new packs
+		self.__latest_pack_checked = False
+
+	def __open_latest_pack(self, data_len: int) -> bool:
+		pack = self.__session.get_latest_pack_opt()
+		if pack is None or pack.id in self.__excluded_pack_ids or pack.size + data_len > self.__max_pack_size:
+			return False
+		try:
+			f = open(get_pack_path(pack.id), 'r+b')
+		except FileNotFoundError:
+			return False
+
+		# cut off the leftovers of the interrupted writes
+		f.truncate(pack.size)
+		f.seek(pack.size)
+		self.__original_sizes[pack.id] = pack.size
+		self.__pack_id, self.__pack_size, self.__file = pack.id, pack.size, f
+		return True
+
+	def __open_pack(self, data_len: int):
+		if not self.__latest_pack_checked:
+			self.__latest_pack_checked = True
+			if self.__open_latest_pack(data_len):
+				return
+
+		pack = self.__session.create_pack(size=0)
+		self.__original_sizes[pack.id] = None
+		self.__file = open(get_pack_path(pack.id), 'wb')
+		self.__pack_id, self.__pack_size = pack.id, 0
+
+	def __close_file(self):
+		if self.__file is not None:
+			self.__file.close()
+			self.__file = None
+		self.__pack_id = None
+
+	def write(self, data: bytes) -> Tuple[int, int]:
+		"""
+		:return: a tuple (pack id, offset)
+		"""
+		if self.__pack_id is not None and self.__pack_size > 0 and self.__pack_size + len(data) > self.__max_pack_size:
+			self.__close_file()
+		if self.__pack_id is None:
+			self.__open_pack(len(data))
+
+		offset = self.__pack_size
+		self.__file.write(data)
+		self.__pack_size += len(data)
+
+		# the pack object might be expunged from the session, so get it every time
+		pack = self.__session.get_pack_opt(self.__pack_id)
+		pack.size = self.__pack_size
+		return self.__pack_id, offset
+
+	def get_written_pack_ids(self) -> Collection[int]:
+		return self.__original_sizes.keys()
+
+	def close(self):
+		self.__close_file()
+
+	def rollback(self):
+		from prime_backup import logger
+		self.__close_file()
+		for pack_id, original_size in self.__original_sizes.items():
+			pack_path = get_pack_path(pack_id)
+			try:
+				if original_size is None:
+					pack_path.unlink(missing_ok=True)
+				else:
+					with open(pack_path, 'r+b') as f:
+						f.truncate(original_size)
+			except OSError as e:
+				logger.get().error('(rollback) restore pack file {!r} failed: {}'.format(pack_path, e))
+		self.__original_sizes.clear()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
@@ -0,0 +1,78 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Optional
+
+from prime_backup.compressors import Compressor, CompressMethod
+from prime_backup.types.hash_method import HashMethod
+from prime_backup.utils.path_like import PathLike
+
+
+def _copy_compressed(compress_method: str, source_path: PathLike, dest_path: PathLike, calc_hash: bool, hash_method: str) -> Compressor.CopyCompressResult:
+	compressor = Compressor.create(compress_method)
+	return compressor.copy_compressed(source_path, dest_path, calc_hash=calc_hash, hash_method=HashMethod[hash_method])
+
+
+def _copy_recompressed(compress_method: str, source_path: PathLike, dest_path: PathLike, source_method: str) -> Compressor.CopyCompressResult:
+	compressor = Compressor.create(compress_method)
+	return compressor.copy_recompressed(source_path, dest_path, CompressMethod[source_method])
+
+
+class CompressProcessPool:
+	"""
+	Compresses files in worker processes, so the compression is not limited by the GIL of the current process.
+	Only the file paths are sent to the workers, the file content never goes through the inter-process pipes
+
+	The "spawn" start method is used, since forking a process with a living database connection and lots of threads is unsafe
+	"""
+
+	def __init__(self, max_workers: int):
+		self.__executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+	@classmethod
+	def create_from_config(cls) -> Optional['CompressProcessPool']:
+		"""
+		:return: None if the process pool is disabled in the config
+		"""
+		from prime_backup.config.config import Config
+		pool_size = Config.get().backup.compress_process_pool_size
+		if pool_size <= 0:
+			return None
+		return cls(pool_size)
+
+	@classmethod
+	def should_use(cls, compress_method: CompressMethod) -> bool:
+		# there's nothing to compress for plain, and the data copy itself releases the GIL
+		# zstd_dict needs to load dictionaries from the database, which is unavailable in the workers
+		return compress_method not in (CompressMethod.plain, CompressMethod.zstd_dict)
+
+	def submit_copy_compressed(
+			self, compress_method: CompressMethod, source_path: PathLike, dest_path: PathLike, *,
+			calc_hash: bool = False, hash_method: Optional[HashMethod] = None,
+	) -> 'Future[Compressor.CopyCompressResult]':
+		"""
+		See :meth:`prime_backup.compressors.Compressor.copy_compressed`
+		"""
+		if hash_method is None:
+			from prime_backup.db.access import DbAccess
+			hash_method = DbAccess.get_hash_method()
+		return self.__executor.submit(_copy_compressed, compress_method.name, source_path, dest_path, calc_hash, hash_method.name)
+
+	def copy_compressed(self, compress_method: CompressMethod, source_path: PathLike, dest_path: PathLike, **kwargs) -> Compressor.CopyCompressResult:
+		return self.submit_copy_compressed(compress_method, source_path, dest_path, **kwargs).result()
+
+	def submit_copy_recompressed(
+			self, compress_method: CompressMethod, source_path: PathLike, dest_path: PathLike, source_method: CompressMethod,
+	) -> 'Future[Compressor.CopyCompressResult]':
+		"""
+		See :meth:`prime_backup.compressors.Compressor.copy_recompressed`
+		"""
+		return self.__executor.submit(_copy_recompressed, compress_method.name, source_path, dest_path, source_method.name)
+
+	def shutdown(self):
+		self.__executor.shutdown(wait=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.shutdown()
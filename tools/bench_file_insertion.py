@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from prime_backup.config.config import Config, set_config_instance
+from prime_backup.db import schema
+from prime_backup.db.access import DbAccess
+from prime_backup.db.session import DbSession
+
+args: argparse.Namespace
+
+
+def prepare_files(session: DbSession, mode: str, count: int) -> List[schema.File]:
+	"""
+	Create the blob, the backup and the paths for the files, and return the transient file objects to insert
+	"""
+	blob = session.create_blob(hash='bench_' + mode, storage_method='direct', compress='plain', raw_size=1, stored_size=1)
+	backup = session.create_backup(creator='bench:' + mode, comment='', targets=[], tags={})
+	session.flush()
+
+	paths = [f'{mode}/{i // 1000}/{i}.dat' for i in range(count)]
+	path_ids = session.get_or_create_path_ids(paths)
+	return [
+		session.create_file(
+			add_to_session=False, blob=blob, backup_id=backup.id, path_id=path_ids[path],
+			mode=0o100644, uid=0, gid=0, ctime_ns=1, mtime_ns=1, atime_ns=1,
+		)
+		for path in paths
+	]
+
+
+def insert_files(mode: str, files: List[schema.File]) -> float:
+	"""
+	:return: the time cost of the insertion and the commit, in seconds
+	"""
+	start = time.time()
+	with DbAccess.open_session() as session:
+		if mode == 'orm':
+			for file in files:
+				session.add(file)
+		elif mode == 'bulk':
+			session.bulk_insert(files)
+		else:
+			raise ValueError(mode)
+		session.flush()
+	return time.time() - start
+
+
+def main():
+	global args
+	parser = argparse.ArgumentParser(
+		description='Benchmark the insertion speed of file rows, with the ORM unit of work and with DbSession.bulk_insert',
+		formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+	)
+	parser.add_argument('-n', '--count', type=int, default=200000, help='Amount of the file rows to insert in each mode')
+	parser.add_argument('-m', '--mode', choices=['orm', 'bulk'], nargs='+', default=['orm', 'bulk'], help='The insertion modes to benchmark')
+	parser.add_argument('-t', '--temp', help='Path for placing the benchmark database. If not provided, a temp directory will be used')
+	args = parser.parse_args()
+
+	temp_root = Path(args.temp) if args.temp is not None else Path(tempfile.mkdtemp(prefix='pb_bench_'))
+	config = Config.get_default()
+	config.storage_root = str(temp_root)
+	set_config_instance(config)
+
+	DbAccess.init(create=True, migrate=True)
+	try:
+		for mode in args.mode:
+			with DbAccess.open_session() as session:
+				files = prepare_files(session, mode, args.count)
+			cost = insert_files(mode, files)
+			print(f'{mode}: {args.count} rows in {cost:.2f}s, {args.count / cost:.0f} rows/s')
+	finally:
+		DbAccess.shutdown()
+		if args.temp is None:
+			shutil.rmtree(temp_root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+	main()